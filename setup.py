@@ -33,7 +33,7 @@ setup(
     install_requires=[
         'ralph>=2.0.0rc1',
         'django-mptt==0.5.5',
-        'xlrd==0.9.2',
+        'openpyxl==2.3.5',
         'inkpy==0.0.1-alpha',
     ],
     entry_points={
@@ -6,8 +6,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from django.db.models import Q
+from ralph.discovery.models_device import Device
 
-from ralph_assets.models_assets import Asset, Warehouse
+from ralph_assets.deprecation import bulk_is_deprecated
+from ralph_assets.models_assets import Asset, AssetType, Warehouse
+from ralph_assets.models_util import iterate_in_chunks
+
+
+CHUNK_SIZE = 1000
 
 
 def get_warehouses():
@@ -19,47 +25,88 @@ def get_warehouses():
         }
 
 
-def get_assets(date):
+def _get_ralph_devices(assets):
+    """Returns a dict of Ralph devices linked to *assets*, keyed by their id.
+
+    Ventures and processors are loaded along with the devices, so reading
+    ``venture`` and ``get_core_count()`` from them costs no extra queries.
+    """
+    ralph_ids = [
+        asset.device_info.ralph_device_id for asset in assets
+        if asset.device_info and asset.device_info.ralph_device_id
+    ]
+    if not ralph_ids:
+        return {}
+    return Device.objects.select_related('venture').prefetch_related(
+        'processor_set__model',
+    ).in_bulk(ralph_ids)
+
+
+def _get_deprecation_flags(assets, date=None):
+    return bulk_is_deprecated(
+        [asset.invoice_date for asset in assets],
+        [asset.deprecation_rate for asset in assets],
+        [asset.force_deprecation for asset in assets],
+        date,
+    )
+
+
+def get_assets(date, chunk_size=CHUNK_SIZE):
     """Yields dicts describing all assets"""
-    for asset in Asset.objects_dc.filter(
+    queryset = Asset.objects_dc.select_related(
+        'model', 'category', 'device_info',
+    ).filter(
         Q(invoice_date=None) | Q(invoice_date__lte=date),
         part_info=None,
-    ):
-        device_info = asset.device_info
-
-        venture_info = asset.venture
-        yield {
-            'asset_id': asset.id,
-            'barcode': asset.barcode,
-            'is_deprecated': asset.is_deprecated(date=date),
-            'price': asset.price,
-            'ralph_id': device_info.ralph_device_id if device_info else None,
-            'slots': asset.slots,
-            'sn': asset.sn,
-            'price': asset.price,
-            'deprecation_rate': asset.deprecation_rate,
-            'power_consumption': asset.model.power_consumption,
-            'height_of_device': asset.model.height_of_device,
-            'warehouse_id': asset.warehouse_id,
-            'venture_id': venture_info.id if venture_info else None,
-            'is_blade': asset.category.is_blade if asset.category else None,
-            'cores_count': asset.cores_count,
-        }
+    )
+    for assets in iterate_in_chunks(queryset, chunk_size):
+        devices = _get_ralph_devices(assets)
+        deprecation_flags = _get_deprecation_flags(assets, date)
+        for asset, is_deprecated in zip(assets, deprecation_flags):
+            device_info = asset.device_info
+            ralph_id = device_info.ralph_device_id if device_info else None
+            device = devices.get(ralph_id)
+            venture_info = device.venture if device else None
+            category = asset.category
+            yield {
+                'asset_id': asset.id,
+                'barcode': asset.barcode,
+                'is_deprecated': is_deprecated,
+                'price': asset.price,
+                'ralph_id': ralph_id,
+                'slots': asset.slots,
+                'sn': asset.sn,
+                'price': asset.price,
+                'deprecation_rate': asset.deprecation_rate,
+                'power_consumption': asset.model.power_consumption,
+                'height_of_device': asset.model.height_of_device,
+                'warehouse_id': asset.warehouse_id,
+                'venture_id': venture_info.id if venture_info else None,
+                'is_blade': category.is_blade if category else None,
+                'cores_count': device.get_core_count() if device else 0,
+            }
 
 
-def get_asset_parts():
+def get_asset_parts(chunk_size=CHUNK_SIZE):
     """Yields dicts describing parts of assets"""
-    for asset in Asset.objects_dc.all():
-        for part in asset.get_parts():
+    queryset = Asset.objects.select_related(
+        'model', 'part_info__device__device_info',
+    ).filter(
+        part_info__device__type__in=AssetType.DC.choices,
+        part_info__device__deleted=False,
+    )
+    for parts in iterate_in_chunks(queryset, chunk_size):
+        deprecation_flags = _get_deprecation_flags(parts)
+        for part, is_deprecated in zip(parts, deprecation_flags):
+            asset = part.part_info.device
             device_info = asset.device_info
             yield {
                 'asset_id': part.id,
                 'barcode': asset.barcode,
-                'is_deprecated': part.is_deprecated(),
+                'is_deprecated': is_deprecated,
                 'model': part.model.name if part.model else None,
                 'price': part.price,
                 'ralph_id': device_info.ralph_device_id if device_info else None,  # noqa
                 'sn': asset.sn,
                 'deprecation_rate': asset.deprecation_rate,
-                'is_deprecated': part.is_deprecated(),
             }
@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 from django.db.models import Q
 from lck.django.common import nested_commit_on_success
 
+from ralph_assets.lookups import prefix_query
 from ralph_assets.models import (
     Asset,
     AssetSource,
@@ -24,8 +25,8 @@ class UnassignedDCDeviceLookup(DCDeviceLookup):
                 Q(device_info__ralph_device_id__isnull=True) |
                 Q(device_info__ralph_device_id=0)
             ) & (
-                Q(barcode__istartswith=q) |
-                Q(sn__istartswith=q) |
+                Q(**prefix_query('barcode', q)) |
+                Q(**prefix_query('sn', q)) |
                 Q(model__name__icontains=q)
             )
         )
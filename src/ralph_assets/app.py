@@ -38,6 +38,32 @@ class Assets(RalphModule):
             'LOAN-ASSET': {'SLUG': 'loan-asset'},
             'RETURN-ASSET': {'SLUG': 'return-asset'},
             'TEMP_STORAGE_PATH': '/tmp/',
+            'CACHE_SIZE': 20,
+            'CONCURRENCY': 4,
+            'QUEUE': 'reports',
+            'TIMEOUT': 600,
+        }
+        self.settings['ASSETS_LOOKUPS'] = {
+            'CACHE_SIZE': 1000,
+            'CACHE_TIMEOUT': 30,
+            'PREFIX_COLUMNS': False,
+        }
+        self.settings['ASSETS_SEARCH'] = {
+            'KEYSET_PAGINATION': True,
+            'OFFSET_PAGES': 5,
+            'CURSOR_TIMEOUT': 3600,
+            'COUNT_REFRESH': 60,
+            'COUNT_MAX_AGE': 3600,
+            'COUNT_QUEUE': 'default',
+            'PLAN_CACHE_SIZE': 100,
+            'PLAN_CACHE_TIMEOUT': 300,
+        }
+        self.settings['ASSETS_IMPORT'] = {
+            'BATCH_SIZE': 500,
+            'PREVIEW_SIZE': 100,
+            'CONCURRENCY': 4,
+            'QUEUE': 'reports',
+            'TIMEOUT': 3600,
         }
         self.settings['ASSETS_TRANSITIONS'] = {
             'ENABLE': False,
@@ -45,5 +71,7 @@ class Assets(RalphModule):
                 'RELEASE-ASSET': 'release-asset',
                 'LOAN-ASSET': 'loan-asset',
                 'RETURN-ASSET': 'return-asset',
-            }
+            },
+            'QUEUE': 'reports',
+            'TIMEOUT': 600,
         }
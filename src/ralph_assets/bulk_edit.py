@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""Set-based saving of the asset bulk edit formset.
+
+Instead of saving every asset of a valid formset (twice, when its office info
+is updated too), ``BulkEditor`` diffs the edited instances against their
+loaded state, groups rows with identical changes and writes every group with
+a single ``UPDATE ... WHERE id IN (...)``. History of the changes is
+collected the way the post_save hooks do it and written in bulk, all in one
+transaction.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.forms.forms import NON_FIELD_ERRORS
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
+
+from ralph_assets.fuzzy import asset_fuzzy_index
+from ralph_assets.lookups import get_lookup_cache
+from ralph_assets.models_assets import Asset, OfficeInfo
+from ralph_assets.models_history import bulk_history, save_history_changes
+
+
+# keeps SQLite below its limit of 999 parameters per query
+BULK_UPDATE_SIZE = 500
+FUZZY_INDEX_FIELDS = {'sn', 'barcode', 'model'}
+
+
+def clean_values(instance, names):
+    """Converts values of fields *names* set by forms (e.g. choices given as
+    strings) to their Python types, so they are not mistaken for changes."""
+    for field in instance._meta.fields:
+        if field.name in names and not field.rel:
+            setattr(instance, field.attname, field.to_python(
+                getattr(instance, field.attname),
+            ))
+
+
+def get_changes(instance):
+    """Returns a dict of significant changes of *instance* which aren't
+    saved yet, keyed by field names."""
+    names = dict((f.attname, f.name) for f in instance._meta.fields)
+    return dict(
+        (names[attname], getattr(instance, attname))
+        for attname in instance.dirty_fields
+        if attname not in instance.insignificant_fields
+    )
+
+
+def group_changes(items, get_instance):
+    """Returns a dict of *items* keyed by the changes of their instances (got
+    with *get_instance*), skipping the unchanged ones."""
+    groups = OrderedDict()
+    for item in items:
+        changes = get_changes(get_instance(item))
+        if changes:
+            key = frozenset(changes.iteritems())
+            groups.setdefault(key, []).append(item)
+    return groups
+
+
+def update_instances(model, instances, changes, user, history_field=None):
+    """Writes *changes* shared by *instances* of *model* with grouped
+    ``UPDATE`` statements. History of the changes is recorded (by the user
+    *user*) with *history_field* pointing at the instance, if given."""
+    for instance in instances:
+        instance.saving_user = user
+        if history_field:
+            save_history_changes(instance, **{history_field: instance})
+    values = dict(changes)
+    values['modified'] = now()
+    ids = [instance.pk for instance in instances]
+    for i in xrange(0, len(ids), BULK_UPDATE_SIZE):
+        model._default_manager.filter(
+            pk__in=ids[i:i + BULK_UPDATE_SIZE],
+        ).update(cache_version=F('cache_version') + 1, **values)
+    for instance in instances:
+        instance.modified = values['modified']
+        instance.cache_version += 1
+        instance._update_field_state()
+
+
+class BulkEditor(object):
+    """Saves the instances of a valid asset bulk edit formset.
+
+    :param formset: valid formset with forms of ``BulkEditAssetForm``
+    :param user: the user making the changes
+    """
+
+    def __init__(self, formset, user):
+        self.formset = formset
+        self.user = user
+        self.profile = user.get_profile()
+
+    def _update(self, model, groups, get_instance, history_field):
+        for changes, forms in groups.iteritems():
+            self.failed_forms = forms
+            update_instances(
+                model, [get_instance(form) for form in forms], changes,
+                self.user, history_field,
+            )
+        self.failed_forms = []
+
+    def _prepare_office_info(self, form):
+        """Applies the *purpose* of the form to the asset's office info,
+        creating it if needed."""
+        purpose = form.cleaned_data.get('purpose')
+        purpose = int(purpose) if purpose else None
+        asset = form.instance
+        if asset.office_info is None:
+            office_info = OfficeInfo(purpose=purpose)
+            office_info.save(user=self.user)
+            asset.office_info = office_info
+        else:
+            asset.office_info.purpose = purpose
+
+    def _save(self):
+        """Saves the changes, returns the forms of changed assets."""
+        forms = self.formset.forms
+        office_info_forms = [
+            form for form in forms if 'purpose' in form.fields
+        ]
+        for form in office_info_forms:
+            self._prepare_office_info(form)
+        for form in forms:
+            clean_values(form.instance, form.fields)
+            form.instance.modified_by = self.profile
+            form.instance.update_computed_fields()
+        office_info_groups = group_changes(
+            office_info_forms, lambda form: form.instance.office_info,
+        )
+        asset_groups = group_changes(forms, lambda form: form.instance)
+        with bulk_history():
+            self._update(
+                OfficeInfo, office_info_groups,
+                lambda form: form.instance.office_info, 'office_info',
+            )
+            self._update(
+                Asset, asset_groups, lambda form: form.instance, 'asset',
+            )
+        return [
+            form for changes, group in asset_groups.iteritems()
+            if FUZZY_INDEX_FIELDS & set(name for name, value in changes)
+            for form in group
+        ]
+
+    def save(self):
+        """Saves the changes. Returns True on success, otherwise adds an
+        error to the forms which couldn't be saved and returns False."""
+        self.failed_forms = []
+        try:
+            with transaction.commit_on_success():
+                indexed_forms = self._save()
+        except IntegrityError as e:
+            for form in self.failed_forms:
+                form._errors.setdefault(
+                    NON_FIELD_ERRORS, form.error_class(),
+                ).append("{}: {}".format(_("Could not save changes"), e))
+            return False
+        # the changes bypassed post_save signals
+        get_lookup_cache().invalidate(Asset)
+        asset_fuzzy_index.refresh(form.instance.id for form in indexed_forms)
+        return True
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""Asset deprecation calculations.
+
+An asset is deprecated on a given date when it is forced to be, when it has
+no invoice date or when its invoice date plus the deprecation period (derived
+from the deprecation rate) is earlier than that date.
+
+The bulk helpers below do the month arithmetic once per distinct deprecation
+period instead of once per asset: for every period they compute the latest
+invoice date that is already deprecated on the target date, so flagging an
+asset boils down to a single date comparison.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Q
+
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def get_deprecation_months(deprecation_rate):
+    """Returns the number of months it takes to deprecate an asset."""
+    return int(
+        (1 / (deprecation_rate / 100) * 12)
+        if deprecation_rate else 0
+    )
+
+
+def get_deprecation_end_date(invoice_date, deprecation_rate):
+    """Returns the date on which the deprecation period ends."""
+    if not invoice_date:
+        return None
+    return invoice_date + relativedelta(
+        months=get_deprecation_months(deprecation_rate),
+    )
+
+
+def get_deprecation_cutoff(deprecation_months, date):
+    """Returns the latest invoice date that is deprecated on *date*.
+
+    ``relativedelta`` clamps month ends (e.g. Jan 31 + 1 month is Feb 28), so
+    the naive ``date - months`` is only a first guess which is then moved to
+    the exact boundary.
+    """
+    months = relativedelta(months=deprecation_months)
+    cutoff = date - months
+    while cutoff + months >= date:
+        cutoff -= ONE_DAY
+    while cutoff + ONE_DAY + months < date:
+        cutoff += ONE_DAY
+    return cutoff
+
+
+def is_deprecated(invoice_date, deprecation_rate, force_deprecation,
+                  date=None):
+    """Per-asset deprecation check."""
+    date = date or datetime.date.today()
+    if force_deprecation or not invoice_date:
+        return True
+    return get_deprecation_end_date(invoice_date, deprecation_rate) < date
+
+
+def bulk_is_deprecated(invoice_dates, deprecation_rates, force_deprecations,
+                       date=None):
+    """Returns the list of deprecation flags for the given sequences of
+    invoice dates, deprecation rates and forced deprecation flags.
+    """
+    date = date or datetime.date.today()
+    cutoffs = {}
+    flags = []
+    for invoice_date, deprecation_rate, force_deprecation in zip(
+        invoice_dates, deprecation_rates, force_deprecations,
+    ):
+        if force_deprecation or not invoice_date:
+            flags.append(True)
+            continue
+        months = get_deprecation_months(deprecation_rate)
+        if months not in cutoffs:
+            cutoffs[months] = get_deprecation_cutoff(months, date)
+        flags.append(invoice_date <= cutoffs[months])
+    return flags
+
+
+def get_deprecation_flags(queryset, date=None):
+    """Returns a dict of deprecation flags for assets in *queryset*, keyed by
+    asset id. Only the columns needed for the calculation are fetched.
+    """
+    rows = list(queryset.values_list(
+        'id', 'invoice_date', 'deprecation_rate', 'force_deprecation',
+    ))
+    if not rows:
+        return {}
+    ids, invoice_dates, deprecation_rates, force_deprecations = zip(*rows)
+    return dict(zip(ids, bulk_is_deprecated(
+        invoice_dates, deprecation_rates, force_deprecations, date,
+    )))
+
+
+def get_deprecated_query(date=None):
+    """Returns a ``Q`` object matching assets which are deprecated on *date*,
+    so the predicate can be evaluated by the database. It relies on the
+    ``deprecation_end_date`` column kept up to date by ``Asset.save``.
+    """
+    date = date or datetime.date.today()
+    return (
+        Q(force_deprecation=True) |
+        Q(deprecation_end_date=None) |
+        Q(deprecation_end_date__lt=date)
+    )
+
+
+def filter_deprecated(queryset, date=None, deprecated=True):
+    """Narrows *queryset* to the assets that are (or, with
+    ``deprecated=False``, are not) deprecated on *date*.
+    """
+    query = get_deprecated_query(date)
+    if deprecated:
+        return queryset.filter(query)
+    return queryset.exclude(query)
@@ -4,17 +4,21 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import csv
-import xlrd
-import itertools as it
-
 from django import forms
 from django.db.models.fields import NOT_PROVIDED
 from django.contrib.contenttypes.models import ContentType
-from django.template.defaultfilters import slugify
 from django.utils.translation import ugettext_lazy as _
 
 from ralph_assets.models_assets import AssetType
+from ralph_assets.spreadsheet import Spreadsheet
+
+
+UPSERT_KEYS = [
+    ('', _('id column')),
+    ('sn', _('Serial number')),
+    ('barcode', _('Barcode')),
+    ('office_info.imei', _('IMEI')),
+]
 
 
 def get_amendment_model(mode):
@@ -25,77 +29,8 @@ def get_amendment_model(mode):
 
 
 class DataUploadField(forms.FileField):
-    """A field that gets the uploaded XLS or CSV data and returns data
-    prepared for add/update."""
-
-    def _process_xls(self, file_):
-        book = xlrd.open_workbook(
-            filename=file_.name,
-            file_contents=file_.read(),
-        )
-        names_per_sheet = {}
-        update_per_sheet = {}
-        add_per_sheet = {}
-        for sheet_name, sheet in (
-            (sheet_name, book.sheet_by_name(sheet_name)) for
-            sheet_name in book.sheet_names()
-        ):
-            if not sheet:
-                continue
-            name_row = sheet.row(0)
-            update = name_row[0].value == 'id'
-            if update:
-                name_row = name_row[1:]
-            names_per_sheet[sheet_name] = col_names = [
-                cell.value for cell in name_row
-            ]
-            update_per_sheet[sheet_name] = {}
-            add_per_sheet[sheet_name] = []
-            if update:
-                for row in (sheet.row(i) for i in xrange(1, sheet.nrows)):
-                    asset_id = int(row[0].value)
-                    update_per_sheet[sheet_name][asset_id] = {}
-                    for key, cell in it.izip(col_names, row[1:]):
-                        update_per_sheet[sheet_name][asset_id][slugify(key)] =\
-                            cell.value
-            else:
-                for row in (sheet.row(i) for i in xrange(1, sheet.nrows)):
-                    asset_data = {}
-                    add_per_sheet[sheet_name].append(asset_data)
-                    for key, cell in it.izip(col_names, row):
-                        asset_data[slugify(key)] = cell.value
-
-        return names_per_sheet, update_per_sheet, add_per_sheet
-
-    def _process_csv(self, file_):
-        def unicode_rows(reader):
-            for row in reader:
-                try:
-                    yield [cell.decode('utf-8') for cell in row]
-                except UnicodeDecodeError:
-                    raise forms.ValidationError(
-                        'Problems with character encoding. Use UTF-8'
-                    )
-        reader = unicode_rows(csv.reader(file_))
-        update_per_sheet = {'csv': {}}
-        add_per_sheet = {'csv': []}
-        name_row = next(reader)
-        update = name_row[0] == 'id'
-        if update:
-            name_row = name_row[1:]
-            for row in reader:
-                asset_id = int(row[0])
-                update_per_sheet['csv'].setdefault(asset_id, {})
-                for key, value in it.izip(name_row, row[1:]):
-                    update_per_sheet['csv'][asset_id][key] = value
-        else:
-            for row in reader:
-                asset_data = {}
-                add_per_sheet['csv'].append(asset_data)
-                for key, value in it.izip(name_row, row[:]):
-                    asset_data[key] = value
-        names_per_sheet = {'csv': name_row}
-        return names_per_sheet, update_per_sheet, add_per_sheet
+    """A field that gets the uploaded XLSX or CSV file and returns it spooled
+    as a ``Spreadsheet``. Only the header rows are read here."""
 
     def to_python(self, value):
         file_ = super(DataUploadField, self).to_python(value)
@@ -106,7 +41,7 @@ class DataUploadField(forms.FileField):
         try:
             filetype = {
                 'application/vnd.openxmlformats-officedocument.'
-                'spreadsheetml.sheet': 'xls',
+                'spreadsheetml.sheet': 'xlsx',
                 'text/csv': 'csv',
                 'application/csv': 'csv',
                 'application/vnd.ms-excel': 'csv',  # Browsers Y U NO RFC 4180?
@@ -115,9 +50,16 @@ class DataUploadField(forms.FileField):
             raise forms.ValidationError(
                 'Unsupported file type. Use CSV of Excel.'
             )
-        return (
-            self._process_xls if filetype == 'xls' else self._process_csv
-        )(file_)
+        spreadsheet = Spreadsheet.spool(file_, filetype)
+        try:
+            headers = spreadsheet.headers()
+        except ValueError as e:
+            spreadsheet.delete()
+            raise forms.ValidationError(unicode(e))
+        if not headers:
+            spreadsheet.delete()
+            raise forms.ValidationError(_('The file is empty.'))
+        return spreadsheet
 
 
 class ModelChoiceField(forms.ChoiceField):
@@ -158,6 +100,15 @@ class XlsUploadForm(forms.Form):
     """The first step for uploading the XLS file for asset bulk update."""
     model = ModelChoiceField()
     file = DataUploadField()
+    key = forms.ChoiceField(
+        choices=UPSERT_KEYS,
+        required=False,
+        label=_('Match rows by'),
+        help_text=_(
+            'Rows with a value matching an existing asset update it, other '
+            'rows add new assets.'
+        ),
+    )
 
 
 class XlsColumnChoiceForm(forms.Form):
@@ -165,9 +116,13 @@ class XlsColumnChoiceForm(forms.Form):
 
     def clean(self, *args, **kwargs):
         result = super(XlsColumnChoiceForm, self).clean(*args, **kwargs)
+        matched = set(result.values()) - {''}
+        if self.key and self.key not in matched:
+            raise forms.ValidationError(
+                _('Choose a column for %s to match rows by it.') % self.key
+            )
         if self.update:
             return result
-        matched = set(result.values()) - {''}
         Model = get_model_by_name(self.model_reflected)
         required = {
             field.name
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+"""In-process n-gram index used by the fuzzy asset lookup.
+
+Every non-part asset is indexed by the normalized concatenation of its serial
+number, barcode and model name. A search ranks the indexed assets by
+``difflib.SequenceMatcher.ratio`` exactly like a full scan would, but only
+the assets sharing an n-gram with the query are looked up in the postings
+and scored, the cheap upper bounds (``real_quick_ratio`` and ``quick_ratio``)
+discarding most of them without computing the expensive ratio. The other
+assets are visited by length, most promising first, and only as long as
+their length still allows them to beat the current top results.
+
+The index is filled lazily and kept current by model signals; bulk writes
+bypassing the signals call ``refresh`` once they are committed. Every change
+also bumps a version number kept in the cache and stores the ids of the
+changed assets under that version, so before the next search the other
+processes (e.g. rq workers running imports) reload just these assets from
+the database. An index which is more than ``MAX_CHANGES`` versions behind,
+or whose changes expired from the cache, is reloaded as a whole.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import difflib
+import heapq
+import threading
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ralph_assets.models_assets import Asset, AssetModel, DeviceInfo
+
+
+NGRAM_SIZE = 3
+VERSION_KEY = 'ralph_assets.fuzzy.version'
+VERSION_TIMEOUT = 30 * 24 * 3600
+CHANGES_KEY = 'ralph_assets.fuzzy.changes.{}'
+CHANGES_TIMEOUT = 24 * 3600
+MAX_CHANGES = 1000
+
+
+def normalize(*parts):
+    return "".join(part or '' for part in parts).replace(" ", "").lower()
+
+
+def get_ngrams(seq, size=NGRAM_SIZE):
+    if len(seq) < size:
+        return {seq} if seq else set()
+    return {seq[i:i + size] for i in xrange(len(seq) - size + 1)}
+
+
+def _get_ratio_bound(length, query_length):
+    """Returns ``real_quick_ratio`` of sequences of these lengths."""
+    total = length + query_length
+    if not total:
+        return 1.0
+    return 2.0 * min(length, query_length) / total
+
+
+def _get_version():
+    return cache.get(VERSION_KEY) or 0
+
+
+def _bump_version():
+    """Marks the indexes of all processes as outdated and returns the new
+    version."""
+    cache.add(VERSION_KEY, 0, VERSION_TIMEOUT)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # the key expired in the meantime
+        cache.set(VERSION_KEY, 1, VERSION_TIMEOUT)
+        return 1
+
+
+def _publish(asset_ids):
+    """Bumps the version, recording the ids of the assets changed by it
+    (None if any asset could have changed). Returns the new version."""
+    version = _bump_version()
+    cache.set(
+        CHANGES_KEY.format(version),
+        list(asset_ids) if asset_ids is not None else None,
+        CHANGES_TIMEOUT,
+    )
+    return version
+
+
+def _get_changes(since, version):
+    """Returns the set of ids of the assets changed after the version
+    *since* up to *version*, or None if they aren't known."""
+    if not since < version <= since + MAX_CHANGES:
+        return None
+    keys = [CHANGES_KEY.format(v) for v in xrange(since + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys) or None in changes.values():
+        return None
+    return set().union(*changes.values())
+
+
+class AssetFuzzyIndex(object):
+    """N-gram index of assets which can be linked with Ralph devices."""
+
+    def __init__(self, ngram_size=NGRAM_SIZE):
+        self.ngram_size = ngram_size
+        self.lock = threading.RLock()
+        self.version = None
+        self.entries = {}
+        self.postings = {}
+        self.lengths = {}
+
+    @property
+    def is_loaded(self):
+        return self.version is not None
+
+    def _add(self, asset_id, seq, ralph_device_id):
+        self.entries[asset_id] = (seq, ralph_device_id)
+        self.lengths.setdefault(len(seq), set()).add(asset_id)
+        for ngram in get_ngrams(seq, self.ngram_size):
+            self.postings.setdefault(ngram, set()).add(asset_id)
+
+    def _discard(self, index, key, asset_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(asset_id)
+            if not ids:
+                del index[key]
+
+    def _remove(self, asset_id):
+        entry = self.entries.pop(asset_id, None)
+        if entry is None:
+            return
+        self._discard(self.lengths, len(entry[0]), asset_id)
+        for ngram in get_ngrams(entry[0], self.ngram_size):
+            self._discard(self.postings, ngram, asset_id)
+
+    def _add_rows(self, queryset):
+        for asset_id, sn, barcode, model_name, ralph_device_id in (
+            queryset.filter(part_info=None).values_list(
+                'id', 'sn', 'barcode', 'model__name',
+                'device_info__ralph_device_id',
+            )
+        ):
+            self._add(
+                asset_id, normalize(sn, barcode, model_name), ralph_device_id,
+            )
+
+    def _reload(self, asset_ids):
+        """Reloads the entries of *asset_ids* from the database."""
+        asset_ids = list(asset_ids)
+        for asset_id in asset_ids:
+            self._remove(asset_id)
+        for i in xrange(0, len(asset_ids), MAX_CHANGES):
+            self._add_rows(
+                Asset.objects.filter(id__in=asset_ids[i:i + MAX_CHANGES]),
+            )
+
+    def _changed(self, asset_ids):
+        """Publishes the change of *asset_ids*, already applied to this
+        index. The index stays current only if nobody else changed anything
+        since, otherwise it catches up before the next search."""
+        version = _publish(asset_ids)
+        if self.is_loaded and version == self.version + 1:
+            self.version = version
+
+    def load(self):
+        with self.lock:
+            version = _get_version()
+            self.entries = {}
+            self.postings = {}
+            self.lengths = {}
+            self._add_rows(Asset.objects.all())
+            self.version = version
+
+    def invalidate(self):
+        """Makes every process reload its index before the next search."""
+        with self.lock:
+            _publish(None)
+            self.version = None
+
+    def ensure_loaded(self):
+        with self.lock:
+            version = _get_version()
+            if self.version == version:
+                return
+            changes = None
+            if self.is_loaded:
+                changes = _get_changes(self.version, version)
+            if changes is None:
+                self.load()
+            else:
+                self._reload(changes)
+                self.version = version
+
+    def refresh(self, asset_ids):
+        """Reloads the entries of *asset_ids*, changed without ``post_save``
+        signals, in this process and the others. Call it once the changes
+        are committed."""
+        asset_ids = list(asset_ids)
+        if not asset_ids:
+            return
+        with self.lock:
+            if self.is_loaded:
+                self._reload(asset_ids)
+            self._changed(asset_ids)
+
+    def update(self, asset):
+        with self.lock:
+            if not self.is_loaded:
+                _publish([asset.id])
+                return
+            self._remove(asset.id)
+            if not (asset.part_info_id or getattr(asset, 'deleted', False)):
+                device_info = asset.device_info
+                self._add(
+                    asset.id,
+                    normalize(asset.sn, asset.barcode, asset.model.name),
+                    device_info.ralph_device_id if device_info else None,
+                )
+            self._changed([asset.id])
+
+    def update_ralph_device_id(self, asset_ids, ralph_device_id):
+        with self.lock:
+            for asset_id in asset_ids:
+                entry = self.entries.get(asset_id)
+                if entry is not None:
+                    self.entries[asset_id] = (entry[0], ralph_device_id)
+            self._changed(asset_ids)
+
+    def remove(self, asset_id):
+        with self.lock:
+            self._remove(asset_id)
+            self._changed([asset_id])
+
+    def search(self, query, linkable_device_ids, limit=10):
+        """Returns ids of the *limit* assets matching *query* best.
+
+        Only assets not linked to any Ralph device or linked to one of
+        *linkable_device_ids* are taken into account. Assets are ordered by
+        descending ratio, ties are broken by ascending id.
+        """
+        query = normalize(query)
+        matcher = difflib.SequenceMatcher(None, '', query)
+        best = []  # heap of (ratio, -asset_id), the worst match on top
+
+        def score(asset_id):
+            seq, ralph_device_id = self.entries[asset_id]
+            if not (
+                ralph_device_id is None or
+                ralph_device_id in linkable_device_ids
+            ):
+                return
+            matcher.set_seq1(seq)
+            if len(best) == limit:
+                worst = best[0][0]
+                if (
+                    matcher.real_quick_ratio() < worst or
+                    matcher.quick_ratio() < worst
+                ):
+                    return
+            item = (matcher.ratio(), -asset_id)
+            if len(best) < limit:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+
+        with self.lock:
+            self.ensure_loaded()
+            shared = {}
+            for ngram in get_ngrams(query, self.ngram_size):
+                for asset_id in self.postings.get(ngram, ()):
+                    shared[asset_id] = shared.get(asset_id, 0) + 1
+            for asset_id in sorted(
+                shared, key=lambda asset_id: (-shared[asset_id], asset_id),
+            ):
+                score(asset_id)
+            # the assets without a common n-gram, by descending upper bound
+            # of their ratio; the rest is skipped once it can't make the top
+            for bound, length in sorted(
+                (
+                    (_get_ratio_bound(length, len(query)), length)
+                    for length in self.lengths
+                ),
+                reverse=True,
+            ):
+                if len(best) == limit and bound < best[0][0]:
+                    break
+                for asset_id in self.lengths[length]:
+                    if asset_id not in shared:
+                        score(asset_id)
+        return [-asset_id for _, asset_id in sorted(best, reverse=True)]
+
+
+asset_fuzzy_index = AssetFuzzyIndex()
+
+
+@receiver(post_save, sender=Asset, dispatch_uid='ralph_assets.fuzzy_index')
+def asset_post_save(sender, instance, **kwargs):
+    asset_fuzzy_index.update(instance)
+
+
+@receiver(post_delete, sender=Asset, dispatch_uid='ralph_assets.fuzzy_index')
+def asset_post_delete(sender, instance, **kwargs):
+    asset_fuzzy_index.remove(instance.id)
+
+
+@receiver(
+    post_save, sender=DeviceInfo, dispatch_uid='ralph_assets.fuzzy_index',
+)
+def device_info_post_save(sender, instance, **kwargs):
+    asset_ids = list(
+        Asset.objects.filter(device_info=instance).values_list('id', flat=True)
+    )
+    if asset_ids:
+        asset_fuzzy_index.update_ralph_device_id(
+            asset_ids, instance.ralph_device_id,
+        )
+
+
+@receiver(
+    post_save, sender=AssetModel, dispatch_uid='ralph_assets.fuzzy_index',
+)
+def asset_model_post_save(sender, instance, created, **kwargs):
+    if not created:
+        asset_fuzzy_index.invalidate()
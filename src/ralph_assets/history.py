@@ -6,10 +6,55 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import threading
+from contextlib import contextmanager
+
 from ralph_assets.models_assets import Asset
 
 
-def field_changes(instance, ignore=('id', 'ralph_device_id')):
+IGNORED_FIELDS = (
+    'id',
+    'ralph_device_id',
+    'deprecation_end_date',
+    'sn_lower',
+    'barcode_lower',
+)
+
+_local = threading.local()
+_choices_labels = {}
+
+
+@contextmanager
+def related_objects_cache():
+    """Memoizes the objects looked up by ``field_changes`` to render the
+    original values of foreign keys until the end of the block, so bulk
+    operations don't fetch the same warehouse, model or user over and over.
+    Nested blocks share the outermost cache.
+    """
+    if getattr(_local, 'related_objects', None) is not None:
+        yield
+        return
+    _local.related_objects = {}
+    try:
+        yield
+    finally:
+        _local.related_objects = None
+
+
+def _get_related_object(model, pk):
+    cache = getattr(_local, 'related_objects', None)
+    if cache is not None and (model, pk) in cache:
+        return cache[model, pk]
+    try:
+        obj = model.objects.get(pk=pk)
+    except model.DoesNotExist:
+        obj = None
+    if cache is not None:
+        cache[model, pk] = obj
+    return obj
+
+
+def field_changes(instance, ignore=IGNORED_FIELDS):
     """Yield the name, original value and new value for each changed field.
     Skip all insignificant fields and those passed in ``ignore``.
     When creating asset, the first asset status will be added into the history.
@@ -26,11 +71,8 @@ def field_changes(instance, ignore=('id', 'ralph_device_id')):
             parent_model = instance._meta.get_field_by_name(
                 field
             )[0].related.parent_model
-            try:
-                if orig is not None:
-                    orig = parent_model.objects.get(pk=orig)
-            except parent_model.DoesNotExist:
-                orig = None
+            if orig is not None:
+                orig = _get_related_object(parent_model, orig)
         try:
             new = getattr(instance, field)
         except AttributeError:
@@ -51,7 +93,12 @@ def get_choices(instance, field, id):
         id = int(id)
     except (TypeError, ValueError):
         return id
-    choices = instance._meta.get_field_by_name(field)[0].get_choices()
-    for choice_id, value in choices:
-        if choice_id == id:
-            return value
+    key = (instance.__class__, field)
+    if key not in _choices_labels:
+        labels = {}
+        for choice_id, value in reversed(
+            instance._meta.get_field_by_name(field)[0].get_choices()
+        ):
+            labels[choice_id] = value
+        _choices_labels[key] = labels
+    return _choices_labels[key].get(id)
@@ -0,0 +1,988 @@
+# -*- coding: utf-8 -*-
+
+"""Batched import of the rows uploaded with the XLS/CSV wizard.
+
+``Importer`` goes through the rows in chunks of ``BATCH_SIZE``. For every
+chunk, the updated objects are fetched with a single ``in_bulk`` query and the
+names of related objects (models, warehouses, users, ...) not seen before are
+resolved with one query per related model. The updates are then written with
+one ``UPDATE`` per group of rows with identical changes. Every chunk is
+committed separately, and rows which can't be saved are rolled back to a
+savepoint and reported the way the wizard always did.
+
+The wizard doesn't import the rows itself: it saves them to a file and
+creates an ``ImportJob`` run by ``run_import_job`` on the
+``ASSETS_IMPORT['QUEUE']`` rq queue. ``JobImporter`` saves the number of
+rows done and their errors with every batch, reports the progress like the
+asynchronous reports do and resumes the job after the last committed batch.
+Before the first batch, the job reads the sheets of the uploaded spreadsheet
+in a pool of ``ASSETS_IMPORT['CONCURRENCY']`` processes and writes their rows
+to the rows file in the order of the sheets. The workers also check the
+values of every row which don't name related objects (types, choices,
+lengths), without touching the database; the rows failing that are stored
+with their error and reported by the importer without being imported.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import itertools
+import json
+import multiprocessing
+import operator
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from functools import reduce
+
+import django_rq
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, transaction
+from django.db.models import get_model, Q
+from django.db.models.fields import CharField, DecimalField, TextField
+from django.db.models.fields.related import RelatedField
+from django.template.defaultfilters import slugify
+from django.utils.timezone import now
+from lck.django.common.models import Named
+from rq import get_current_job
+
+from ralph_assets.bulk_edit import (
+    clean_values,
+    get_changes,
+    group_changes,
+    update_instances,
+)
+from ralph_assets.forms_import import get_amendment_model, get_model_by_name
+from ralph_assets.fuzzy import asset_fuzzy_index
+from ralph_assets.lookups import get_lookup_cache
+from ralph_assets.models_assets import (
+    Asset,
+    CreatableFromString,
+    MODE2ASSET_TYPE,
+    Sluggy,
+)
+from ralph_assets.models_history import bulk_history
+from ralph_assets.models_import import (
+    ImportJob,
+    ImportJobError,
+    ImportJobStatus,
+)
+from ralph_assets.spreadsheet import Spreadsheet
+from ralph.util.reports import set_progress
+
+
+IMPORT_PATH = 'assets/imports'
+
+
+def iterate_chunks(iterable, size):
+    """Yields lists of at most *size* items of *iterable*."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ValueResolver(object):
+    """Transforms the strings of a spreadsheet into values of the fields of
+    *model* or, for names prefixed with *amd_field*, of *amd_model*.
+
+    Related objects are looked up by name (``Named``), username (``User``)
+    or slug (``Sluggy``). A resolver lives as long as the import and
+    remembers every name it has looked up, found or not, so ``prefetch``
+    queries each related model only for the names it hasn't seen yet.
+    Missing objects which can be created from strings are created with a
+    single ``INSERT`` per model, unless *create* is False.
+    """
+
+    def __init__(
+        self, model, mode, amd_field=None, amd_model=None, create=True,
+    ):
+        self.model = model
+        self.mode = mode
+        self.amd_field = amd_field
+        self.amd_model = amd_model
+        self.create = create
+        self.fields = {}
+        self.choices = {}
+        self.related = {}
+
+    def get_field(self, field_name):
+        field = self.fields.get(field_name)
+        if field is None:
+            if '.' in field_name:
+                _, name = field_name.split('.', 1)
+                model = self.amd_model
+            else:
+                name = field_name
+                model = self.model
+            field = model._meta.get_field_by_name(name)[0]
+            self.fields[field_name] = field
+        return field
+
+    def get_choices(self, field):
+        """Returns the values of *field* choices keyed by their normalized
+        labels."""
+        choices = self.choices.get(field)
+        if choices is None:
+            choices = self.choices[field] = {}
+            for k, v in field.choices:
+                choices.setdefault(v.lower().strip(), k)
+        return choices
+
+    def _get_lookup(self, model):
+        """Returns the field the objects of *model* are looked up by and
+        whether the lookup is case insensitive."""
+        if issubclass(model, User):
+            return 'username', True
+        if issubclass(model, Sluggy):
+            return 'slug', False
+        return 'name', True
+
+    def _get_key(self, model, value):
+        name, iexact = self._get_lookup(model)
+        return value.lower() if iexact else value
+
+    def _is_related(self, field):
+        return (
+            isinstance(field, RelatedField) and
+            issubclass(field.rel.to, (Named, User, Sluggy))
+        )
+
+    def _load(self, model, values):
+        """Looks up the objects of *model* named *values* with one query,
+        creating the missing ones if possible."""
+        name, iexact = self._get_lookup(model)
+        lookup = '{}__iexact'.format(name) if iexact else name
+        objects = self.related.setdefault(model, {})
+        for obj in model.objects.filter(reduce(operator.or_, (
+            Q(**{lookup: value}) for value in values
+        ))):
+            objects.setdefault(self._get_key(model, getattr(obj, name)), obj)
+        missing = {}
+        for value in values:
+            missing.setdefault(self._get_key(model, value), value)
+        for key in objects:
+            missing.pop(key, None)
+        if (
+            missing and self.create and
+            issubclass(model, CreatableFromString)
+        ):
+            self._create(model, missing.values())
+        for key in missing:
+            objects.setdefault(key, None)
+
+    def _create(self, model, values):
+        model.objects.bulk_create([
+            model.create_from_string(
+                asset_type=MODE2ASSET_TYPE[self.mode], s=value,
+            ) for value in values
+        ])
+        # bulk_create doesn't set primary keys
+        objects = self.related[model]
+        for obj in model.objects.filter(name__in=values):
+            objects[self._get_key(model, obj.name)] = obj
+        # and doesn't send post_save signals either
+        get_lookup_cache().invalidate(model)
+
+    def prefetch(self, rows):
+        """Loads the related objects named in *rows*, dicts of strings keyed
+        by field names, which weren't looked up before. Missing objects are
+        created right away, so rows rolled back later don't take them
+        along."""
+        values = {}
+        for row in rows:
+            for field_name, value in row.iteritems():
+                if not value or not isinstance(value, basestring):
+                    continue
+                field = self.get_field(field_name)
+                if not self._is_related(field):
+                    continue
+                model = field.rel.to
+                if self._get_key(model, value) not in self.related.get(
+                    model, {},
+                ):
+                    values.setdefault(model, set()).add(value)
+        for model, names in values.iteritems():
+            self._load(model, names)
+
+    def get_missing_model(self, field_name, value):
+        """Returns the related model of *field_name* if *value* names none
+        of its objects, None otherwise. Call ``prefetch`` first."""
+        field = self.get_field(field_name)
+        if (
+            not value or not isinstance(value, basestring) or
+            not self._is_related(field)
+        ):
+            return
+        model = field.rel.to
+        if self.related[model].get(self._get_key(model, value)) is None:
+            return model
+
+    def validate(self, data):
+        """Returns the error of the row *data*, a dict of strings keyed by
+        field names, or None. The values of all but the related fields are
+        checked, without database queries."""
+        for field_name, value in data.iteritems():
+            field = self.get_field(field_name)
+            if self._is_related(field):
+                continue
+            try:
+                value = self.resolve(field_name, value)
+                if value in (None, ''):
+                    continue
+                value = field.to_python(value)
+                if field.choices and value not in dict(field.flatchoices):
+                    raise ValidationError(
+                        field.error_messages['invalid_choice'] % value,
+                    )
+                field.run_validators(value)
+            except Exception as exc:
+                return repr(exc)
+
+    def _get_related(self, model, value):
+        key = self._get_key(model, value)
+        objects = self.related.get(model, {})
+        if key not in objects:
+            self._load(model, [value])
+        obj = self.related[model][key]
+        if obj is None:
+            raise model.DoesNotExist(
+                '{} matching "{}" does not exist.'.format(
+                    model._meta.object_name, value,
+                )
+            )
+        return obj
+
+    def resolve(self, field_name, value):
+        """Transforms a pure string into the value to be put into the
+        field."""
+        field = self.get_field(field_name)
+        if not value:
+            if isinstance(field, (TextField, CharField)):
+                return ''
+            else:
+                return
+        if isinstance(field, DecimalField):
+            if value.count(',') == 1 and '.' not in value:
+                value = value.replace(',', '.')
+        if field.choices:
+            value = self.get_choices(field).get(
+                value.lower().strip(), value,
+            )
+        if isinstance(value, basestring) and self._is_related(field):
+            value = self._get_related(field.rel.to, value)
+        return value
+
+
+class ImportSummary(object):
+    """What importing the rows of a spreadsheet would do.
+
+    ``missing`` lists the ids of updated objects which don't exist,
+    ``existing`` counts the new rows per unique field whose value is already
+    taken, ``unresolved`` and ``created`` list per field the names of
+    related objects which don't exist and can't or can be created, and
+    ``duplicates`` lists the values of the upsert key found in more than one
+    row. Lists of ids and names are cut at ``VALUES_LIMIT`` items.
+    """
+
+    VALUES_LIMIT = 20
+
+    def __init__(self):
+        self.rows = 0
+        self.updates = 0
+        self.adds = 0
+        self.missing = []
+        self.missing_count = 0
+        self.existing = {}
+        self.unresolved = {}
+        self.created = {}
+        self.duplicates = []
+        self.duplicates_count = 0
+        self.error = None
+        self._keys = set()
+
+    def add_missing(self, asset_id):
+        self.missing_count += 1
+        if len(self.missing) < self.VALUES_LIMIT:
+            self.missing.append(asset_id)
+
+    def add_key(self, value):
+        if value is None:
+            return
+        if value not in self._keys:
+            self._keys.add(value)
+            return
+        self.duplicates_count += 1
+        if (
+            len(self.duplicates) < self.VALUES_LIMIT and
+            value not in self.duplicates
+        ):
+            self.duplicates.append(value)
+
+    def add_name(self, names, field_name, value):
+        values = names.setdefault(field_name, set())
+        if len(values) < self.VALUES_LIMIT:
+            values.add(value)
+
+
+class Importer(object):
+    """Imports rows of a spreadsheet into the model *model_name*.
+
+    :param mode: ``dc`` or ``back_office``
+    :param mappings: names of the model fields keyed by slugified column
+        names
+    :param user: the user making the import
+    :param key: a mapped unique field, e.g. ``sn``, ``barcode`` or
+        ``office_info.imei``; rows without an id update the object with the
+        same value of this field if there is one
+
+    Rows which couldn't be imported are listed afterwards in
+    ``failed_assets`` (ids of missing objects) and ``errors``.
+    """
+
+    def __init__(
+        self, model_name, mode, mappings, user, batch_size=None, key=None,
+    ):
+        self.Model = get_model_by_name(model_name)
+        if model_name == 'ralph_assets.asset':
+            self.amd_field, amd_model = get_amendment_model(mode)
+            self.AmdModel = get_model_by_name(amd_model)
+        else:
+            self.amd_field = self.AmdModel = None
+        self.mode = mode
+        self.mappings = mappings
+        self.user = user
+        self.batch_size = (
+            batch_size or settings.ASSETS_IMPORT.get('BATCH_SIZE', 500)
+        )
+        self.resolver = ValueResolver(
+            self.Model, mode, self.amd_field, self.AmdModel,
+        )
+        self.key = key or None
+        self.key_columns = set(
+            column for column, field_name in mappings.iteritems()
+            if field_name == key
+        )
+        self.failed_assets = []
+        self.errors = {}
+
+    def _map(self, data):
+        """Returns the values of *data* keyed by the mapped field names."""
+        mapped = {}
+        for key, value in data.iteritems():
+            field_name = self.mappings.get(slugify(key))
+            if field_name is not None:
+                mapped[field_name] = value
+        return mapped
+
+    def _in_savepoint(self, func, *args):
+        """Calls *func*, rolling back its changes if it fails. Returns the
+        error or None."""
+        sid = transaction.savepoint()
+        try:
+            func(*args)
+        except DatabaseError as exc:
+            transaction.savepoint_rollback(sid)
+            return repr(exc)
+        transaction.savepoint_commit(sid)
+
+    def _set_values(self, instance, data):
+        amd_prefix = '{}.'.format(self.amd_field)
+        names = set()
+        for field_name, value in data.iteritems():
+            value = self.resolver.resolve(field_name, value)
+            target = instance
+            if self.amd_field and field_name.startswith(amd_prefix):
+                _, field_name = field_name.split('.', 1)
+                target = getattr(instance, self.amd_field)
+                if target is None:
+                    # saved with the row by ``_write_new_amendment``
+                    target = self.AmdModel()
+                    setattr(instance, self.amd_field, target)
+            setattr(target, field_name, value)
+            names.add(field_name)
+        clean_values(instance, names)
+        if self.amd_field and getattr(instance, self.amd_field):
+            clean_values(getattr(instance, self.amd_field), names)
+        if isinstance(instance, Asset):
+            instance.update_computed_fields()
+
+    def _update_groups(self, model, groups, get_instance, history_field):
+        """Writes the *groups* of changes, retrying row by row to find the
+        failing rows when a group fails."""
+        for changes, items in groups.iteritems():
+            instances = [get_instance(item) for item in items]
+            if self._in_savepoint(
+                self._write, model, instances, changes, history_field,
+            ) is None:
+                continue
+            for item, instance in zip(items, instances):
+                error = self._in_savepoint(
+                    self._write, model, [instance], changes, history_field,
+                )
+                if error is not None:
+                    self.add_error(self._row_numbers[item.pk], item.pk, error)
+
+    def _write(self, model, instances, changes, history_field):
+        mptt_meta = getattr(model, '_mptt_meta', None)
+        with bulk_history():
+            if mptt_meta and mptt_meta.parent_attr in dict(changes):
+                # moving nodes of a tree needs to update the tree fields
+                for instance in instances:
+                    instance.save()
+            else:
+                update_instances(
+                    model, instances, changes, self.user, history_field,
+                )
+
+    def _write_new_amendment(self, instance, history_field):
+        """Saves the new amendment object of *instance* and writes the
+        changes of the instance, so a failing row leaves no orphaned
+        amendment object behind."""
+        amendment = getattr(instance, self.amd_field)
+        amendment.save()
+        setattr(instance, self.amd_field, amendment)
+        self._write(
+            self.Model, [instance], frozenset(get_changes(instance).items()),
+            history_field,
+        )
+
+    def _update_chunk(self, rows):
+        queryset = self.Model.objects.all()
+        if self.amd_field:
+            queryset = queryset.select_related(self.amd_field)
+        objects = queryset.in_bulk([asset_id for row, asset_id, data in rows])
+        rows = [
+            (row, asset_id, self._map(data)) for row, asset_id, data in rows
+        ]
+        self.resolver.prefetch(data for row, asset_id, data in rows)
+        self._row_numbers = {}
+        instances = []
+        for row, asset_id, data in rows:
+            instance = objects.get(asset_id)
+            if instance is None:
+                self.add_missing(row, asset_id)
+                continue
+            try:
+                self._set_values(instance, data)
+            except Exception as exc:
+                self.add_error(row, asset_id, repr(exc))
+                continue
+            if asset_id not in self._row_numbers:
+                instances.append(instance)
+            self._row_numbers[asset_id] = row
+        history_field = 'asset' if self.Model is Asset else None
+        if self.amd_field:
+            new_amendments = [
+                instance for instance in instances
+                if getattr(instance, self.amd_field) is not None and
+                getattr(instance, self.amd_field).pk is None
+            ]
+            for instance in new_amendments:
+                error = self._in_savepoint(
+                    self._write_new_amendment, instance, history_field,
+                )
+                if error is not None:
+                    self.add_error(
+                        self._row_numbers[instance.pk], instance.pk, error,
+                    )
+            new_ids = set(instance.pk for instance in new_amendments)
+            instances = [
+                instance for instance in instances
+                if instance.pk not in new_ids
+            ]
+            self._update_groups(
+                self.AmdModel,
+                group_changes(
+                    [
+                        instance for instance in instances
+                        if getattr(instance, self.amd_field)
+                    ],
+                    lambda instance: getattr(instance, self.amd_field),
+                ),
+                lambda instance: getattr(instance, self.amd_field),
+                self.amd_field,
+            )
+        groups = group_changes(instances, lambda instance: instance)
+        self._update_groups(
+            self.Model, groups, lambda instance: instance, history_field,
+        )
+
+    def _add_row(self, data):
+        kwargs = {}
+        amd_kwargs = {}
+        for field_name, value in data.iteritems():
+            value = self.resolver.resolve(field_name, value)
+            if self.amd_field and field_name.startswith(
+                self.amd_field + '.'
+            ):
+                _, field_name = field_name.split('.', 1)
+                amd_kwargs[field_name] = value
+            else:
+                kwargs[field_name] = value
+        asset = self.Model(**kwargs)
+        if self.AmdModel is not None:
+            amd_model_object = self.AmdModel(**amd_kwargs)
+            amd_model_object.save()
+            setattr(asset, self.amd_field, amd_model_object)
+        if isinstance(asset, Asset):
+            asset.type = MODE2ASSET_TYPE[self.mode]
+        else:
+            asset.asset_type = MODE2ASSET_TYPE[self.mode]
+        asset.save()
+        return asset
+
+    def _add_chunk(self, rows):
+        """Creates the objects of *rows*, returns their ids."""
+        self.resolver.prefetch(self._map(data) for row, data in rows)
+        ids = []
+        for row, data in rows:
+            sid = transaction.savepoint()
+            try:
+                ids.append(self._add_row(self._map(data)).pk)
+            except Exception as exc:
+                transaction.savepoint_rollback(sid)
+                self.add_error(row, tuple(data.values()), repr(exc))
+            else:
+                transaction.savepoint_commit(sid)
+
+    def _get_unique_fields(self, resolver):
+        """Returns the mapped field names whose values have to be unique."""
+        return [
+            field_name for field_name in set(self.mappings.values())
+            if resolver.get_field(field_name).unique
+        ]
+
+    def _get_key_value(self, data):
+        """Returns the value of the ``key`` field in the unmapped *data* or
+        None."""
+        for column, value in data.iteritems():
+            if value not in (None, '') and slugify(column) in self.key_columns:
+                return unicode(value)
+
+    def _resolve_keys(self, rows):
+        """Returns *rows* (pairs of an id and data) with the ids of rows
+        without one set to the id of the object with their ``key`` value,
+        looked up with one query."""
+        if not self.key:
+            return rows
+        values = set(
+            self._get_key_value(data)
+            for asset_id, data in rows if asset_id is None
+        )
+        values.discard(None)
+        if not values:
+            return rows
+        lookup = self.key.replace('.', '__')
+        ids = dict(
+            (unicode(value), pk)
+            for value, pk in self.Model.objects.filter(**{
+                '{}__in'.format(lookup): values,
+            }).values_list(lookup, 'pk')
+        )
+        return [
+            (
+                ids.get(self._get_key_value(data))
+                if asset_id is None else asset_id,
+                data,
+            )
+            for asset_id, data in rows
+        ]
+
+    def _summarize_chunk(self, summary, resolver, unique_fields, rows):
+        if self.key:
+            for asset_id, data in rows:
+                summary.add_key(self._get_key_value(data))
+        rows = [
+            (asset_id, self._map(data))
+            for asset_id, data in self._resolve_keys(rows)
+        ]
+        ids = set(asset_id for asset_id, data in rows if asset_id is not None)
+        existing_ids = set(
+            self.Model.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        ) if ids else set()
+        adds = [data for asset_id, data in rows if asset_id is None]
+        summary.rows += len(rows)
+        summary.adds += len(adds)
+        summary.updates += len(rows) - len(adds)
+        for asset_id, data in rows:
+            if asset_id is not None and asset_id not in existing_ids:
+                summary.add_missing(asset_id)
+        for field_name in unique_fields:
+            values = set(
+                unicode(data[field_name]) for data in adds
+                if data.get(field_name)
+            )
+            if not values:
+                continue
+            lookup = field_name.replace('.', '__')
+            taken = set(
+                unicode(value) for value in self.Model.objects.filter(**{
+                    '{}__in'.format(lookup): values,
+                }).values_list(lookup, flat=True)
+            )
+            count = sum(
+                1 for data in adds
+                if data.get(field_name) and unicode(data[field_name]) in taken
+            )
+            if count:
+                summary.existing[field_name] = (
+                    summary.existing.get(field_name, 0) + count
+                )
+        resolver.prefetch(data for asset_id, data in rows)
+        for asset_id, data in rows:
+            for field_name, value in data.iteritems():
+                model = resolver.get_missing_model(field_name, value)
+                if model is None:
+                    continue
+                summary.add_name(
+                    summary.created
+                    if issubclass(model, CreatableFromString)
+                    else summary.unresolved,
+                    field_name,
+                    value,
+                )
+
+    def summarize(self, rows):
+        """Goes through *rows* (see ``run``) in batches without writing
+        anything and returns an ``ImportSummary``. Every batch takes one
+        query for the updated objects, one per unique field and one per
+        related model with names not seen before."""
+        summary = ImportSummary()
+        resolver = ValueResolver(
+            self.Model, self.mode, self.amd_field, self.AmdModel,
+            create=False,
+        )
+        unique_fields = self._get_unique_fields(resolver)
+        try:
+            for chunk in iterate_chunks(rows, self.batch_size):
+                self._summarize_chunk(summary, resolver, unique_fields, chunk)
+        except ValueError as e:
+            summary.error = unicode(e)
+        return summary
+
+    def add_missing(self, row, asset_id):
+        """Records that the object updated by the *row*-th row is missing."""
+        self.failed_assets.append(asset_id)
+
+    def add_error(self, row, key, message):
+        """Records the error of the *row*-th row, identified by *key*."""
+        self.errors[key] = message
+
+    def checkpoint(self, count):
+        """Called in the transaction of every batch, once the first *count*
+        rows are done."""
+
+    def run(self, rows, start=0):
+        """Imports *rows*, pairs of the id of the updated object (None for
+        new objects) and a dict of values keyed by column names, skipping
+        the first *start* rows. Rows found invalid before have their error
+        as the third item and are only reported."""
+        rows = itertools.islice(enumerate(rows), start, None)
+        for chunk in iterate_chunks(rows, self.batch_size):
+            last_row = chunk[-1][0]
+            invalid = [(row, item) for row, item in chunk if len(item) > 2]
+            chunk = [(row, item) for row, item in chunk if len(item) == 2]
+            chunk = zip(
+                [row for row, data in chunk],
+                self._resolve_keys([data for row, data in chunk]),
+            )
+            updates = [
+                (row, asset_id, data) for row, (asset_id, data) in chunk
+                if asset_id is not None
+            ]
+            adds = [
+                (row, data) for row, (asset_id, data) in chunk
+                if asset_id is None
+            ]
+            added_ids = []
+            with transaction.commit_on_success():
+                for row, (asset_id, data, error) in invalid:
+                    self.add_error(
+                        row,
+                        asset_id if asset_id is not None
+                        else tuple(data.values()),
+                        error,
+                    )
+                if updates:
+                    self._update_chunk(updates)
+                if adds:
+                    added_ids = self._add_chunk(adds)
+                self.checkpoint(last_row + 1)
+            if self.Model is Asset:
+                # the grouped updates bypassed post_save signals and the
+                # other processes have to read the rows once committed
+                asset_fuzzy_index.refresh(
+                    [asset_id for row, asset_id, data in updates] + added_ids
+                )
+        # the updates bypassed post_save signals
+        get_lookup_cache().invalidate(self.Model)
+
+    def update(self, rows):
+        """Updates the objects with the data of *rows*, pairs of an id and
+        a dict of values keyed by column names."""
+        self.run(rows)
+
+    def add(self, rows):
+        """Creates objects with the data of *rows*, dicts of values keyed by
+        column names."""
+        self.run((None, data) for data in rows)
+
+
+def _get_row_validator(model_name, mode):
+    """Returns a ``ValueResolver`` for ``ValueResolver.validate`` of the rows
+    imported into *model_name*. Unlike ``get_model_by_name`` it takes the
+    models from the app cache, so it doesn't query the database."""
+    model = get_model(*model_name.split('.'))
+    amd_field = amd_model = None
+    if model is Asset:
+        amd_field, amd_model_name = get_amendment_model(mode)
+        amd_model = get_model(*amd_model_name.split('.'))
+    return ValueResolver(model, mode, amd_field, amd_model, create=False)
+
+
+def _read_sheet(args):
+    """Reads and validates the rows of a sheet and writes them, encoded as
+    lines of a rows file, to a new temporary file. Runs in the worker
+    processes of ``save_spreadsheet_rows``, which share the database
+    connection of the parent, so it must not touch the database. Returns
+    the path of the file, the number of rows and of invalid rows and the
+    time taken, so only these go back to the parent."""
+    token, index, model_name, mode, mappings = args
+    started = time.time()
+    validator = _get_row_validator(model_name, mode)
+    rows = invalid = 0
+    fd, path = tempfile.mkstemp(suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as part_file:
+            for asset_id, data in Spreadsheet(token).rows(index):
+                error = validator.validate(dict(
+                    (mappings[slugify(key)], value)
+                    for key, value in data.iteritems()
+                    if slugify(key) in mappings
+                ))
+                if error is None:
+                    line = json.dumps([asset_id, data])
+                else:
+                    invalid += 1
+                    line = json.dumps([asset_id, data, error])
+                part_file.write(line + b'\n')
+                rows += 1
+    except Exception:
+        os.remove(path)
+        raise
+    return path, rows, invalid, time.time() - started
+
+
+def save_spreadsheet_rows(
+    spreadsheet, model_name, mode, mappings, concurrency=None,
+):
+    """Writes the rows of *spreadsheet*, pairs of an id (or None) and a dict
+    of values, to a new file in the default storage, one JSON list per line.
+    Rows with invalid values (see ``ValueResolver.validate``) of the model
+    *model_name*, with columns mapped to fields by *mappings*, get their
+    error as the third item.
+
+    The sheets are read and validated by a pool of *concurrency* (by default
+    ``ASSETS_IMPORT['CONCURRENCY']``) processes, each writing the rows of its
+    sheet to a temporary file. The files are joined in the order of the
+    sheets, so the rows file doesn't depend on which worker finished first.
+    Returns the name of the file, the number of rows and a list of the
+    ``name``, number of ``rows``, of ``invalid`` rows and ``parse_time`` of
+    every sheet.
+    """
+    names = spreadsheet.sheet_names()
+    tasks = [
+        (spreadsheet.token, index, model_name, mode, mappings)
+        for index in xrange(len(names))
+    ]
+    concurrency = min(
+        concurrency or settings.ASSETS_IMPORT.get('CONCURRENCY', 4),
+        len(tasks),
+    )
+    pool = multiprocessing.Pool(concurrency) if concurrency > 1 else None
+    results = (pool.imap if pool else itertools.imap)(_read_sheet, tasks)
+    sheets = []
+    try:
+        with tempfile.TemporaryFile() as rows_file:
+            for name, (path, rows, invalid, parse_time) in itertools.izip(
+                names, results,
+            ):
+                try:
+                    with open(path, 'rb') as part_file:
+                        shutil.copyfileobj(part_file, rows_file)
+                finally:
+                    os.remove(path)
+                sheets.append({
+                    'name': name,
+                    'rows': rows,
+                    'invalid': invalid,
+                    'parse_time': parse_time,
+                    'import_time': 0,
+                })
+            rows_file.seek(0)
+            file_name = default_storage.save(
+                os.path.join(IMPORT_PATH, '{}.json'.format(uuid.uuid4())),
+                File(rows_file),
+            )
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    return file_name, sum(sheet['rows'] for sheet in sheets), sheets
+
+
+def read_rows(name):
+    """Yields the rows saved with ``save_spreadsheet_rows`` to the file
+    *name*."""
+    rows_file = default_storage.open(name)
+    try:
+        for line in rows_file:
+            yield json.loads(line)
+    finally:
+        rows_file.close()
+
+
+class JobImporter(Importer):
+    """Imports the rows of an ``ImportJob``, saving the number of rows done
+    and their errors in the transaction of every batch."""
+
+    def __init__(self, job, **kwargs):
+        super(JobImporter, self).__init__(
+            job.model, job.mode, json.loads(job.mappings), job.created_by,
+            key=job.key, **kwargs
+        )
+        self.job = job
+        self.job_errors = []
+        self.sheets = json.loads(job.sheets or '[]')
+        self._last_checkpoint = job.checkpoint, time.time()
+        self.rq_job = get_current_job()
+        if self.rq_job:
+            self.rq_job.meta.setdefault('progress', 0)
+            self.rq_job.meta.setdefault('start_progress', None)
+
+    def add_missing(self, row, asset_id):
+        self.add_error(row, asset_id, "Object doesn't exist.")
+
+    def add_error(self, row, key, message):
+        self.job_errors.append(ImportJobError(
+            job=self.job, row=row, key=unicode(key)[:255], message=message,
+        ))
+
+    def _add_import_time(self, start, end, seconds):
+        """Splits the *seconds* taken by the rows from *start* to *end*
+        between their sheets."""
+        if end <= start:
+            return
+        offset = 0
+        for sheet in self.sheets:
+            rows = min(end, offset + sheet['rows']) - max(start, offset)
+            if rows > 0:
+                sheet['import_time'] += seconds * rows / (end - start)
+            offset += sheet['rows']
+
+    def checkpoint(self, count):
+        ImportJobError.objects.bulk_create(self.job_errors)
+        self.job_errors = []
+        start, started = self._last_checkpoint
+        self._last_checkpoint = count, time.time()
+        self._add_import_time(start, count, time.time() - started)
+        _update_job(self.job, checkpoint=count, sheets=json.dumps(self.sheets))
+        set_progress(self.rq_job, self.job.progress)
+
+    def resume(self):
+        """Imports the rows after the last checkpoint."""
+        self.run(read_rows(self.job.rows_file), start=self.job.checkpoint)
+
+
+def _update_job(job, **values):
+    """Sets *values* of *job* and saves only them, so the worker never
+    overwrites what the web process saves meanwhile (e.g. ``rq_job_id``)."""
+    values['modified'] = now()
+    for name, value in values.iteritems():
+        setattr(job, name, value)
+    ImportJob.objects.filter(pk=job.pk).update(**values)
+
+
+def create_import_job(model_name, mode, mappings, user, spreadsheet, key=''):
+    """Returns a new import job for the rows of *spreadsheet*."""
+    job = ImportJob(
+        model=model_name,
+        mode=mode,
+        mappings=json.dumps(mappings),
+        key=key,
+        spreadsheet=spreadsheet.token,
+        created_by=user,
+    )
+    job.save()
+    return job
+
+
+def prepare_import_job(job):
+    """Saves the rows of the spreadsheet of *job* to its rows file. The
+    spreadsheet is deleted afterwards."""
+    spreadsheet = Spreadsheet(job.spreadsheet)
+    rows_file, total, sheets = save_spreadsheet_rows(
+        spreadsheet, job.model, job.mode, json.loads(job.mappings),
+    )
+    _update_job(
+        job, rows_file=rows_file, total=total, sheets=json.dumps(sheets),
+    )
+    spreadsheet.delete()
+
+
+def run_import_job(job_id):
+    """Runs or resumes the import job with *job_id*."""
+    job = ImportJob.objects.get(pk=job_id)
+    if job.status == ImportJobStatus.finished.id:
+        return
+    _update_job(job, status=ImportJobStatus.running.id)
+    try:
+        if not job.rows_file:
+            prepare_import_job(job)
+        JobImporter(job).resume()
+    except Exception:
+        _update_job(job, status=ImportJobStatus.failed.id)
+        raise
+    _update_job(job, status=ImportJobStatus.finished.id)
+    default_storage.delete(job.rows_file)
+
+
+def enqueue_import_job(job):
+    """Runs *job* on the ``ASSETS_IMPORT['QUEUE']`` rq queue or, if no queue
+    is set, right away."""
+    options = settings.ASSETS_IMPORT
+    queue = options.get('QUEUE', 'reports')
+    if not queue:
+        run_import_job(job.id)
+        return
+    # the status is set before the worker can start the job
+    _update_job(job, status=ImportJobStatus.queued.id)
+    rq_job = django_rq.get_queue(queue).enqueue_call(
+        func=run_import_job, args=(job.id,),
+        timeout=options.get('TIMEOUT', 3600),
+    )
+    _update_job(job, rq_job_id=rq_job.id)
+
+
+def can_resume_import_job(job):
+    """Returns True if *job* was interrupted: it has failed, or its rq job
+    has failed or is gone."""
+    if job.status == ImportJobStatus.failed.id:
+        return True
+    if job.status == ImportJobStatus.finished.id or not job.rq_job_id:
+        return False
+    rq_job = django_rq.get_queue(
+        settings.ASSETS_IMPORT.get('QUEUE', 'reports'),
+    ).fetch_job(job.rq_job_id)
+    return rq_job is None or rq_job.is_failed
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""Shared backend of the autocomplete lookup channels.
+
+Results of ``get_query`` are kept in a short-lived, in-process LRU cache keyed
+by the channel and the exact query. Every cached entry remembers which models
+its results depend on and is dropped as soon as an instance of one of them is
+saved or deleted.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+
+class LookupCache(object):
+    """LRU cache of lookup results with a time limit."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, models, value = entry
+            if expires < time.time():
+                return None
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value, models):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.timeout, models, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, model):
+        with self.lock:
+            for key, (_, models, _) in self.entries.items():
+                if issubclass(model, models):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_lookup_cache = None
+_lookup_cache_lock = threading.Lock()
+_watched_models = set()
+
+
+def get_lookup_cache():
+    """Returns the process-wide ``LookupCache``, created on first use."""
+    global _lookup_cache
+    with _lookup_cache_lock:
+        if _lookup_cache is None:
+            options = settings.ASSETS_LOOKUPS
+            _lookup_cache = LookupCache(
+                size=options.get('CACHE_SIZE', 1000),
+                timeout=options.get('CACHE_TIMEOUT', 30),
+            )
+        return _lookup_cache
+
+
+def _invalidate_lookup_cache(sender, **kwargs):
+    get_lookup_cache().invalidate(sender)
+
+
+def cached_query(*models):
+    """Decorator caching results of a ``LookupChannel.get_query`` method.
+
+    *models* are the models the results depend on, saving or deleting any of
+    their instances invalidates the cached results.
+    """
+    for model in models:
+        if model in _watched_models:
+            continue
+        _watched_models.add(model)
+        uid = 'ralph_assets.lookup_cache.{}'.format(model.__name__)
+        post_save.connect(
+            _invalidate_lookup_cache, sender=model, dispatch_uid=uid,
+        )
+        post_delete.connect(
+            _invalidate_lookup_cache, sender=model, dispatch_uid=uid,
+        )
+
+    def decorator(get_query):
+        @functools.wraps(get_query)
+        def wrapper(self, q, request):
+            if not settings.ASSETS_LOOKUPS.get('CACHE_TIMEOUT', 30):
+                return get_query(self, q, request)
+            # keyed by the exact query, lookups may treat case and
+            # whitespace differently
+            key = (self.__class__, q)
+            lookup_cache = get_lookup_cache()
+            result = lookup_cache.get(key)
+            if result is None:
+                result = list(get_query(self, q, request))
+                lookup_cache.set(key, result, models)
+            return result
+        return wrapper
+    return decorator
+
+
+def prefix_query(field, q):
+    """Returns lookup kwargs matching values of *field* starting with *q*.
+
+    With ``ASSETS_LOOKUPS['PREFIX_COLUMNS']`` enabled the lowercase copy of
+    the field (``<field>_lower``) is used, so the database can answer with an
+    index range scan instead of evaluating ``UPPER(...) LIKE`` for each row.
+    """
+    if settings.ASSETS_LOOKUPS.get('PREFIX_COLUMNS', False):
+        return {'{}_lower__startswith'.format(field): q.lower()}
+    return {'{}__istartswith'.format(field): q}
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Remove expired temporary files, selections and import jobs."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import os
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from ralph_assets.importer import IMPORT_PATH
+from ralph_assets.models_assets import ReportOdtSource
+from ralph_assets.models_import import ImportJob, ImportJobStatus
+from ralph_assets.models_selection import AssetSelection
+from ralph_assets.spreadsheet import UPLOAD_PATH
+from ralph_assets.views import CSV_EXPORT_PATH
+
+
+REPORT_EXTENSIONS = ('.odt', '.pdf')
+
+
+class Command(BaseCommand):
+    """Remove the files, selections and import jobs nobody needs anymore.
+
+    Reports left in ``ASSETS_REPORTS['TEMP_STORAGE_PATH']`` (only files named
+    after a report template are touched, the directory may be shared), CSV
+    exports, uploaded spreadsheets and rows files older than ``--max-age``
+    hours are deleted, unless they belong to an import which can still be
+    resumed. Asset selections older than ``--max-age`` hours and finished or
+    failed import jobs older than ``--jobs-max-age`` days are deleted too.
+    Meant to be run periodically, e.g. from cron.
+    """
+
+    help = 'Remove expired temporary files, selections and import jobs.'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--max-age',
+            dest='max_age',
+            type='int',
+            default=24,
+            help='Age in hours after which temporary files expire.',
+        ),
+        make_option(
+            '--jobs-max-age',
+            dest='jobs_max_age',
+            type='int',
+            default=30,
+            help='Age in days after which import jobs expire.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        now = datetime.datetime.now()
+        expired = now - datetime.timedelta(hours=options['max_age'])
+        jobs_expired = now - datetime.timedelta(days=options['jobs_max_age'])
+        jobs = ImportJob.objects.filter(
+            status__in=(
+                ImportJobStatus.finished.id, ImportJobStatus.failed.id,
+            ),
+            modified__lt=jobs_expired,
+        )
+        for job in jobs:
+            names = [job.rows_file]
+            if job.spreadsheet:
+                names.append(os.path.join(UPLOAD_PATH, job.spreadsheet))
+            for name in names:
+                if name and default_storage.exists(name):
+                    default_storage.delete(name)
+        jobs_count = jobs.count()
+        jobs.delete()
+        selections = AssetSelection.objects.filter(created__lt=expired)
+        selections_count = selections.count()
+        selections.delete()
+        files_count = self.remove_reports(expired)
+        in_use = set()
+        for rows_file, spreadsheet in ImportJob.objects.values_list(
+            'rows_file', 'spreadsheet',
+        ):
+            in_use.update((rows_file, os.path.join(UPLOAD_PATH, spreadsheet)))
+        for path in (CSV_EXPORT_PATH, UPLOAD_PATH, IMPORT_PATH):
+            files_count += self.remove_files(path, expired, in_use)
+        self.stdout.write(
+            'Removed {} files, {} selections and {} import jobs.\n'.format(
+                files_count, selections_count, jobs_count,
+            )
+        )
+
+    def remove_reports(self, expired):
+        """Removes the expired reports from the temporary directory."""
+        path = settings.ASSETS_REPORTS['TEMP_STORAGE_PATH']
+        prefixes = tuple(
+            '{}-'.format(slug)
+            for slug in ReportOdtSource.objects.values_list('slug', flat=True)
+        )
+        if not prefixes or not os.path.isdir(path):
+            return 0
+        expired = time.mktime(expired.timetuple())
+        count = 0
+        for file_name in os.listdir(path):
+            full_path = os.path.join(path, file_name)
+            if not (
+                file_name.startswith(prefixes) and
+                file_name.endswith(REPORT_EXTENSIONS)
+            ):
+                continue
+            try:
+                if os.path.getmtime(full_path) < expired:
+                    os.remove(full_path)
+                    count += 1
+            except OSError:
+                # removed by a request in the meantime
+                continue
+        return count
+
+    def remove_files(self, path, expired, in_use):
+        """Removes the files in the storage directory *path* older than
+        *expired*, except for the ones in *in_use*."""
+        try:
+            file_names = default_storage.listdir(path)[1]
+        except OSError:
+            # nothing has been saved there yet
+            return 0
+        count = 0
+        for file_name in file_names:
+            name = os.path.join(path, file_name)
+            if name in in_use:
+                continue
+            if default_storage.modified_time(name) < expired:
+                default_storage.delete(name)
+                count += 1
+        return count
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""Recalculate the ``deprecation_end_date`` column of assets."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ralph_assets.deprecation import get_deprecation_end_date
+from ralph_assets.models_assets import Asset
+from ralph_assets.models_util import iterate_in_chunks
+
+
+class Command(BaseCommand):
+    """Recalculate ``deprecation_end_date`` for all assets.
+
+    Assets are updated with one ``UPDATE`` per distinct end date in a chunk,
+    bypassing ``save`` so no history entries or other signals are emitted.
+    The column is filled in by the migrations, this is only needed when the
+    assets were changed bypassing ``save`` as well.
+    """
+
+    help = 'Recalculate deprecation end dates of all assets.'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            dest='chunk_size',
+            type='int',
+            default=1000,
+            help='Number of assets processed in one transaction.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        queryset = Asset.admin_objects.only(
+            'id', 'invoice_date', 'deprecation_rate', 'deprecation_end_date',
+        )
+        updated = 0
+        for assets in iterate_in_chunks(queryset, options['chunk_size']):
+            ids_per_date = {}
+            for asset in assets:
+                end_date = get_deprecation_end_date(
+                    asset.invoice_date, asset.deprecation_rate,
+                )
+                if end_date != asset.deprecation_end_date:
+                    ids_per_date.setdefault(end_date, []).append(asset.id)
+            with transaction.commit_on_success():
+                for end_date, ids in ids_per_date.iteritems():
+                    Asset.admin_objects.filter(id__in=ids).update(
+                        deprecation_end_date=end_date,
+                    )
+                    updated += len(ids)
+        self.stdout.write('{} assets updated.\n'.format(updated))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+"""Show the PDF report rendering metrics."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ralph_assets.reports import get_report_metrics
+
+
+class Command(BaseCommand):
+    """Print the number of rendered reports, their average render time and
+    the depth of the reports queue."""
+
+    help = 'Show the PDF report rendering metrics.'
+
+    def handle(self, *args, **options):
+        metrics = get_report_metrics()
+        self.stdout.write(
+            'Rendered reports: {}\n'
+            'Average render time: {} ms\n'
+            'Queued jobs: {}\n'.format(
+                metrics['rendered'],
+                metrics['average_ms'],
+                metrics['queue_depth'],
+            )
+        )
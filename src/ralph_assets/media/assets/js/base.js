@@ -15,10 +15,23 @@
         return ids;
     }
 
+    Bulk.prototype.select = function(action, data) {
+        // the selection is stored on the server, the action gets its token
+        var form = $('#selection_form');
+        form.find('input[name!=csrfmiddlewaretoken]').remove();
+        data.action = action;
+        $.each(data, function(name, values) {
+            $.each($.isArray(values) ? values : [values], function(index, value) {
+                $('<input type="hidden">').attr('name', name).val(value).appendTo(form);
+            });
+        });
+        form.submit();
+    };
+
     Bulk.prototype.edit_selected = function() {
         var ids = this.get_ids();
         if (ids.length) {
-            window.location.href = 'bulkedit?select=' + ids.join('&select=');
+            this.select('bulkedit', {select: ids});
         }
         return false;
     };
@@ -26,20 +39,20 @@
     Bulk.prototype.invoice_report_selected = function() {
         var ids = this.get_ids();
         if (ids.length){
-            window.location.href = 'invoice_report?select=' + ids.join('&select=');
+            this.select('invoice_report', {select: ids});
         }
     };
 
     Bulk.prototype.addAttachment = function(type) {
         var ids = this.get_ids();
         if (ids.length){
-            window.location.href = 'add_attachment/' + type + '/?select=' + ids.join('&select=');
+            this.select('add_attachment/' + type, {select: ids});
         }
     };
     Bulk.prototype.invoice_report_search_query = function () {
         var params = window.location.search;
         if (params.length){
-            window.location.href = 'invoice_report' + params + '&from_query=1';
+            this.select('invoice_report', {query: params.substring(1)});
         }
     };
 
@@ -49,7 +62,7 @@
             ids.length &&
             $.inArray(type, ['release-asset', 'return-asset', 'loan-asset']) != -1
         ) {
-            window.location.href = 'transition?select=' + ids.join('&select=') + '&transition_type=' + type;
+            this.select('transition', {select: ids, transition_type: type});
         }
     };
 
@@ -59,7 +72,9 @@
             params.length &&
             $.inArray(type, ['release-asset', 'return-asset', 'loan-asset']) != -1
         ) {
-            window.location.href = 'transition' + params + '&from_query=1&transition_type=' + type;
+            this.select('transition', {
+                query: params.substring(1), transition_type: type
+            });
         }
     };
 
@@ -6,13 +6,13 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import difflib
-
 from ajax_select import LookupChannel
 from django.contrib.auth.models import User
 from django.utils.html import escape
 from django.db.models import Q, F, Count
 
+from ralph_assets.fuzzy import asset_fuzzy_index
+from ralph_assets.lookups import cached_query, prefix_query
 from ralph_assets.models_assets import (
     Asset,
     AssetCategory,
@@ -35,22 +35,25 @@ from ralph_assets.models_sam import (  # noqa
     SoftwareCategory,
 )
 from ralph_assets.models_history import AssetHistoryChange
+from ralph_assets.models_import import ImportJob, ImportJobError
+from ralph_assets.models_selection import AssetSelection
 from ralph_assets.models_transition import (
     Action,
     Transition,
     TransitionsHistory,
 )
-from ralph.discovery.models import Device, DeviceType
+from ralph.discovery.models import Device, DeviceModel, DeviceType
 
 
 class DeviceLookup(LookupChannel):
     model = Asset
 
+    @cached_query(Asset, AssetModel, DeviceInfo)
     def get_query(self, q, request):
         query = Q(
             Q(device_info__gt=0) & Q(
-                Q(barcode__istartswith=q) |
-                Q(sn__istartswith=q) |
+                Q(**prefix_query('barcode', q)) |
+                Q(**prefix_query('sn', q)) |
                 Q(model__name__icontains=q)
             )
         )
@@ -110,15 +113,17 @@ class FreeLicenceLookup(LookupChannel):
 class RalphDeviceLookup(LookupChannel):
     model = Device
 
+    @cached_query(Device, DeviceModel)
     def get_query(self, q, request):
         query = Q(
             Q(
                 Q(barcode__istartswith=q) |
-                Q(id__istartswith=q) |
                 Q(sn__istartswith=q) |
                 Q(model__name__icontains=q)
             )
         )
+        if q.isdigit():
+            query |= Q(id=int(q))
         return Device.objects.filter(query).order_by('sn')[:10]
 
     def get_result(self, obj):
@@ -140,6 +145,7 @@ class RalphDeviceLookup(LookupChannel):
 class AssetLookup(LookupChannel):
     model = Asset
 
+    @cached_query(Asset)
     def get_query(self, q, request):
         return Asset.objects.filter(
             Q(barcode__icontains=q) |
@@ -209,6 +215,7 @@ class AssetManufacturerLookup(LookupChannel):
 class WarehouseLookup(LookupChannel):
     model = Warehouse
 
+    @cached_query(Warehouse)
     def get_query(self, q, request):
         return Warehouse.objects.filter(
             Q(name__icontains=q)
@@ -236,36 +243,14 @@ class BODeviceLookup(DeviceLookup):
 
 class AssetLookupFuzzy(AssetLookup):
     def get_query(self, query, request):
-        dev_ids = Device.objects.filter(
+        dev_ids = set(Device.objects.filter(
             model__type=DeviceType.unknown,
-        ).values_list('id', flat=True)
-        assets = Asset.objects.select_related(
-            'model__name',
-        ).filter(
-            Q(device_info__ralph_device_id=None) |
-            Q(device_info__ralph_device_id__in=dev_ids),
-        ).filter(part_info=None)
-
-        def comparator(asset):
-            seq = "".join(
-                [part or '' for part in
-                    [
-                        asset.sn,
-                        asset.barcode,
-                        asset.model.name,
-                    ]]
-            ).replace(" ", "").lower()
-            ratio = difflib.SequenceMatcher(
-                None,
-                seq,
-                query.replace(" ", "").lower(),
-            ).ratio()
-            if ratio:
-                return 1 / ratio
-            return 999
-
-        assets = sorted(assets, key=comparator)
-        return assets[:10]
+        ).values_list('id', flat=True))
+        asset_ids = asset_fuzzy_index.search(query, dev_ids)
+        assets = Asset.objects.select_related('model').in_bulk(asset_ids)
+        return [
+            assets[asset_id] for asset_id in asset_ids if asset_id in assets
+        ]
 
     def format_match(self, obj):
         ret = obj.__unicode__()
@@ -276,6 +261,7 @@ class AssetLookupFuzzy(AssetLookup):
 class UserLookup(LookupChannel):
     model = User
 
+    @cached_query(User)
     def get_query(self, q, request):
         try:
             q1, q2 = q.split()
@@ -318,10 +304,13 @@ __all__ = [
     'AssetManufacturer',
     'AssetModel',
     'AssetOwner',
+    'AssetSelection',
     'AssetSource',
     'AssetStatus',
     'AssetType',
     'DeviceInfo',
+    'ImportJob',
+    'ImportJobError',
     'OfficeInfo',
     'PartInfo',
     'ReportOdtSource',
@@ -8,11 +8,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import datetime
 import os
 
-from dateutil.relativedelta import relativedelta
-
 from django.contrib.auth.models import User
 from lck.django.choices import Choices
 from lck.django.common.models import (
@@ -39,6 +36,12 @@ from ralph.business.models import Venture
 from ralph.discovery.models_device import Device, DeviceType
 from ralph.discovery.models_util import SavingUser
 
+from ralph_assets.deprecation import (
+    get_deprecation_end_date,
+    get_deprecation_months,
+    is_deprecated,
+)
+
 
 SAVE_PRIORITY = 0
 
@@ -304,9 +307,15 @@ class Asset(TimeTrackable, EditorTrackable, SavingUser, SoftDeletable):
     order_no = models.CharField(max_length=50, null=True, blank=True)
     invoice_date = models.DateField(null=True, blank=True)
     sn = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    sn_lower = models.CharField(
+        max_length=200, null=True, blank=True, db_index=True, editable=False,
+    )
     barcode = models.CharField(
         max_length=200, null=True, blank=True, unique=True, default=None
     )
+    barcode_lower = models.CharField(
+        max_length=200, null=True, blank=True, db_index=True, editable=False,
+    )
     price = models.DecimalField(
         max_digits=10, decimal_places=2, default=0, blank=True, null=True,
     )
@@ -353,6 +362,9 @@ class Asset(TimeTrackable, EditorTrackable, SavingUser, SoftDeletable):
     force_deprecation = models.BooleanField(help_text=(
         'Check if you no longer want to bill for this asset'
     ))
+    deprecation_end_date = models.DateField(
+        null=True, blank=True, db_index=True, editable=False,
+    )
     category = models.ForeignKey('AssetCategory', null=True, blank=True)
     production_year = models.PositiveSmallIntegerField(null=True, blank=True)
     slots = models.FloatField(
@@ -440,10 +452,22 @@ class Asset(TimeTrackable, EditorTrackable, SavingUser, SoftDeletable):
         else:
             return 'device'
 
-    def save(self, commit=True, *args, **kwargs):
+    def update_computed_fields(self):
+        """Cleans up fields and fills the ones derived from others, it has to
+        be called before saving the asset in any way."""
         if self.source == '':
             # XXX: replace '' with null, bec. null=True on model doesn't work
             self.source = None
+        self.sn_lower = self.sn.lower() if self.sn else self.sn
+        self.barcode_lower = (
+            self.barcode.lower() if self.barcode else self.barcode
+        )
+        self.deprecation_end_date = get_deprecation_end_date(
+            self.invoice_date, self.deprecation_rate,
+        )
+
+    def save(self, commit=True, *args, **kwargs):
+        self.update_computed_fields()
         instance = super(Asset, self).save(commit=commit, *args, **kwargs)
         return instance
 
@@ -491,19 +515,15 @@ class Asset(TimeTrackable, EditorTrackable, SavingUser, SoftDeletable):
         super(Asset, self).__init__(*args, **kwargs)
 
     def get_deprecation_months(self):
-        return int(
-            (1 / (self.deprecation_rate / 100) * 12)
-            if self.deprecation_rate else 0
-        )
+        return get_deprecation_months(self.deprecation_rate)
 
     def is_deprecated(self, date=None):
-        date = date or datetime.date.today()
-        if self.force_deprecation or not self.invoice_date:
-            return True
-        deprecation_date = self.invoice_date + relativedelta(
-            months=self.get_deprecation_months(),
+        return is_deprecated(
+            self.invoice_date,
+            self.deprecation_rate,
+            self.force_deprecation,
+            date,
         )
-        return deprecation_date < date
 
     def delete_with_info(self, *args, **kwargs):
         """
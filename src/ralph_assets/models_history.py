@@ -6,6 +6,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 from django.db import models as db
@@ -13,7 +15,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
-from ralph_assets.history import field_changes
+from ralph_assets.history import field_changes, related_objects_cache
 from ralph_assets.models_assets import (
     Asset,
     DeviceInfo,
@@ -22,6 +24,12 @@ from ralph_assets.models_assets import (
 )
 
 
+# keeps SQLite below its limit of 999 parameters per query
+BULK_CREATE_SIZE = 100
+
+_local = threading.local()
+
+
 class AssetHistoryChange(db.Model):
     """Represent a single change of a asset."""
 
@@ -62,18 +70,83 @@ class AssetHistoryChange(db.Model):
         )
 
 
-@receiver(post_save, sender=Asset, dispatch_uid='ralph.history_assets')
-def asset_post_save(sender, instance, raw, using, **kwargs):
-    """A hook for creating ``HistoryChange`` entries when a asset changes."""
-    for field, orig, new in field_changes(instance):
+class HistoryBuffer(object):
+    """Collects history changes to be written with ``bulk_create``."""
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size
+        self.changes = []
+
+    def add(self, changes):
+        self.changes.extend(changes)
+        if self.batch_size and len(self.changes) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        changes, self.changes = self.changes, []
+        _bulk_create(changes)
+
+
+def _bulk_create(changes):
+    for i in xrange(0, len(changes), BULK_CREATE_SIZE):
+        AssetHistoryChange.objects.bulk_create(
+            changes[i:i + BULK_CREATE_SIZE],
+        )
+
+
+@contextmanager
+def bulk_history(batch_size=None):
+    """Defers writing history changes made by the post_save hooks below
+    until the end of the block (or until *batch_size* changes are
+    collected) and writes them in bulk. Nested blocks share the outermost
+    buffer. Related objects rendered in the changes are fetched once per
+    block (see ``related_objects_cache``).
+
+    Collected changes are dropped when the block raises an exception, so it
+    should be used inside the transaction the changes are made in, e.g.::
+
+        with transaction.commit_on_success():
+            with bulk_history():
+                for asset in assets:
+                    asset.save()
+    """
+    if getattr(_local, 'buffer', None) is not None:
+        yield _local.buffer
+        return
+    _local.buffer = HistoryBuffer(batch_size)
+    try:
+        with related_objects_cache():
+            yield _local.buffer
+        _local.buffer.flush()
+    finally:
+        _local.buffer = None
+
+
+def save_history_changes(instance, **kwargs):
+    """Saves changes of *instance* (with *kwargs* pointing at it) or adds
+    them to the current ``bulk_history`` buffer. Call it before the changes
+    are saved when they bypass ``save()`` and so the hooks below."""
+    changes = [
         AssetHistoryChange(
-            asset=instance,
             field_name=field,
             old_value=unicode(orig),
             new_value=unicode(new),
             user=instance.saving_user,
             comment=instance.save_comment,
-        ).save()
+            **kwargs
+        ) for field, orig, new in field_changes(instance)
+    ]
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        _bulk_create(changes)
+    else:
+        buffer.add(changes)
+
+
+@receiver(post_save, sender=Asset, dispatch_uid='ralph.history_assets')
+def asset_post_save(sender, instance, raw, using, **kwargs):
+    """A hook for creating ``HistoryChange`` entries when a asset changes."""
+    save_history_changes(instance, asset=instance)
 
 
 @receiver(post_save, sender=DeviceInfo, dispatch_uid='ralph.history_assets')
@@ -81,15 +154,7 @@ def device_info_post_save(sender, instance, raw, using, **kwargs):
     """A hook for creating ``HistoryChange`` entries
     when a DeviceInfo changes.
     """
-    for field, orig, new in field_changes(instance):
-        AssetHistoryChange(
-            device_info=instance,
-            field_name=field,
-            old_value=unicode(orig),
-            new_value=unicode(new),
-            user=instance.saving_user,
-            comment=instance.save_comment,
-        ).save()
+    save_history_changes(instance, device_info=instance)
 
 
 @receiver(post_save, sender=PartInfo, dispatch_uid='ralph.history_assets')
@@ -97,26 +162,10 @@ def part_info_post_save(sender, instance, raw, using, **kwargs):
     """A hook for creating ``HistoryChange`` entries
     when a PartInfo changes.
     """
-    for field, orig, new in field_changes(instance):
-        AssetHistoryChange(
-            part_info=instance,
-            field_name=field,
-            old_value=unicode(orig),
-            new_value=unicode(new),
-            user=instance.saving_user,
-            comment=instance.save_comment,
-        ).save()
+    save_history_changes(instance, part_info=instance)
 
 
 @receiver(post_save, sender=OfficeInfo, dispatch_uid='ralph.history_assets')
 def office_info_post_save(sender, instance, raw, using, **kwargs):
     """A hook for creating ``HistoryChange`` entries when a Office changes."""
-    for field, orig, new in field_changes(instance):
-        AssetHistoryChange(
-            office_info=instance,
-            field_name=field,
-            old_value=unicode(orig),
-            new_value=unicode(new),
-            user=instance.saving_user,
-            comment=instance.save_comment,
-        ).save()
+    save_history_changes(instance, office_info=instance)
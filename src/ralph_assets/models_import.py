@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Background imports of the rows uploaded with the XLS/CSV wizard.
+
+The rows to import are stored in a file (one JSON object per line) and
+imported by an rq job in checkpointed batches: ``ImportJob.checkpoint`` and
+the ``ImportJobError`` rows of the batch are saved in the batch's
+transaction, so an import interrupted by a crashed worker can be resumed
+right after the last committed batch.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+
+from django.contrib.auth.models import User
+from django.db import models
+from lck.django.choices import Choices
+from lck.django.common.models import TimeTrackable
+
+
+class ImportJobStatus(Choices):
+    _ = Choices.Choice
+
+    queued = _("queued")
+    running = _("running")
+    finished = _("finished")
+    failed = _("failed")
+
+
+def _get_rate(rows, seconds):
+    if not seconds:
+        return None
+    return int(rows / seconds)
+
+
+class ImportJob(TimeTrackable):
+    created_by = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL,
+    )
+    model = models.CharField(max_length=100)
+    mode = models.CharField(max_length=20)
+    mappings = models.TextField()
+    key = models.CharField(max_length=100, blank=True, default='')
+    spreadsheet = models.CharField(max_length=100, blank=True, default='')
+    rows_file = models.CharField(max_length=255)
+    sheets = models.TextField(blank=True, default='')
+    status = models.PositiveSmallIntegerField(
+        choices=ImportJobStatus(), default=ImportJobStatus.queued.id,
+    )
+    total = models.PositiveIntegerField(default=0)
+    checkpoint = models.PositiveIntegerField(default=0)
+    rq_job_id = models.CharField(max_length=100, blank=True, default='')
+
+    def __unicode__(self):
+        return '{} ({})'.format(self.model, self.created)
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 1 if self.is_done else 0
+        return self.checkpoint / self.total
+
+    @property
+    def sheet_stats(self):
+        """The rows of every sheet and how many of them were parsed and
+        imported per second."""
+        stats = []
+        for sheet in json.loads(self.sheets or '[]'):
+            stats.append(dict(
+                sheet,
+                parse_rate=_get_rate(sheet['rows'], sheet['parse_time']),
+                import_rate=_get_rate(sheet['rows'], sheet['import_time']),
+            ))
+        return stats
+
+    @property
+    def is_done(self):
+        return self.status in (
+            ImportJobStatus.finished.id, ImportJobStatus.failed.id,
+        )
+
+
+class ImportJobError(models.Model):
+    job = models.ForeignKey(ImportJob, related_name='errors')
+    row = models.PositiveIntegerField()
+    key = models.CharField(max_length=255)
+    message = models.TextField()
+
+    class Meta:
+        ordering = ('row', 'id')
+
+    def __unicode__(self):
+        return '{}: {}'.format(self.key, self.message)
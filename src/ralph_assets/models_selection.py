@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Selections of assets for bulk operations.
+
+Bulk edit, transitions, invoice reports and attachment upload used to get
+their assets as ``?select=<id>`` parameters, one per asset. An
+``AssetSelection`` is stored instead and the views get its short token,
+joining against its members rather than building ``IN`` lists. Members are
+inserted with ``INSERT ... SELECT``, so selecting the results of a search
+doesn't load them at all.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from uuid import uuid4
+
+from django.contrib.auth.models import User
+from django.db import connections, models, transaction
+from django.db.models.sql.datastructures import EmptyResultSet
+from lck.django.common.models import TimeTrackable
+
+from ralph_assets.models_assets import Asset
+
+
+# keeps SQLite below its limit of 999 parameters per query
+SELECTION_CHUNK_SIZE = 500
+
+
+def _get_token():
+    return uuid4().hex
+
+
+class AssetSelection(TimeTrackable):
+    token = models.CharField(
+        max_length=32, unique=True, default=_get_token, editable=False,
+    )
+    created_by = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL,
+    )
+    assets = models.ManyToManyField(Asset, related_name='selections')
+
+    def __unicode__(self):
+        return self.token
+
+    def _insert_assets(self, queryset):
+        """Adds the assets matched by *queryset* with a single query."""
+        ids = queryset.order_by().values_list('id', flat=True).distinct()
+        try:
+            sql, params = ids.query.get_compiler(ids.db).as_sql()
+        except EmptyResultSet:
+            return
+        connection = connections[ids.db]
+        qn = connection.ops.quote_name
+        through = self.assets.through._meta
+        cursor = connection.cursor()
+        cursor.execute(
+            'INSERT INTO {} ({}, {}) SELECT %s, U.{} FROM ({}) U'.format(
+                qn(through.db_table),
+                qn(through.get_field('assetselection').column),
+                qn(through.get_field('asset').column),
+                qn('id'),
+                sql,
+            ),
+            (self.pk,) + tuple(params),
+        )
+        transaction.commit_unless_managed(using=ids.db)
+
+    @classmethod
+    def from_queryset(cls, queryset, user=None):
+        """Returns a new selection of the assets matched by *queryset*."""
+        selection = cls(created_by=user)
+        selection.save()
+        selection._insert_assets(queryset)
+        return selection
+
+    @classmethod
+    def from_ids(cls, ids, user=None):
+        """Returns a new selection of the existing assets with *ids*."""
+        ids = sorted(set(int(id) for id in ids))
+        selection = cls(created_by=user)
+        selection.save()
+        for i in xrange(0, len(ids), SELECTION_CHUNK_SIZE):
+            selection._insert_assets(Asset._default_manager.filter(
+                pk__in=ids[i:i + SELECTION_CHUNK_SIZE],
+            ))
+        return selection
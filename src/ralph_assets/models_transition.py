@@ -10,7 +10,6 @@ import os
 import logging
 
 from django.contrib.auth.models import User
-from django.core.files.base import ContentFile
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from lck.django.common.models import (
@@ -20,6 +19,7 @@ from lck.django.common.models import (
 )
 
 from ralph_assets.models_assets import Asset, AssetStatus
+from ralph_assets.reports import store_report
 
 
 logger = logging.getLogger(__name__)
@@ -83,19 +83,22 @@ class TransitionsHistory(TimeTrackable, WithConcurrentGetOrCreate):
         transition_history.report_filename = report_filename
         transition_history.uid = uid
         try:
-            with open(report_file_path, 'rb') as f:
-                content = f.read()
-                f.close()
-                content = ContentFile(content)
-                transition_history.report_file.save(
-                    report_filename, content, save=True,
-                )
-        except IOError as e:
+            transition_history.report_file.name = store_report(
+                report_file_path,
+                _get_file_path(transition_history, report_filename),
+            )
+        except (IOError, OSError) as e:
             logger.error(
                 "Can not read report file: {} ({})".format(
                     report_file_path, e,
                 ),
             )
-        transition_history.save()
-        transition_history.assets.add(*assets)
+        try:
+            transition_history.save()
+            transition_history.assets.add(*assets)
+        except Exception:
+            # the row is rolled back, so is the report
+            if transition_history.report_file:
+                transition_history.report_file.delete(save=False)
+            raise
         return transition_history
@@ -18,3 +18,51 @@ class SavingUser(db.Model):
     def save(self, user=None, *args, **kwargs):
         self.saving_user = user
         return super(SavingUser, self).save(*args, **kwargs)
+
+
+def iterate_in_chunks(queryset, chunk_size):
+    """Yield lists of objects from *queryset*, *chunk_size* rows at a time.
+
+    Chunks are fetched by primary key ranges (not OFFSET), so every chunk
+    costs the same regardless of how deep into the table it is.
+    """
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk_query = queryset
+        if last_pk is not None:
+            chunk_query = chunk_query.filter(pk__gt=last_pk)
+        chunk = list(chunk_query[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def iterate_ordered_chunks(queryset, chunk_size):
+    """Yield lists of objects from *queryset*, *chunk_size* rows at a time,
+    keeping the order of the queryset.
+
+    Ordered querysets are fetched with OFFSET, the primary key breaking ties
+    so no row is skipped or repeated between chunks. Unordered ones are
+    handed over to ``iterate_in_chunks``.
+    """
+    if not queryset.ordered:
+        for chunk in iterate_in_chunks(queryset, chunk_size):
+            yield chunk
+        return
+    ordering = list(queryset.query.order_by)
+    if not ordering:
+        ordering = list(queryset.model._meta.ordering)
+    queryset = queryset.order_by(*(ordering + ['pk']))
+    offset = 0
+    while True:
+        chunk = list(queryset[offset:offset + chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        offset += chunk_size
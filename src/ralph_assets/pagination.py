@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""Keyset ("seek") pagination of the asset search results.
+
+``KeysetPaginator`` orders the results by the sort column and ``id``. Every
+rendered page remembers (in the cache) the sort key of the first row of the
+page and of the page following it, so walking through the results page by
+page fetches them with an indexed ``WHERE (sort, id) >= cursor`` range
+instead of an ever growing ``OFFSET``. The first ``OFFSET_PAGES`` pages, and
+any page without a known cursor (e.g. reached by a direct link), are still
+fetched with ``OFFSET``, so jumping around near the start works as before.
+
+The total number of results comes from ``get_cached_count``: a count cached
+per query which is served stale and refreshed by an rq job once it gets old.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import time
+
+import django_rq
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
+
+
+# backends sorting NULL values after all other values in ascending order
+NULLS_LAST_VENDORS = ('oracle', 'postgresql')
+
+
+def _get_cache_key(prefix, queryset, *args):
+    """Returns a cache key identifying the SQL of *queryset* or None, when
+    the queryset can't match anything.
+    """
+    try:
+        sql = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return None
+    digest = hashlib.md5(repr((sql, args))).hexdigest()
+    return 'ralph_assets.{}.{}'.format(prefix, digest)
+
+
+def refresh_count(key, model, query):
+    """Counts the results of *query* and stores them under *key*."""
+    queryset = model._default_manager.all()
+    queryset.query = query
+    cache.set(
+        key, (queryset.count(), time.time()),
+        settings.ASSETS_SEARCH.get('COUNT_MAX_AGE', 3600),
+    )
+
+
+def get_cached_count(queryset):
+    """Returns the (possibly stale) number of results of *queryset*.
+
+    The count is computed in place only when it is not cached at all. Once
+    it is older than ``COUNT_REFRESH`` seconds, a refresh is enqueued on
+    ``COUNT_QUEUE`` (or done in place, if no queue is set) and the old value
+    is returned in the meantime.
+    """
+    options = settings.ASSETS_SEARCH
+    queryset = queryset.order_by()
+    key = _get_cache_key('count', queryset)
+    if key is None:
+        return 0
+    cached = cache.get(key)
+    if cached is None:
+        count = queryset.count()
+        cache.set(
+            key, (count, time.time()), options.get('COUNT_MAX_AGE', 3600),
+        )
+        return count
+    count, counted_at = cached
+    refresh = options.get('COUNT_REFRESH', 60)
+    if (
+        time.time() - counted_at > refresh and
+        cache.add(key + '.refresh', True, refresh)
+    ):
+        queue = options.get('COUNT_QUEUE', 'default')
+        if queue:
+            django_rq.get_queue(queue).enqueue(
+                refresh_count, key, queryset.model, queryset.query,
+            )
+        else:
+            refresh_count(key, queryset.model, queryset.query)
+    return count
+
+
+class KeysetPaginator(Paginator):
+    """Paginator seeking pages by the *sort* column (as set by
+    ``DataTableMixin.sort_queryset``) and ``id``.
+
+    Seeking is used only for sorting by a local, non-relational field (or by
+    ``id`` when no sort is given), other sorts always use ``OFFSET``.
+    """
+
+    def __init__(self, object_list, per_page, sort=None, offset_pages=None,
+                 **kwargs):
+        self.descending = bool(sort) and sort.startswith('-')
+        self.seek_field = self._get_seek_field(
+            object_list.model, (sort or 'id').lstrip('-'),
+        )
+        ordering = [sort] if sort else []
+        if (sort or '').lstrip('-') != 'id':
+            ordering.append('-id' if self.descending else 'id')
+        object_list = object_list.order_by(*ordering)
+        if offset_pages is None:
+            offset_pages = settings.ASSETS_SEARCH.get('OFFSET_PAGES', 5)
+        self.offset_pages = offset_pages
+        self.cursor_key = _get_cache_key('cursor', object_list, per_page)
+        self.can_seek = (
+            self.seek_field is not None and self.cursor_key is not None
+        )
+        super(KeysetPaginator, self).__init__(object_list, per_page, **kwargs)
+
+    def _get_seek_field(self, model, name):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if field.rel:
+            return None
+        return field
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = get_cached_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+    def _get_cursor(self, row):
+        return getattr(row, self.seek_field.attname), row.id
+
+    def _remember_cursor(self, number, row):
+        if number > self.offset_pages:
+            cache.set(
+                '{}.{}'.format(self.cursor_key, number),
+                self._get_cursor(row),
+                settings.ASSETS_SEARCH.get('CURSOR_TIMEOUT', 3600),
+            )
+
+    def _get_seek_query(self, value, id):
+        """Returns a ``Q`` matching the rows at or after the cursor."""
+        name = self.seek_field.name
+        op = 'lt' if self.descending else 'gt'
+        query = Q(**{'id__{}e'.format(op): id})
+        if name == 'id':
+            return query
+        vendor = connections[self.object_list.db].vendor
+        nulls_after = (vendor in NULLS_LAST_VENDORS) != self.descending
+        if value is None:
+            query &= Q(**{name: None})
+            if not nulls_after:
+                query |= Q(**{'{}__isnull'.format(name): False})
+            return query
+        query = (
+            Q(**{'{}__{}'.format(name, op): value}) |
+            (Q(**{name: value}) & query)
+        )
+        if nulls_after:
+            query |= Q(**{name: None})
+        return query
+
+    def page(self, number):
+        number = self.validate_number(number)
+        cursor = None
+        if self.can_seek and number > self.offset_pages:
+            cursor = cache.get('{}.{}'.format(self.cursor_key, number))
+        if cursor is not None:
+            rows = list(self.object_list.filter(
+                self._get_seek_query(*cursor),
+            )[:self.per_page + 1])
+        else:
+            bottom = (number - 1) * self.per_page
+            rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if self.can_seek and rows:
+            self._remember_cursor(number, rows[0])
+            if len(rows) > self.per_page:
+                self._remember_cursor(number + 1, rows[self.per_page])
+        return Page(rows[:self.per_page], number, self)
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+"""Rendering of the PDF reports (invoices and transition handover documents).
+
+A report template is an ODT file whose ``content.xml`` and ``styles.xml``
+are Django templates. The parsed templates, and the other members of the
+archive, are kept in a process-wide cache keyed by the path and mtime of the
+template file, so a long-living rq worker reads and compiles each template
+once. Rendering fills the templates in and writes the ODT archive straight
+from memory; the conversion to PDF is done by the external script configured
+in ``INKPY['script_path']``, called with the paths of the ODT and PDF files,
+so a batch of reports is converted by ``CONCURRENCY`` such processes at a
+time. The files are the same as those of ``inkpy.api.generate_pdf``, which
+renders the same members with a temporary copy of the template on disk.
+
+Render times are added up in the cache; ``get_report_metrics`` returns them
+together with the number of jobs waiting in the reports queue.
+
+Generated files are handed over without reading them: ``store_report``
+hard-links (or moves) them into a file system storage, ``open_report`` opens
+and unlinks a file which is then streamed to the client. Files left behind
+by failed requests are expired by the ``assets_cleanup`` command.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import errno
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import django_rq
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.template import Context, Template
+
+from ralph_assets.models_assets import ReportOdtSource
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_MEMBERS = ('content.xml', 'styles.xml')
+METRICS_TIMEOUT = 30 * 24 * 3600
+
+
+class ReportError(Exception):
+    """A report could not be rendered."""
+
+
+class TemplateCache(object):
+    """LRU cache of parsed ODT templates keyed by the path and mtime of the
+    template file."""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def _load(self, path):
+        """Returns a list of ``(ZipInfo, Template or bytes)`` of the members
+        of the ODT file *path*."""
+        members = []
+        with zipfile.ZipFile(path) as odt:
+            for info in odt.infolist():
+                content = odt.read(info)
+                if info.filename in TEMPLATE_MEMBERS:
+                    content = Template(content.decode('utf-8'))
+                members.append((info, content))
+        return members
+
+    def get(self, path):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError as e:
+            raise ReportError('Can not read template {}: {}'.format(path, e))
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None and entry[0] == mtime:
+                self.entries[path] = entry
+                return entry[1]
+        members = self._load(path)
+        with self.lock:
+            self.entries.pop(path, None)
+            self.entries[path] = (mtime, members)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return members
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_template_cache = None
+_template_cache_lock = threading.Lock()
+
+
+def get_template_cache():
+    """Returns the process-wide ``TemplateCache``, created on first use."""
+    global _template_cache
+    with _template_cache_lock:
+        if _template_cache is None:
+            _template_cache = TemplateCache(
+                settings.ASSETS_REPORTS.get('CACHE_SIZE', 20),
+            )
+        return _template_cache
+
+
+def get_output_path(file_name):
+    return os.path.join(
+        settings.ASSETS_REPORTS['TEMP_STORAGE_PATH'], file_name,
+    )
+
+
+def render_odt(source_path, odt_path, data):
+    """Fills the template *source_path* in with *data* and writes the ODT
+    archive to *odt_path*."""
+    context = Context(data)
+    # members are written in their original order, with their original
+    # compression, so ``mimetype`` stays the first, uncompressed one
+    with zipfile.ZipFile(odt_path, 'w') as odt:
+        for info, content in get_template_cache().get(source_path):
+            if isinstance(content, Template):
+                content = content.render(context).encode('utf-8')
+            # ``writestr`` updates the ZipInfo, the cached one is shared
+            member = zipfile.ZipInfo(info.filename, info.date_time)
+            member.compress_type = info.compress_type
+            member.external_attr = info.external_attr
+            odt.writestr(member, content)
+
+
+def convert_to_pdf(odt_path, output_path):
+    """Converts *odt_path* to the PDF file *output_path* and removes the ODT
+    file."""
+    try:
+        returncode = subprocess.call([
+            sys.executable,
+            settings.INKPY['script_path'],
+            odt_path,
+            output_path,
+        ])
+    finally:
+        os.remove(odt_path)
+    if returncode or not os.path.exists(output_path):
+        raise ReportError(
+            'Conversion of {} to PDF failed ({}).'.format(odt_path, returncode)
+        )
+
+
+def _record_render(count, seconds):
+    for key, value in (
+        ('ralph_assets.reports.rendered', count),
+        ('ralph_assets.reports.render_ms', int(seconds * 1000)),
+    ):
+        cache.add(key, 0, METRICS_TIMEOUT)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            # the key expired in the meantime
+            cache.set(key, value, METRICS_TIMEOUT)
+
+
+def render_reports(template_file, reports):
+    """Renders the PDF reports *reports*, a list of ``(file name, data)``
+    pairs, from the ``ReportOdtSource`` *template_file*. Returns the paths of
+    the generated files."""
+    started = time.time()
+    source_path = template_file.template.path
+    paths = []
+    for file_name, data in reports:
+        output_path = get_output_path(file_name)
+        render_odt(source_path, output_path[:-3] + 'odt', data)
+        paths.append(output_path)
+    jobs = [(path[:-3] + 'odt', path) for path in paths]
+    if len(jobs) == 1:
+        convert_to_pdf(*jobs[0])
+    else:
+        pool = ThreadPool(settings.ASSETS_REPORTS.get('CONCURRENCY', 4))
+        try:
+            pool.map(lambda job: convert_to_pdf(*job), jobs)
+        finally:
+            pool.close()
+            pool.join()
+    seconds = time.time() - started
+    _record_render(len(paths), seconds)
+    logger.info(
+        'Rendered {} {} report(s) in {:.2f}s.'.format(
+            len(paths), template_file.slug, seconds,
+        )
+    )
+    return paths
+
+
+def render_report(template_file, file_name, data):
+    """Renders a single PDF report and returns its path."""
+    return render_reports(template_file, [(file_name, data)])[0]
+
+
+def run_render_reports(template_file_id, reports):
+    """The rq job rendering *reports* from the template *template_file_id*.
+    """
+    return render_reports(
+        ReportOdtSource.objects.get(pk=template_file_id), reports,
+    )
+
+
+def enqueue_reports(template_file, reports):
+    """Renders *reports* in the reports queue and returns the id of the job,
+    its result is the list of paths of the generated files. The data of the
+    reports has to be picklable."""
+    options = settings.ASSETS_REPORTS
+    return django_rq.get_queue(options.get('QUEUE', 'reports')).enqueue_call(
+        func=run_render_reports,
+        args=(template_file.id, reports),
+        timeout=options.get('TIMEOUT', 600),
+    ).id
+
+
+def store_report(path, name):
+    """Moves the generated file *path* to the default storage as *name*
+    and returns the name it was saved under. Files are hard-linked (or
+    moved, when the storage is on another file system) when the storage
+    keeps them on the local disk and copied in chunks otherwise."""
+    try:
+        default_storage.path('')
+    except NotImplementedError:
+        with open(path, 'rb') as f:
+            name = default_storage.save(name, File(f))
+        os.remove(path)
+        return name
+    name = default_storage.get_available_name(name)
+    full_path = default_storage.path(name)
+    directory = os.path.dirname(full_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    try:
+        os.link(path, full_path)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        shutil.move(path, full_path)
+    else:
+        os.remove(path)
+    return name
+
+
+def open_report(path):
+    """Opens the generated file *path* for reading and removes it from the
+    disk, it is gone as soon as the returned file is closed."""
+    f = open(path, 'rb')
+    os.remove(path)
+    return f
+
+
+def get_report_metrics():
+    """Returns the number of rendered reports, their average render time in
+    milliseconds and the number of jobs waiting in the reports queue."""
+    rendered = cache.get('ralph_assets.reports.rendered') or 0
+    render_ms = cache.get('ralph_assets.reports.render_ms') or 0
+    return {
+        'rendered': rendered,
+        'average_ms': render_ms // rendered if rendered else None,
+        'queue_depth': django_rq.get_queue(
+            settings.ASSETS_REPORTS.get('QUEUE', 'reports'),
+        ).count,
+    }
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""Declarative compiler of the asset search queries.
+
+Every search parameter is described by a filter of ``ASSET_SEARCH_FILTERS``
+which knows how to turn the parameter's value into a ``Q`` object: an exact
+match, a (case insensitive) substring match, a date range, a match of a
+category together with its children or a fixed query chosen by value.
+
+``asset_search_compiler.compile(request.GET)`` combines the queries of all
+the given parameters into one. Compiled queries are cached by the values of
+the search parameters, so repeating a search (paging, sorting, exporting)
+doesn't compile it, nor query the category tree, again.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import datetime
+import re
+import threading
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.signals import post_delete, post_save
+
+from ralph_assets.deprecation import get_deprecated_query
+from ralph_assets.lookups import LookupCache
+from ralph_assets.models_assets import AssetCategory
+
+
+QUOTATION_MARKS = re.compile(r"^\".+\"$")
+
+
+class SearchFilter(object):
+    """Base class of the search filters.
+
+    :param name: name of the search parameter
+    :param path: lookup path of the filtered field, defaults to *name*
+    """
+
+    # models the compiled query depends on
+    depends_on = ()
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path or name
+
+    def get_params(self):
+        return (self.name,)
+
+    def compile(self, data):
+        """Returns the query for the search parameters in *data* or None,
+        when the filter isn't used."""
+        value = data.get(self.name)
+        if not value:
+            return None
+        # if search term is enclosed in "", we want exact matches
+        exact = bool(QUOTATION_MARKS.search(value))
+        if exact:
+            value = value[1:-1]
+        return self.get_query(value, exact)
+
+    def get_query(self, value, exact):
+        """Returns the query matching *value*, by default the values of the
+        field equal to it."""
+        return Q(**{self.path: value})
+
+
+class ExactFilter(SearchFilter):
+    """Matches the value as it is, optionally converted by *parse*."""
+
+    def __init__(self, name, path=None, parse=None):
+        super(ExactFilter, self).__init__(name, path)
+        self.parse = parse
+
+    def get_query(self, value, exact):
+        if self.parse:
+            value = self.parse(value)
+        return super(ExactFilter, self).get_query(value, exact)
+
+
+class IContainsFilter(SearchFilter):
+    """Matches values containing the searched text or, for quoted texts,
+    equal to it."""
+
+    def __init__(self, name, path=None, lookup='icontains'):
+        super(IContainsFilter, self).__init__(name, path)
+        self.lookup = lookup
+
+    def get_query(self, value, exact):
+        if exact:
+            return Q(**{self.path: value})
+        return Q(**{'{}__{}'.format(self.path, self.lookup): value})
+
+
+class RangeFilter(SearchFilter):
+    """Matches values between the ``<name>_from`` and ``<name>_to``
+    parameters (both inclusive and optional)."""
+
+    def get_params(self):
+        return (self.name + '_from', self.name + '_to')
+
+    def compile(self, data):
+        start, end = (data.get(param) for param in self.get_params())
+        if not start and not end:
+            return None
+        query = Q()
+        if start:
+            query &= Q(**{self.path + '__gte': start})
+        if end:
+            query &= Q(**{self.path + '__lte': end})
+        return query
+
+
+class TreeFilter(SearchFilter):
+    """Matches a node of a tree model (given by its primary key) and its
+    children."""
+
+    def __init__(self, name, model, path=None):
+        super(TreeFilter, self).__init__(name, path)
+        self.model = model
+        self.depends_on = (model,)
+
+    def get_query(self, value, exact):
+        keys = [value]
+        try:
+            node = self.model.objects.get(pk=value)
+        except self.model.DoesNotExist:
+            pass
+        else:
+            keys.extend(child.pk for child in node.get_children())
+        return Q(**{self.path + '__in': keys})
+
+
+class ChoiceFilter(SearchFilter):
+    """Maps (case insensitively) values of the parameter to queries. A query
+    can be given as a callable, which is called on every compilation.
+    Other values are ignored."""
+
+    def __init__(self, name, choices):
+        super(ChoiceFilter, self).__init__(name)
+        self.choices = choices
+
+    def get_query(self, value, exact):
+        query = self.choices.get(value.lower())
+        if callable(query):
+            query = query()
+        return query
+
+
+def _parse_ids(value):
+    return [int(id) for id in value.split(",")]
+
+
+ASSET_SEARCH_FILTERS = [
+    ExactFilter('id', 'id__in', parse=_parse_ids),
+    ExactFilter('selection', 'selections__token'),
+    IContainsFilter('niw'),
+    TreeFilter('category', AssetCategory, 'category_id'),
+    IContainsFilter('invoice_no'),
+    IContainsFilter('model', 'model__name'),
+    IContainsFilter('order_no'),
+    ChoiceFilter('part_info', {
+        'device': Q(part_info__isnull=True),
+        'part': Q(part_info__gte=0),
+    }),
+    IContainsFilter('provider'),
+    IContainsFilter('sn'),
+    ExactFilter('status'),
+    ChoiceFilter('deleted', {'on': Q(deleted__in=(True, False))}),
+    IContainsFilter('manufacturer', 'model__manufacturer__name'),
+    IContainsFilter('barcode', lookup='contains'),
+    ExactFilter('device_info'),
+    ExactFilter('source'),
+    ChoiceFilter('deprecation_rate', {
+        'null': Q(deprecation_rate__isnull=True),
+        'deprecated': get_deprecated_query,
+        '6': Q(deprecation_rate__gt=0, deprecation_rate__lte=6),
+        '12': Q(deprecation_rate__gt=6, deprecation_rate__lte=12),
+        '24': Q(deprecation_rate__gt=12, deprecation_rate__lte=24),
+        '48': Q(deprecation_rate__gt=24, deprecation_rate__lte=48),
+        '48<': Q(deprecation_rate__gt=48),
+    }),
+    ChoiceFilter('unlinked', {
+        'on': ~Q(device_info=None) & Q(device_info__ralph_device_id=None),
+    }),
+    IContainsFilter('ralph_device_id', 'device_info__ralph_device_id'),
+    IContainsFilter('task_url'),
+    IContainsFilter('imei', 'office_info__imei'),
+    ExactFilter('guardian', 'guardian__id'),
+    ExactFilter('user', 'user__id'),
+    ExactFilter('purpose', 'office_info__purpose'),
+    RangeFilter('invoice_date'),
+    RangeFilter('request_date'),
+    RangeFilter('delivery_date'),
+    RangeFilter('production_use_date'),
+    RangeFilter('provider_order_date'),
+    RangeFilter('loan_end_date'),
+]
+
+
+class SearchQueryCompiler(object):
+    """Compiles search parameters into a single ``Q`` object using
+    *filters*."""
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.params = [
+            param for search_filter in filters
+            for param in search_filter.get_params()
+        ]
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        for model in set(
+            model for search_filter in filters
+            for model in search_filter.depends_on
+        ):
+            post_save.connect(self._invalidate, sender=model, weak=False)
+            post_delete.connect(self._invalidate, sender=model, weak=False)
+
+    @property
+    def cache(self):
+        """The cache of compiled queries, created on first use."""
+        with self._cache_lock:
+            if self._cache is None:
+                options = settings.ASSETS_SEARCH
+                self._cache = LookupCache(
+                    size=options.get('PLAN_CACHE_SIZE', 100),
+                    timeout=options.get('PLAN_CACHE_TIMEOUT', 300),
+                )
+            return self._cache
+
+    def _invalidate(self, sender, **kwargs):
+        self.cache.invalidate(sender)
+
+    def get_signature(self, data):
+        """Returns the values of the search parameters given in *data*."""
+        return tuple(
+            (param, data.get(param)) for param in self.params
+            if data.get(param)
+        )
+
+    def compile(self, data):
+        """Returns the query for the search parameters in *data*, a dict or
+        a ``QueryDict``."""
+        # queries may depend on the current date (e.g. deprecation)
+        key = (datetime.date.today(), self.get_signature(data))
+        query = self.cache.get(key)
+        if query is None:
+            query = Q()
+            depends_on = set()
+            for search_filter in self.filters:
+                filter_query = search_filter.compile(data)
+                if filter_query is not None:
+                    query &= filter_query
+                    depends_on.update(search_filter.depends_on)
+            self.cache.set(key, query, tuple(depends_on))
+        return copy.deepcopy(query)
+
+
+def get_select_related(model, columns):
+    """Returns names of the relations of *model* shown in data table
+    *columns*, either as the column's field or its foreign field."""
+    related = set()
+    for column in columns:
+        for name in (column.field, column.foreign_field_name):
+            if not name:
+                continue
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.rel:
+                related.add(name)
+    return sorted(related)
+
+
+asset_search_compiler = SearchQueryCompiler(ASSET_SEARCH_FILTERS)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""Lazy reading of the spreadsheets uploaded with the XLS/CSV wizard.
+
+An upload is spooled to the default storage once and referenced by its
+token afterwards, so the wizard keeps a short string in the session rather
+than the file or its parsed rows. The rows are read one at a time: CSV files
+with the ``csv`` module and XLSX workbooks with openpyxl in read-only mode.
+Listing the columns reads only the first row of every sheet.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import csv
+import datetime
+import itertools
+import os
+import re
+from uuid import uuid4
+from zipfile import BadZipfile
+
+import openpyxl
+from django.core.files.storage import default_storage
+from django.template.defaultfilters import slugify
+from openpyxl.utils.exceptions import InvalidFileException
+
+
+UPLOAD_PATH = 'assets/uploads'
+TOKEN_RE = re.compile(r'^[0-9a-f]{32}\.(csv|xlsx)$')
+
+
+def _iterate_csv(file_):
+    for number, row in enumerate(csv.reader(file_), 1):
+        try:
+            yield [cell.decode('utf-8') for cell in row]
+        except UnicodeDecodeError:
+            raise ValueError(
+                'Problems with character encoding in row {}. '
+                'Use UTF-8.'.format(number)
+            )
+
+
+def _get_xlsx_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if value.time() == datetime.time():
+            value = value.date()
+        return value.isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _load_xlsx(file_):
+    try:
+        return openpyxl.load_workbook(file_, read_only=True, data_only=True)
+    except (BadZipfile, InvalidFileException, KeyError):
+        raise ValueError('The file is not a valid XLSX workbook.')
+
+
+def _iterate_xlsx(file_, index=None):
+    sheets = _load_xlsx(file_).worksheets
+    if index is not None:
+        sheets = sheets[index:index + 1]
+    for sheet in sheets:
+        yield sheet.title, (
+            [_get_xlsx_value(cell.value) for cell in row]
+            for row in sheet.iter_rows()
+        )
+
+
+def _split_header(names):
+    """Returns the column names of a header row and whether the sheet is an
+    update (its first column is ``id``)."""
+    names = [unicode(name) for name in names]
+    update = bool(names) and names[0] == 'id'
+    return (names[1:] if update else names), update
+
+
+class Spreadsheet(object):
+    """An uploaded CSV file or XLSX workbook, spooled to the default
+    storage."""
+
+    def __init__(self, token):
+        if not TOKEN_RE.match(token):
+            raise ValueError('Invalid spreadsheet token: {!r}'.format(token))
+        self.token = token
+        self.filetype = token.rsplit('.', 1)[1]
+        self.name = os.path.join(UPLOAD_PATH, token)
+
+    @classmethod
+    def spool(cls, file_, filetype):
+        """Saves the uploaded *file_* and returns it as a spreadsheet."""
+        name = default_storage.save(
+            os.path.join(UPLOAD_PATH, '{}.{}'.format(uuid4().hex, filetype)),
+            file_,
+        )
+        return cls(os.path.basename(name))
+
+    def _iterate_sheets(self, index=None):
+        """Yields pairs of a sheet name and an iterator over its rows, lists
+        of cell values, of all sheets or of the *index*-th one."""
+        spool = default_storage.open(self.name)
+        try:
+            if self.filetype == 'csv':
+                yield 'csv', _iterate_csv(spool)
+            else:
+                for sheet in _iterate_xlsx(spool, index):
+                    yield sheet
+        finally:
+            spool.close()
+
+    def sheet_names(self):
+        """Returns the names of all sheets without reading their rows."""
+        if self.filetype == 'csv':
+            return ['csv']
+        spool = default_storage.open(self.name)
+        try:
+            return [sheet.title for sheet in _load_xlsx(spool).worksheets]
+        finally:
+            spool.close()
+
+    def headers(self):
+        """Returns a list of ``(sheet name, column names, update)`` of every
+        sheet which has a header row."""
+        headers = []
+        for sheet_name, rows in self._iterate_sheets():
+            names = next(rows, None)
+            if names:
+                headers.append((sheet_name,) + _split_header(names))
+        return headers
+
+    def rows(self, index=None):
+        """Yields the rows of all sheets, or of the *index*-th one, as pairs
+        of the id of the updated object (None for new objects) and a dict of
+        values keyed by the slugified column names. Blank rows are
+        skipped."""
+        for sheet_name, rows in self._iterate_sheets(index):
+            names = next(rows, None)
+            if not names:
+                continue
+            names, update = _split_header(names)
+            keys = [slugify(name) for name in names]
+            for number, row in enumerate(rows, 2):
+                if all(value == '' for value in row):
+                    continue
+                if not update:
+                    yield None, dict(itertools.izip(keys, row))
+                    continue
+                try:
+                    asset_id = int(row[0])
+                except (IndexError, TypeError, ValueError):
+                    raise ValueError(
+                        'Invalid id in row {} of sheet {}.'.format(
+                            number, sheet_name,
+                        )
+                    )
+                yield asset_id, dict(itertools.izip(keys, row[1:]))
+
+    def delete(self):
+        default_storage.delete(self.name)
@@ -7,7 +7,10 @@ from __future__ import unicode_literals
 
 from django.test import TestCase
 
-from ralph_assets.models_assets import AssetStatus
+from ralph_assets.deprecation import get_deprecation_end_date
+from ralph_assets.models_assets import Asset, AssetStatus
+from ralph_assets.models_history import AssetHistoryChange
+from ralph_assets.models_selection import AssetSelection
 from ralph_assets.tests.util import (
     create_asset,
     create_model,
@@ -123,3 +126,53 @@ class TestBulkEdit(TestCase):
                     unicode(getattr(fields[counter], key)), unicode(data[key])
                 )
             counter += 1
+
+    def test_bulkedit_updates_history_and_computed_fields(self):
+        url = '/assets/dc/bulkedit/?select=%s&select=%s' % (
+            self.asset.id, self.asset1.id)
+        row = {
+            'model': self.model.id,
+            'invoice_no': 'Invoice No1',
+            'invoice_date': '2012-02-02',
+            'provider': 'Provider1',
+        }
+        post_data = get_bulk_edit_post_data(dict(row), dict(row))
+        response = self.client.post(url, post_data, follow=True)
+        self.assertTrue('Changes saved.' in response.content)
+        for asset in Asset.objects.filter(
+            pk__in=[self.asset.id, self.asset1.id],
+        ):
+            self.assertEqual(asset.provider, 'Provider1')
+            self.assertEqual(asset.sn_lower, asset.sn.lower())
+            self.assertEqual(
+                asset.deprecation_end_date,
+                get_deprecation_end_date(
+                    asset.invoice_date, asset.deprecation_rate,
+                ),
+            )
+            self.assertTrue(AssetHistoryChange.objects.filter(
+                asset=asset, field_name='provider', new_value='Provider1',
+            ).exists())
+
+    def test_edit_selection(self):
+        create_asset(sn='3333-3333-3333-3333', category=self.category)
+        response = self.client.post('/assets/dc/selection/', {
+            'action': 'bulkedit',
+            'query': 'sn=1111-1111-1111-1111',
+        })
+        selection = AssetSelection.objects.get()
+        self.assertRedirects(
+            response,
+            '/assets/dc/bulkedit/?selection={}'.format(selection.token),
+        )
+        self.assertEqual(
+            [asset.id for asset in selection.assets.all()], [self.asset.id],
+        )
+        selection = AssetSelection.from_ids([self.asset.id, self.asset1.id])
+        response = self.client.get(
+            '/assets/dc/bulkedit/?selection={}'.format(selection.token),
+        )
+        self.assertEqual(
+            set(form.instance.id for form in response.context['formset']),
+            {self.asset.id, self.asset1.id},
+        )
@@ -175,6 +175,15 @@ class TestSearchForm(TestCase):
         # Test if search form find correct data
         self.assertEqual(rows_from_table[0].sn, '1234-1234-1234-1234')
 
+    def test_exact_sn_field(self):
+        for sn, count in (
+            ('123', 3), ('"123"', 0), ('"1234-1234-1234-1234"', 1),
+        ):
+            content = self.client.get('/assets/dc/search?sn=%s' % sn)
+            self.assertEqual(content.status_code, 200)
+            rows_from_table = content.context_data['bob_page'].object_list
+            self.assertEqual(len(rows_from_table), count)
+
     def test_type_filed(self):
         device = '/assets/dc/search?part_info=device'
         part = '/assets/dc/search?part_info=part'
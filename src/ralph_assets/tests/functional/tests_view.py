@@ -7,10 +7,21 @@ from __future__ import unicode_literals
 
 import datetime
 
+from django.core.files.storage import default_storage
 from django.test import TestCase
+from django.test.client import RequestFactory
 
 from ralph_assets.models_assets import (AssetStatus, AssetType)
+from ralph_assets.models_sam import Licence, LicenceType, SoftwareCategory
 from ralph_assets.tests.util import create_asset, create_category
+from ralph_assets import views
+from ralph_assets.views import (
+    AssetSearch,
+    LICENCE_PAGE_SIZE,
+    LicenceList,
+    _iterate_csv,
+    _save_csv_file,
+)
 from ralph.ui.tests.global_utils import login_as_su
 
 
@@ -61,3 +72,120 @@ class TestDataDisplay(TestCase):
                 'Warehouse',
             ]
         )
+
+
+class TestLicenceList(TestCase):
+
+    def setUp(self):
+        self.client = login_as_su()
+        licence_type = LicenceType(name='Per seat')
+        licence_type.save()
+        self.categories = []
+        # enough categories for a second page, sorted after these two
+        others = [
+            ('Tool {:02}'.format(i), ('T-{}'.format(i),))
+            for i in xrange(LICENCE_PAGE_SIZE)
+        ]
+        for name, sns in [
+            ('Office', ('O-1', 'O-2')), ('Photo', ('P-1',)),
+        ] + others:
+            category = SoftwareCategory(
+                name=name, asset_type=AssetType.back_office.id,
+            )
+            category.save()
+            for sn in sns:
+                licence = Licence(
+                    licence_type=licence_type,
+                    software_category=category,
+                    number_bought=5,
+                    sn=sn,
+                    bought_date=datetime.date(2014, 1, 1),
+                    asset_type=AssetType.back_office.id,
+                )
+                licence.save()
+            self.categories.append(category)
+        licence = Licence.objects.get(sn='O-1')
+        for sn in ('sn-1', 'sn-2'):
+            licence.assets.add(create_asset(sn=sn))
+
+    def get_categories(self, data=None):
+        """Returns the categories listed for *data*, checking they take the
+        count, the page of categories and their licences queries only."""
+        view = LicenceList()
+        view.request = RequestFactory().get(
+            '/assets/back_office/sam/', data or {},
+        )
+        view.set_mode('back_office')
+        with self.assertNumQueries(3):
+            return list(view.get_categories())
+
+    def test_page(self):
+        response = self.client.get('/assets/back_office/sam/', {'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [c.name for c in response.context_data['categories']],
+            ['Tool 08', 'Tool 09'],
+        )
+
+    def test_used_and_total(self):
+        categories = self.get_categories()
+        self.assertEqual(len(categories), LICENCE_PAGE_SIZE)
+        self.assertEqual(
+            [(c.name, c.used, c.total) for c in categories[:3]],
+            [('Office', 2, 10), ('Photo', 0, 5), ('Tool 00', 0, 5)],
+        )
+        categories = self.get_categories({'page': 2})
+        self.assertEqual(
+            [(c.name, c.used, c.total) for c in categories],
+            [('Tool 08', 0, 5), ('Tool 09', 0, 5)],
+        )
+
+    def test_search(self):
+        categories = self.get_categories({'q': 'O-2'})
+        self.assertEqual([c.name for c in categories], ['Office'])
+        self.assertEqual(
+            [l.sn for l in categories[0].licences_annotated], ['O-2'],
+        )
+
+
+class TestCsvExport(TestCase):
+
+    def setUp(self):
+        for sn in ('sn-2', 'sn-3', 'sn-1'):
+            create_asset(sn=sn)
+
+    def get_rows(self, data):
+        view = AssetSearch()
+        view.request = RequestFactory().get('/assets/dc/search', data)
+        view.set_mode('dc')
+        return list(view.handle_search_data(get_csv=True))
+
+    def test_export_follows_sort(self):
+        chunk_size = views.CSV_CHUNK_SIZE
+        views.CSV_CHUNK_SIZE = 2
+        try:
+            for sort, expected in (
+                ('sn', ['sn-1', 'sn-2', 'sn-3']),
+                ('-sn', ['sn-3', 'sn-2', 'sn-1']),
+            ):
+                rows = self.get_rows({'sort': sort})
+                self.assertEqual(rows[0][:2], ['type', 'SN'])
+                self.assertEqual([row[1] for row in rows[1:]], expected)
+        finally:
+            views.CSV_CHUNK_SIZE = chunk_size
+
+    def test_save_csv_file(self):
+        name = _save_csv_file([['SN', 'Name'], ['sn-1', 'Zażółć']])
+        try:
+            with default_storage.open(name) as f:
+                self.assertEqual(
+                    f.read(), b'SN;Name\r\nsn-1;Za\xbf\xf3\xb3\xe6\r\n',
+                )
+        finally:
+            default_storage.delete(name)
+
+    def test_iterate_csv(self):
+        self.assertEqual(
+            b''.join(_iterate_csv(['row', 'message'], [[1, 'Zażółć']])),
+            b'row;message\r\n1;Za\xbf\xf3\xb3\xe6\r\n',
+        )
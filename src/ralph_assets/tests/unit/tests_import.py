@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+from ralph.ui.tests.global_utils import login_as_su
+
+from ralph_assets.importer import (
+    _read_sheet,
+    create_import_job,
+    Importer,
+    run_import_job,
+    ValueResolver,
+)
+from ralph_assets.models_assets import (
+    Asset,
+    AssetModel,
+    AssetStatus,
+    OfficeInfo,
+    Warehouse,
+)
+from ralph_assets.models_history import AssetHistoryChange
+from ralph_assets.models_import import ImportJob, ImportJobStatus
+from ralph_assets.spreadsheet import Spreadsheet
+from ralph_assets.tests.util import create_asset, create_warehouse
+
+
+class TestImporter(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'importer', 'importer@example.com', 'importer',
+        )
+        self.assets = [
+            create_asset(sn='sn-{}'.format(i)) for i in xrange(3)
+        ]
+        self.warehouse = create_warehouse('Warehouse2')
+        self.mappings = {
+            'sn': 'sn',
+            'model': 'model',
+            'niw': 'niw',
+            'user': 'user',
+            'warehouse': 'warehouse',
+        }
+
+    def test_update(self):
+        first, second, third = self.assets
+        importer = Importer(
+            'ralph_assets.asset', 'dc', self.mappings, self.user,
+            batch_size=2,
+        )
+        importer.update([
+            (first.id, {'Warehouse': 'warehouse2', 'niw': 'N1'}),
+            (second.id, {'Warehouse': 'WAREHOUSE2', 'niw': 'N1'}),
+            (third.id, {'sn': first.sn}),
+            (third.id + 100, {'niw': 'N2'}),
+        ])
+        self.assertEqual(importer.failed_assets, [third.id + 100])
+        self.assertEqual(importer.errors.keys(), [third.id])
+        for asset in Asset.objects.filter(pk__in=[first.id, second.id]):
+            self.assertEqual(asset.warehouse, self.warehouse)
+            self.assertEqual(asset.niw, 'N1')
+            self.assertTrue(AssetHistoryChange.objects.filter(
+                asset=asset, field_name='niw', new_value='N1',
+            ).exists())
+        self.assertEqual(Asset.objects.get(pk=third.id).sn, third.sn)
+
+    def test_failed_update_leaves_no_amendment(self):
+        first, second, third = self.assets
+        mappings = dict(self.mappings, version='office_info.version')
+        importer = Importer(
+            'ralph_assets.asset', 'back_office', mappings, self.user,
+        )
+        importer.update([
+            (second.id, {'version': '1.0'}),
+            (third.id, {'sn': first.sn, 'version': '2.0'}),
+        ])
+        self.assertEqual(importer.errors.keys(), [third.id])
+        self.assertEqual(
+            Asset.objects.get(pk=second.id).office_info.version, '1.0',
+        )
+        self.assertIsNone(Asset.objects.get(pk=third.id).office_info)
+        self.assertEqual(OfficeInfo.objects.count(), 1)
+
+    def test_add(self):
+        importer = Importer(
+            'ralph_assets.asset', 'back_office', self.mappings, self.user,
+        )
+        importer.add([
+            {'sn': 'sn-new', 'model': 'Model1', 'warehouse': 'Warehouse3'},
+            {'sn': 'sn-other', 'model': 'Model1', 'user': 'nobody'},
+        ])
+        asset = Asset.objects.get(sn='sn-new')
+        self.assertEqual(asset.warehouse.name, 'Warehouse3')
+        self.assertTrue(asset.office_info)
+        self.assertEqual(
+            Warehouse.objects.filter(name='Warehouse3').count(), 1,
+        )
+        self.assertEqual(len(importer.errors), 1)
+        self.assertFalse(Asset.objects.filter(sn='sn-other').exists())
+
+    def test_resolver_remembers_values(self):
+        resolver = ValueResolver(Asset, 'dc')
+        rows = [
+            {'warehouse': 'Warehouse2', 'model': 'New model'},
+            {'warehouse': 'WAREHOUSE2', 'model': 'new model'},
+            {'warehouse': 'New warehouse', 'user': 'nobody'},
+        ]
+        # a lookup of each model, a bulk insert of the missing models and
+        # warehouses and a lookup of the inserted ones
+        with self.assertNumQueries(7):
+            resolver.prefetch(rows)
+        with self.assertNumQueries(0):
+            resolver.prefetch(rows)
+            self.assertEqual(
+                resolver.resolve('warehouse', 'warehouse2'), self.warehouse,
+            )
+            self.assertEqual(
+                resolver.resolve('model', 'NEW MODEL').name, 'New model',
+            )
+            self.assertEqual(
+                resolver.resolve('status', 'New '), AssetStatus.new.id,
+            )
+            with self.assertRaises(User.DoesNotExist):
+                resolver.resolve('user', 'nobody')
+
+    def test_job_resumes_after_checkpoint(self):
+        first, second, third = self.assets
+        spreadsheet = Spreadsheet.spool(ContentFile(
+            'id,niw\n{},N1\n{},N2\n{},N3\n'.format(
+                first.id, second.id, third.id + 100,
+            ).encode('utf-8')
+        ), 'csv')
+        job = create_import_job(
+            'ralph_assets.asset', 'dc', self.mappings, self.user, spreadsheet,
+        )
+        job.checkpoint = 1
+        job.save()
+        run_import_job(job.id)
+        job = ImportJob.objects.get(pk=job.id)
+        self.assertEqual(job.status, ImportJobStatus.finished.id)
+        self.assertEqual((job.checkpoint, job.total), (3, 3))
+        self.assertEqual(
+            [(sheet['name'], sheet['rows']) for sheet in job.sheet_stats],
+            [('csv', 3)],
+        )
+        self.assertEqual(Asset.objects.get(pk=first.id).niw, first.niw)
+        self.assertEqual(Asset.objects.get(pk=second.id).niw, 'N2')
+        self.assertEqual(
+            list(job.errors.values_list('row', 'key')),
+            [(2, unicode(third.id + 100))],
+        )
+
+    def test_invalid_rows_are_reported(self):
+        first, second, third = self.assets
+        spreadsheet = Spreadsheet.spool(ContentFile(
+            'id,niw,status\n{},N1,bogus\n{},N2,in progress\n'.format(
+                first.id, second.id,
+            ).encode('utf-8')
+        ), 'csv')
+        job = create_import_job(
+            'ralph_assets.asset', 'dc', dict(self.mappings, status='status'),
+            self.user, spreadsheet,
+        )
+        run_import_job(job.id)
+        job = ImportJob.objects.get(pk=job.id)
+        self.assertEqual(job.sheet_stats[0]['invalid'], 1)
+        self.assertEqual(
+            list(job.errors.values_list('row', 'key')),
+            [(0, unicode(first.id))],
+        )
+        self.assertEqual(Asset.objects.get(pk=first.id).niw, first.niw)
+        second = Asset.objects.get(pk=second.id)
+        self.assertEqual(
+            (second.niw, second.status), ('N2', AssetStatus.in_progress.id),
+        )
+
+    def test_sheet_rows_are_written_by_the_worker(self):
+        spreadsheet = Spreadsheet.spool(
+            ContentFile(b'id,niw,status\n1,N1,bogus\n2,N2,in progress\n'),
+            'csv',
+        )
+        self.addCleanup(spreadsheet.delete)
+        path, rows, invalid, parse_time = _read_sheet((
+            spreadsheet.token, 0, 'ralph_assets.asset', 'dc',
+            dict(self.mappings, status='status'),
+        ))
+        self.addCleanup(os.remove, path)
+        self.assertEqual((rows, invalid), (2, 1))
+        with open(path, 'rb') as part_file:
+            lines = [json.loads(line) for line in part_file]
+        self.assertEqual([len(line) for line in lines], [3, 2])
+        self.assertEqual(
+            lines[1], [2, {'niw': 'N2', 'status': 'in progress'}],
+        )
+
+    def test_job_is_shown_to_its_creator_only(self):
+        spreadsheet = Spreadsheet.spool(ContentFile(b'id,niw\n'), 'csv')
+        job = create_import_job(
+            'ralph_assets.asset', 'dc', self.mappings, self.user, spreadsheet,
+        )
+        url = reverse(
+            'xls_upload_job', kwargs={'mode': 'dc', 'job_id': job.id},
+        )
+        client = login_as_su(
+            'other', 'other', 'other@example.com', is_superuser=False,
+        )
+        self.assertEqual(client.get(url, {'format': 'json'}).status_code, 404)
+        self.assertEqual(client.post(url).status_code, 404)
+        client = Client()
+        client.login(username='importer', password='importer')
+        self.assertEqual(client.get(url, {'format': 'json'}).status_code, 200)
+        client = login_as_su()
+        self.assertEqual(client.get(url, {'format': 'json'}).status_code, 200)
+
+    def test_summarize(self):
+        first = self.assets[0]
+        importer = Importer(
+            'ralph_assets.asset', 'dc', self.mappings, self.user,
+        )
+        summary = importer.summarize([
+            (first.id, {'warehouse': 'Warehouse2'}),
+            (first.id + 100, {'niw': 'N1'}),
+            (None, {'sn': first.sn, 'model': 'New model'}),
+            (None, {'sn': 'sn-new', 'user': 'nobody'}),
+        ])
+        self.assertEqual(
+            (summary.rows, summary.updates, summary.adds), (4, 2, 2),
+        )
+        self.assertEqual(summary.missing, [first.id + 100])
+        self.assertEqual(summary.existing, {'sn': 1})
+        self.assertEqual(summary.unresolved, {'user': {'nobody'}})
+        self.assertEqual(summary.created, {'model': {'New model'}})
+        self.assertFalse(
+            AssetModel.objects.filter(name='New model').exists(),
+        )
+
+    def test_upsert_by_key(self):
+        first = self.assets[0]
+        importer = Importer(
+            'ralph_assets.asset', 'dc', self.mappings, self.user, key='sn',
+        )
+        rows = [
+            (None, {'sn': first.sn, 'niw': 'N1'}),
+            (None, {'sn': 'sn-new', 'model': 'Model1', 'niw': 'N2'}),
+        ]
+        summary = importer.summarize(rows)
+        self.assertEqual((summary.updates, summary.adds), (1, 1))
+        self.assertEqual(summary.duplicates, [])
+        importer.run(rows)
+        self.assertEqual(Asset.objects.get(pk=first.id).niw, 'N1')
+        self.assertEqual(Asset.objects.get(sn='sn-new').niw, 'N2')
+        summary = importer.summarize(rows + [(None, {'sn': first.sn})])
+        self.assertEqual(summary.duplicates, [first.sn])
+        self.assertEqual(summary.updates, 3)
+
+
+class TestSpreadsheet(TestCase):
+
+    def test_csv_rows(self):
+        spreadsheet = Spreadsheet.spool(
+            ContentFile(b'id,Serial number,niw\n1,sn-1,N1\n,,\n2,sn-2,\n'),
+            'csv',
+        )
+        self.addCleanup(spreadsheet.delete)
+        spreadsheet = Spreadsheet(spreadsheet.token)
+        self.assertEqual(
+            spreadsheet.headers(), [('csv', ['Serial number', 'niw'], True)],
+        )
+        self.assertEqual(list(spreadsheet.rows()), [
+            (1, {'serial-number': 'sn-1', 'niw': 'N1'}),
+            (2, {'serial-number': 'sn-2', 'niw': ''}),
+        ])
+
+    def test_invalid_token(self):
+        with self.assertRaises(ValueError):
+            Spreadsheet('../settings.py')
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ralph_assets.lookups import cached_query, get_lookup_cache, prefix_query
+from ralph_assets.models_assets import Asset, Warehouse
+from ralph_assets.tests.util import create_asset, create_warehouse
+
+
+class WarehouseLookup(object):
+
+    @cached_query(Warehouse)
+    def get_query(self, q, request):
+        return Warehouse.objects.filter(name__istartswith=q).order_by('id')
+
+
+class TestLookups(TestCase):
+
+    def setUp(self):
+        get_lookup_cache().clear()
+        self.warehouse = create_warehouse('Warehouse1')
+
+    def test_cached_query(self):
+        lookup = WarehouseLookup()
+        with self.assertNumQueries(1):
+            self.assertEqual(lookup.get_query('ware', None), [self.warehouse])
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup.get_query('ware', None), [self.warehouse])
+        # keyed by the exact query
+        with self.assertNumQueries(1):
+            lookup.get_query('Ware', None)
+        warehouse = create_warehouse('Warehouse2')
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                lookup.get_query('ware', None), [self.warehouse, warehouse],
+            )
+
+    @override_settings(ASSETS_LOOKUPS={'CACHE_TIMEOUT': 0})
+    def test_cached_query_disabled(self):
+        lookup = WarehouseLookup()
+        for i in xrange(2):
+            with self.assertNumQueries(1):
+                list(lookup.get_query('ware', None))
+
+    def test_prefix_query(self):
+        asset = create_asset(sn='AbC-1', barcode='XyZ-1')
+        for prefix_columns, expected in (
+            (True, {'sn_lower__startswith': 'abc'}),
+            (False, {'sn__istartswith': 'aBc'}),
+        ):
+            with override_settings(
+                ASSETS_LOOKUPS={'PREFIX_COLUMNS': prefix_columns},
+            ):
+                query = prefix_query('sn', 'aBc')
+                self.assertEqual(query, expected)
+                self.assertEqual(list(Asset.objects.filter(**query)), [asset])
+
+    def test_lower_columns_follow_saves(self):
+        asset = create_asset(sn='AbC-1', barcode='XyZ-1')
+        self.assertEqual(
+            (asset.sn_lower, asset.barcode_lower), ('abc-1', 'xyz-1'),
+        )
+        asset.sn = 'DeF-2'
+        asset.barcode = None
+        asset.save()
+        asset = Asset.objects.get(pk=asset.pk)
+        self.assertEqual(
+            (asset.sn_lower, asset.barcode_lower), ('def-2', None),
+        )
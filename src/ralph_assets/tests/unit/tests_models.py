@@ -6,13 +6,32 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import difflib
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
 from django.test import TestCase
 
 from ralph.discovery.models_device import Device, DeviceType
 
 from ralph_assets.api_pricing import get_assets, get_asset_parts
-from ralph_assets.models_assets import PartInfo, AssetModel
-from ralph_assets.tests.util import create_asset, create_category
+from ralph_assets.deprecation import filter_deprecated, get_deprecation_flags
+from ralph_assets.fuzzy import AssetFuzzyIndex, CHANGES_KEY, normalize
+from ralph_assets.history import (
+    field_changes,
+    get_choices,
+    related_objects_cache,
+)
+from ralph_assets.models import AssetLookupFuzzy
+from ralph_assets.models_assets import Asset, PartInfo, AssetModel
+from ralph_assets.models_history import AssetHistoryChange, bulk_history
+from ralph_assets.pagination import KeysetPaginator
+from ralph_assets.tests.util import (
+    create_asset,
+    create_category,
+    create_warehouse,
+)
 
 
 class TestModelAsset(TestCase):
@@ -70,6 +89,158 @@ class TestModelAsset(TestCase):
         self.assertEqual(self.asset2.is_deprecated(date), False)
         self.assertEqual(self.asset3.is_deprecated(date), True)
 
+    def test_deprecation_end_date(self):
+        self.assertEqual(
+            self.asset.deprecation_end_date, datetime.date(2013, 11, 28),
+        )
+        self.asset.deprecation_rate = 50
+        self.asset.save()
+        self.assertEqual(
+            Asset.objects.get(pk=self.asset.pk).deprecation_end_date,
+            datetime.date(2014, 11, 28),
+        )
+
+    def test_fuzzy_lookup(self):
+        lookup = AssetLookupFuzzy()
+        self.assertEqual(
+            lookup.get_query('1111-1111-1111-1112', None)[0], self.asset2,
+        )
+        self.asset2.sn = '2222-2222-2222-2222'
+        self.asset2.save()
+        self.assertEqual(
+            lookup.get_query('2222-2222-2222-2222', None)[0], self.asset2,
+        )
+
+    def test_fuzzy_lookup_matches_full_scan(self):
+        for i in xrange(30):
+            create_asset(
+                sn='{:04d}-{}'.format(i * 37, 'xy' * (i % 7)),
+                barcode='bc-{}'.format(i) if i % 3 else None,
+            )
+        dev_ids = Device.objects.filter(
+            model__type=DeviceType.unknown,
+        ).values_list('id', flat=True)
+        assets = Asset.objects.select_related('model').filter(
+            Q(device_info__ralph_device_id=None) |
+            Q(device_info__ralph_device_id__in=dev_ids),
+        ).filter(part_info=None)
+        lookup = AssetLookupFuzzy()
+        for query in ('0370-xyxy', '1111-1111-1111-1112', 'bc-2', 'qqq', ''):
+
+            def get_ratio(asset):
+                return difflib.SequenceMatcher(
+                    None,
+                    normalize(asset.sn, asset.barcode, asset.model.name),
+                    normalize(query),
+                ).ratio()
+
+            expected = sorted(
+                assets, key=lambda asset: (-get_ratio(asset), asset.id),
+            )[:10]
+            self.assertEqual(lookup.get_query(query, None), expected)
+
+    def test_fuzzy_index_reloads_changed_assets(self):
+        cache.clear()
+        index, other_process_index = AssetFuzzyIndex(), AssetFuzzyIndex()
+        index.ensure_loaded()
+        other_process_index.ensure_loaded()
+        # a grouped update bypassing post_save
+        Asset.objects.filter(pk=self.asset2.pk).update(sn='2222')
+        other_process_index.refresh([self.asset2.pk])
+        with self.assertNumQueries(1):
+            index.ensure_loaded()
+        self.assertEqual(
+            index.entries[self.asset2.pk],
+            other_process_index.entries[self.asset2.pk],
+        )
+        self.assertTrue(index.entries[self.asset2.pk][0].startswith('2222'))
+        Asset.objects.filter(pk=self.asset.pk).update(sn='3333')
+        other_process_index.refresh([self.asset.pk])
+        cache.delete(CHANGES_KEY.format(other_process_index.version))
+        # unknown changes, the whole index is reloaded
+        index.ensure_loaded()
+        self.assertEqual(index.entries, other_process_index.entries)
+
+    def test_bulk_deprecation(self):
+        date = datetime.date(2014, 03, 29)
+        assets = Asset.objects.filter(
+            id__in=[self.asset.id, self.asset2.id, self.asset3.id],
+        )
+        expected = dict(
+            (asset.id, asset.is_deprecated(date)) for asset in assets
+        )
+        self.assertEqual(get_deprecation_flags(assets, date), expected)
+        self.assertEqual(
+            set(filter_deprecated(assets, date).values_list('id', flat=True)),
+            set(id for id, deprecated in expected.items() if deprecated),
+        )
+        self.assertEqual(
+            set(filter_deprecated(
+                assets, date, deprecated=False,
+            ).values_list('id', flat=True)),
+            set(id for id, deprecated in expected.items() if not deprecated),
+        )
+
+    def test_bulk_history(self):
+        def get_history(asset):
+            return list(AssetHistoryChange.objects.filter(
+                asset=asset,
+            ).values_list('field_name', 'old_value', 'new_value'))
+
+        asset = Asset.objects.get(pk=self.asset.pk)
+        asset.invoice_no = 'INV-1'
+        asset.provider = 'Provider'
+        asset.save()
+        asset2 = Asset.objects.get(pk=self.asset2.pk)
+        history_count = AssetHistoryChange.objects.count()
+        with bulk_history():
+            asset2.invoice_no = 'INV-1'
+            asset2.provider = 'Provider'
+            asset2.save()
+            self.assertEqual(
+                AssetHistoryChange.objects.count(), history_count,
+            )
+        self.assertEqual(
+            get_history(asset2)[-2:], get_history(asset)[-2:],
+        )
+
+    def test_history_lookups(self):
+        self.assertEqual(get_choices(self.asset, 'status', 'x'), 'x')
+        self.assertEqual(
+            get_choices(self.asset, 'status', self.asset.status),
+            self.asset.get_status_display(),
+        )
+        old_warehouse = self.asset.warehouse
+        new_warehouse = create_warehouse('Warehouse2')
+        with related_objects_cache():
+            for queries in (1, 0):
+                asset = Asset.objects.get(pk=self.asset.pk)
+                asset.warehouse = new_warehouse
+                with self.assertNumQueries(queries):
+                    changes = list(field_changes(asset))
+                self.assertIn(
+                    ('warehouse', old_warehouse, new_warehouse), changes,
+                )
+
+    def test_keyset_pagination(self):
+        for i in xrange(7):
+            create_asset(
+                sn='3333-3333-3333-333{}'.format(i),
+                invoice_no='INV-{}'.format(i % 3) if i % 4 else None,
+            )
+        cache.clear()
+        for sort in (None, 'invoice_no', '-invoice_no', '-id'):
+            paginator = KeysetPaginator(
+                Asset.objects.all(), 2, sort=sort, offset_pages=0,
+            )
+            expected = Paginator(paginator.object_list, 2)
+            # every page after the first one is fetched with a cursor
+            for number in expected.page_range:
+                self.assertEqual(
+                    list(paginator.page(number).object_list),
+                    list(expected.page(number).object_list),
+                )
+
 
 class TestApiAssets(TestCase):
     def setUp(self):
@@ -118,6 +289,20 @@ class TestApiAssets(TestCase):
             self.assertEqual(item['is_blade'], self.category.is_blade)
             self.assertEqual(item['cores_count'], self.asset.cores_count)
 
+    def tests_api_asset_queries_count(self):
+        date = datetime.date(2014, 03, 29)
+        # assets, their Ralph devices and the processors of the devices
+        with self.assertNumQueries(3):
+            self.assertEqual(len(list(get_assets(date))), 1)
+        for i in xrange(5):
+            create_asset(
+                sn='2222-2222-2222-222{}'.format(i),
+                invoice_date=datetime.date(2012, 11, 28),
+                category=self.category,
+            )
+        with self.assertNumQueries(3):
+            self.assertEqual(len(list(get_assets(date))), 6)
+
     def tests_api_asset_part(self):
         for item in get_asset_parts():
             self.assertEqual(item['price'], 100)
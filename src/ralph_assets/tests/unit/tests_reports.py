@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.test import TestCase
+from django.test.utils import override_settings
+from inkpy.api import generate_pdf
+
+from ralph_assets import reports
+from ralph_assets.models_assets import ReportOdtSource
+from ralph_assets.reports import (
+    convert_to_pdf,
+    enqueue_reports,
+    get_report_metrics,
+    get_template_cache,
+    open_report,
+    render_odt,
+    render_reports,
+    ReportError,
+    run_render_reports,
+    store_report,
+    TemplateCache,
+)
+
+# stands in for the LibreOffice script of ``INKPY['script_path']``, the "PDF"
+# is a copy of the ODT file
+COPY_SCRIPT = b"""import shutil, sys
+shutil.copy(sys.argv[1], sys.argv[2])
+"""
+
+CONTENT = """<office:document-content>
+{% for asset in assets %}<text:p>{{ asset.sn }} \u2013 {{ user }}</text:p>
+{% endfor %}</office:document-content>"""
+
+
+class FakeQueue(object):
+
+    id = 'job'
+
+    def __init__(self, count=0):
+        self.count = count
+        self.calls = []
+
+    def get_queue(self, name):
+        self.name = name
+        return self
+
+    def enqueue_call(self, **kwargs):
+        self.calls.append(kwargs)
+        return self
+
+
+def read_odt(path):
+    with zipfile.ZipFile(path) as odt:
+        return dict((name, odt.read(name)) for name in odt.namelist())
+
+
+class TestReports(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.template_path = os.path.join(self.tmp_dir, 'template.odt')
+        self.write_template('<p>{{ name }}</p>')
+        get_template_cache().clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_template(self, content, mtime=None, styles='<styles/>'):
+        with zipfile.ZipFile(self.template_path, 'w') as odt:
+            odt.writestr('mimetype', 'application/vnd.oasis.opendocument.text')
+            odt.writestr('content.xml', content.encode('utf-8'))
+            odt.writestr('styles.xml', styles.encode('utf-8'))
+            odt.writestr(
+                'META-INF/manifest.xml', '<manifest:manifest/>',
+                zipfile.ZIP_DEFLATED,
+            )
+        if mtime:
+            os.utime(self.template_path, (mtime, mtime))
+
+    def write_script(self, content):
+        path = os.path.join(self.tmp_dir, 'script.py')
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def create_template_file(self):
+        with open(self.template_path, 'rb') as f:
+            name = default_storage.save('assets/template.odt', File(f))
+        self.addCleanup(default_storage.delete, name)
+        template_file = ReportOdtSource(
+            name='Report', slug='report', template=name,
+        )
+        template_file.save()
+        return template_file
+
+    def get_reports_settings(self, **options):
+        reports_settings = {
+            'TEMP_STORAGE_PATH': self.tmp_dir,
+            'CONCURRENCY': 2,
+            'QUEUE': 'reports',
+            'TIMEOUT': 600,
+        }
+        reports_settings.update(options)
+        return reports_settings
+
+    def patch_queue(self, queue):
+        self.addCleanup(setattr, reports, 'django_rq', reports.django_rq)
+        reports.django_rq = queue
+
+    def test_render_odt(self):
+        odt_path = os.path.join(self.tmp_dir, 'report.odt')
+        render_odt(self.template_path, odt_path, {'name': 'Jan'})
+        with zipfile.ZipFile(odt_path) as odt:
+            self.assertEqual(odt.namelist()[0], 'mimetype')
+            self.assertEqual(odt.read('content.xml'), b'<p>Jan</p>')
+            self.assertEqual(odt.read('styles.xml'), b'<styles/>')
+
+    @override_settings(ASSETS_REPORTS={'TEMP_STORAGE_PATH': '/tmp/'})
+    def test_template_cache_without_cache_size_setting(self):
+        reports._template_cache = None
+        try:
+            self.assertEqual(get_template_cache().size, 20)
+        finally:
+            reports._template_cache = None
+
+    def test_template_cache_is_keyed_by_mtime(self):
+        cache = TemplateCache(size=1)
+        members = cache.get(self.template_path)
+        self.assertIs(cache.get(self.template_path), members)
+        self.write_template('<p>{{ name }}!</p>', mtime=1)
+        self.assertIsNot(cache.get(self.template_path), members)
+
+    def test_store_report(self):
+        path = os.path.join(self.tmp_dir, 'report.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF')
+        name = store_report(path, 'assets/report.pdf')
+        self.assertFalse(os.path.exists(path))
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), b'%PDF')
+        default_storage.delete(name)
+
+    def test_open_report(self):
+        path = os.path.join(self.tmp_dir, 'report.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF')
+        with open_report(path) as f:
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(f.read(), b'%PDF')
+
+    def test_convert_to_pdf(self):
+        odt_path = os.path.join(self.tmp_dir, 'report.odt')
+        pdf_path = os.path.join(self.tmp_dir, 'report.pdf')
+        render_odt(self.template_path, odt_path, {'name': 'Jan'})
+        with override_settings(
+            INKPY={'script_path': self.write_script(COPY_SCRIPT)},
+        ):
+            convert_to_pdf(odt_path, pdf_path)
+        self.assertFalse(os.path.exists(odt_path))
+        self.assertEqual(read_odt(pdf_path)['content.xml'], b'<p>Jan</p>')
+
+    def test_convert_to_pdf_fails(self):
+        odt_path = os.path.join(self.tmp_dir, 'report.odt')
+        render_odt(self.template_path, odt_path, {'name': 'Jan'})
+        with override_settings(
+            INKPY={'script_path': self.write_script(b'raise SystemExit(1)')},
+        ):
+            with self.assertRaises(ReportError):
+                convert_to_pdf(
+                    odt_path, os.path.join(self.tmp_dir, 'report.pdf'),
+                )
+        self.assertFalse(os.path.exists(odt_path))
+
+    def test_reports_match_inkpy(self):
+        self.write_template(CONTENT, styles='<styles>{{ id }}</styles>')
+        template_file = self.create_template_file()
+        data = {
+            'id': 'report-1',
+            'assets': [{'sn': 'sn-1'}, {'sn': 'sn-2'}],
+            'user': 'Za\u017c\xf3\u0142\u0107',
+        }
+        inkpy_path = os.path.join(self.tmp_dir, 'inkpy.pdf')
+        with override_settings(
+            INKPY={
+                'script_path': self.write_script(COPY_SCRIPT),
+                'tmp_dir': os.path.join(self.tmp_dir, 'inkpy'),
+            },
+            ASSETS_REPORTS=self.get_reports_settings(),
+        ):
+            generate_pdf(template_file.template.path, inkpy_path, data)
+            path, = render_reports(template_file, [('report.pdf', data)])
+        self.assertEqual(read_odt(path), read_odt(inkpy_path))
+        with zipfile.ZipFile(path) as odt:
+            self.assertEqual(odt.namelist()[0], 'mimetype')
+
+    def test_render_reports_in_batches(self):
+        cache.delete_many([
+            'ralph_assets.reports.rendered', 'ralph_assets.reports.render_ms',
+        ])
+        template_file = self.create_template_file()
+        with override_settings(
+            INKPY={'script_path': self.write_script(COPY_SCRIPT)},
+            ASSETS_REPORTS=self.get_reports_settings(),
+        ):
+            paths = run_render_reports(template_file.id, [
+                ('report-{}.pdf'.format(i), {'name': 'name-{}'.format(i)})
+                for i in xrange(3)
+            ])
+            self.patch_queue(FakeQueue(count=5))
+            metrics = get_report_metrics()
+        self.assertEqual(
+            [read_odt(path)['content.xml'] for path in paths],
+            [b'<p>name-0</p>', b'<p>name-1</p>', b'<p>name-2</p>'],
+        )
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir)),
+            ['report-0.pdf', 'report-1.pdf', 'report-2.pdf', 'script.py',
+             'template.odt'],
+        )
+        self.assertEqual(metrics['rendered'], 3)
+        self.assertEqual(metrics['queue_depth'], 5)
+        self.assertIsNotNone(metrics['average_ms'])
+
+    def test_enqueue_reports(self):
+        template_file = self.create_template_file()
+        queue = FakeQueue()
+        self.patch_queue(queue)
+        report_list = [('report.pdf', {'name': 'Jan'})]
+        with override_settings(
+            ASSETS_REPORTS=self.get_reports_settings(QUEUE='pdf', TIMEOUT=60),
+        ):
+            self.assertEqual(
+                enqueue_reports(template_file, report_list), 'job',
+            )
+        self.assertEqual(queue.name, 'pdf')
+        self.assertEqual(queue.calls, [{
+            'func': run_render_reports,
+            'args': (template_file.id, report_list),
+            'timeout': 60,
+        }])
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.http import Http404
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from ralph.ui.tests.global_utils import login_as_su
+
+from ralph_assets import views_transition
+from ralph_assets.models_assets import Asset, AssetStatus, ReportOdtSource
+from ralph_assets.models_history import AssetHistoryChange
+from ralph_assets.models_selection import AssetSelection
+from ralph_assets.models_transition import (
+    Action,
+    Transition,
+    TransitionsHistory,
+)
+from ralph_assets.tests.util import create_asset
+from ralph_assets.views_transition import (
+    run_transition,
+    RUN_TRANSITION_FUNC,
+    TransitionDispatcher,
+    TransitionView,
+)
+
+
+class FakeJob(object):
+
+    def __init__(self, func_name):
+        self.func_name = func_name
+        self.is_finished = self.is_failed = False
+
+
+class FakeQueue(object):
+
+    def __init__(self, job):
+        self.job = job
+
+    def get_queue(self, name):
+        return self
+
+    def fetch_job(self, job_id):
+        return self.job
+
+
+class TestTransitionDispatcher(TestCase):
+
+    def setUp(self):
+        self.logged_user = User.objects.create_user(
+            'logged', 'logged@example.com', 'logged',
+        )
+        self.affected_user = User.objects.create_user(
+            'affected', 'affected@example.com', 'affected',
+        )
+        self.transition = Transition(
+            name='release', slug='release-asset',
+            to_status=AssetStatus.in_progress.id,
+        )
+        self.transition.save()
+        for i in xrange(3):
+            create_asset(sn='sn-{}'.format(i))
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.patch('render_report', self.render_report)
+
+    def patch(self, name, value):
+        self.addCleanup(
+            setattr, views_transition, name, getattr(views_transition, name),
+        )
+        setattr(views_transition, name, value)
+
+    def render_report(self, template_file, file_name, data):
+        path = os.path.join(self.tmp_dir, file_name)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF')
+        return path
+
+    def add_actions(self, transition, *names):
+        for name in names:
+            action, created = Action.objects.get_or_create(name=name)
+            transition.actions.add(action)
+
+    def create_template(self, slug):
+        template_file = ReportOdtSource(
+            name=slug, slug=slug, template='assets/{}.odt'.format(slug),
+        )
+        template_file.save()
+        return template_file
+
+    def test_actions_are_written_together(self):
+        dispatcher = TransitionDispatcher(
+            None, self.transition, Asset.objects.all(), self.logged_user,
+            self.affected_user,
+        )
+        dispatcher._action_change_status()
+        dispatcher._action_assign_user()
+        dispatcher._update_assets()
+        for asset in Asset.objects.all():
+            self.assertEqual(asset.status, AssetStatus.in_progress.id)
+            self.assertEqual(asset.user, self.affected_user)
+        for field_name in ('status', 'user'):
+            self.assertEqual(
+                AssetHistoryChange.objects.filter(
+                    field_name=field_name, user=self.logged_user,
+                ).count(),
+                3,
+            )
+
+    def test_run_transition(self):
+        self.add_actions(
+            self.transition, 'change_status', 'assign_user', 'release_report',
+        )
+        selection = AssetSelection.from_queryset(
+            Asset.objects.all(), self.logged_user,
+        )
+        history = TransitionsHistory.objects.get(pk=run_transition(
+            self.transition.id, selection.token, self.logged_user.id,
+            self.affected_user.id, self.create_template('release-asset').id,
+        ))
+        self.addCleanup(history.report_file.delete, save=False)
+        self.assertEqual(history.affected_user, self.affected_user)
+        self.assertEqual(history.assets.count(), 3)
+        with default_storage.open(history.report_file.name) as f:
+            self.assertEqual(f.read(), b'%PDF')
+        for asset in Asset.objects.all():
+            self.assertEqual(asset.status, AssetStatus.in_progress.id)
+            self.assertEqual(asset.user, self.affected_user)
+        self.assertFalse(
+            AssetSelection.objects.filter(token=selection.token).exists(),
+        )
+
+    def test_failed_transition_removes_report(self):
+        self.add_actions(self.transition, 'change_status', 'release_report')
+
+        def get_lookup_cache():
+            raise ValueError()
+        self.patch('get_lookup_cache', get_lookup_cache)
+        dispatcher = TransitionDispatcher(
+            None, self.transition, Asset.objects.all(), self.logged_user,
+            self.affected_user, self.create_template('release-asset'),
+        )
+        with self.assertRaises(ValueError):
+            dispatcher.run()
+        name = dispatcher.get_transition_history_object().report_file.name
+        self.assertTrue(name)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_job_response_checks_job_type(self):
+        view = TransitionView()
+        view.request = RequestFactory().get('/')
+        self.patch('django_rq', FakeQueue(FakeJob('rq.dummy')))
+        with self.assertRaises(Http404):
+            view.get_job_response('job')
+        self.patch('django_rq', FakeQueue(FakeJob(RUN_TRANSITION_FUNC)))
+        self.assertEqual(json.loads(view.get_job_response('job').content), {
+            'finished': False, 'failed': False, 'report_link': None,
+        })
+
+    @override_settings(ASSETS_TRANSITIONS={
+        'ENABLE': True,
+        'SLUGS': {'RETURN-ASSET': 'return-asset'},
+        'QUEUE': '',
+    })
+    def test_transition_runs_inline_without_queue(self):
+        transition = Transition(
+            name='return-asset', slug='return-asset',
+            to_status=AssetStatus.ok.id,
+        )
+        transition.save()
+        self.add_actions(transition, 'change_status', 'return_report')
+        self.create_template('return-asset')
+        Asset.objects.update(user=self.affected_user)
+        client = login_as_su()
+        response = client.post('{}?transition_type=return-asset&{}'.format(
+            reverse('transition', kwargs={'mode': 'dc'}),
+            '&'.join(
+                'select={}'.format(asset_id)
+                for asset_id in Asset.objects.values_list('id', flat=True)
+            ),
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['transition_job'])
+        history = TransitionsHistory.objects.get()
+        self.addCleanup(history.report_file.delete, save=False)
+        self.assertEqual(history.affected_user, self.affected_user)
+        self.assertEqual(history.assets.count(), 3)
+        self.assertEqual(
+            set(Asset.objects.values_list('status', flat=True)),
+            set([AssetStatus.ok.id]),
+        )
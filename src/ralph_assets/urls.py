@@ -24,8 +24,10 @@ from ralph_assets.views import (
     EditLicence,
     EditPart,
     HistoryAsset,
+    ImportJobView,
     InvoiceReport,
     LicenceList,
+    SelectionView,
     SplitDeviceView,
     XlsUploadView,
 )
@@ -78,6 +80,9 @@ urlpatterns = patterns(
     url(r'(?P<mode>(back_office|dc))/split/asset/(?P<asset_id>[0-9]+)/$',
         login_required(SplitDeviceView.as_view()),
         name='device_split'),
+    url(r'(?P<mode>(back_office|dc))/selection/$',
+        login_required(SelectionView.as_view()),
+        name='asset_selection'),
     url(r'(?P<mode>(back_office|dc))/invoice_report/$',
         login_required(InvoiceReport.as_view()),
         name='invoice_report'),
@@ -96,6 +101,11 @@ urlpatterns = patterns(
         login_required(XlsUploadView.as_view(XLS_UPLOAD_FORMS)),
         name='xls_upload',
     ),
+    url(
+        r'(?P<mode>(back_office|dc))/xls/job/(?P<job_id>[0-9]+)/$',
+        login_required(ImportJobView.as_view()),
+        name='xls_upload_job',
+    ),
     url(
         r'(?P<mode>(back_office|dc))/sam/$',
         login_required(LicenceList.as_view()),
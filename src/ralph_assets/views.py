@@ -6,41 +6,46 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import itertools
+import json
 import logging
-import re
+import os
+import tempfile
 import uuid
 
 from collections import Counter
+from cStringIO import StringIO
+from bob.csvutil import UnicodeWriter
 from bob.data_table import DataTableColumn, DataTableMixin
 from bob.menu import MenuItem, MenuHeader
 from bob.views import DependencyView
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.formtools.wizard.views import SessionWizardView
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.files.storage import FileSystemStorage
-from django.core.paginator import Paginator
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.servers.basehttp import FileWrapper
+from django.core.paginator import EmptyPage, Paginator
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.db import transaction
 from django.db.models import Count, Q
-from django.db.models.fields import CharField, DecimalField, TextField
-from django.db.models.fields.related import RelatedField
 from django.forms.models import modelformset_factory, formset_factory
 from django.http import (
     HttpResponse,
     HttpResponseBadRequest,
     HttpResponseRedirect,
     Http404,
+    QueryDict,
 )
 from django.shortcuts import get_object_or_404, render
 from django.template.defaultfilters import slugify
+from django.utils.http import urlencode
 from django.utils.translation import ugettext_lazy as _
-from inkpy.api import generate_pdf
 from rq import get_current_job
-from lck.django.common.models import Named
 
 from ralph_assets import forms as assets_forms
+from ralph_assets.bulk_edit import BulkEditor
 from ralph_assets.forms import (
     AttachmentForm,
     AddDeviceForm,
@@ -54,17 +59,15 @@ from ralph_assets.forms import (
     BackOfficeSearchAssetForm,
     DataCenterSearchAssetForm,
 )
-from ralph_assets.forms_import import (
-    ColumnChoiceField,
-    get_model_by_name,
-    get_amendment_model,
-)
+from ralph_assets.forms_import import ColumnChoiceField
 from ralph_assets.forms_sam import LicenceForm
+from ralph_assets.importer import create_import_job, enqueue_import_job
+from ralph_assets.importer import Importer
+from ralph_assets.importer import can_resume_import_job
 from ralph_assets import models as assets_models
 from ralph_assets.models import (
     Asset,
     AssetModel,
-    AssetCategory,
     DeviceInfo,
     Licence,
     OfficeInfo,
@@ -77,11 +80,17 @@ from ralph_assets.models_assets import (
     AssetType,
     MODE2ASSET_TYPE,
     ASSET_TYPE2MODE,
-    CreatableFromString,
-    Sluggy,
 )
 from ralph_assets.models_history import AssetHistoryChange
+from ralph_assets.models_import import ImportJob
+from ralph_assets.models_selection import AssetSelection
+from ralph_assets.models_util import iterate_ordered_chunks
+from ralph_assets.pagination import KeysetPaginator
+from ralph_assets.reports import open_report, render_report, ReportError
+from ralph_assets.search import asset_search_compiler, get_select_related
+from ralph_assets.spreadsheet import Spreadsheet
 from ralph.business.models import Venture
+from ralph.discovery.models import Device, DeviceType
 from ralph.ui.views.common import Base
 from ralph.util.api_assets import get_device_components
 from ralph.util.reports import Report, set_progress
@@ -90,8 +99,10 @@ SAVE_PRIORITY = 200
 HISTORY_PAGE_SIZE = 25
 MAX_PAGE_SIZE = 65535
 LICENCE_PAGE_SIZE = 10
-
-QUOTATION_MARKS = re.compile(r"^\".+\"$")
+CSV_CHUNK_SIZE = 1000
+CSV_PROGRESS_INTERVAL = 100
+CSV_EXPORT_PATH = 'assets/exports'
+CSV_ENCODING = 'cp1250'
 
 logger = logging.getLogger(__name__)
 
@@ -275,176 +286,73 @@ class _AssetSearch(AssetsBase):
         self.form = search_form(self.request.GET, mode=mode)
         super(_AssetSearch, self).set_mode(mode)
 
-    def get_search_category_part(self, field_value):
-        try:
-            category_id = field_value
-        except ValueError:
-            pass
-        else:
-            category = AssetCategory.objects.get(slug=category_id)
-            children = [x.slug for x in category.get_children()]
-            categories = [category_id, ] + children
-            return Q(category_id__in=categories)
-
-    def get_all_items(self, query):
-        include_deleted = self.request.GET.get('deleted')
+    def get_all_items(self, query, data=None):
+        if data is None:
+            data = self.request.GET
+        include_deleted = data.get('deleted')
         if include_deleted and include_deleted.lower() == 'on':
             return self.admin_objects.filter(query)
         return self.objects.filter(query)
 
     def handle_search_data(self, *args, **kwargs):
-        search_fields = [
-            'id',
-            'niw',
-            'category',
-            'invoice_no',
-            'model',
-            'order_no',
-            'part_info',
-            'provider',
-            'sn',
-            'status',
-            'deleted',
-            'manufacturer',
-            'barcode',
-            'device_info',
-            'source',
-            'deprecation_rate',
-            'unlinked',
-            'ralph_device_id',
-            'task_url',
-            'imei',
-            'guardian',
-            'user',
-            'purpose',
-        ]
-        # handle simple 'equals' search fields at once.
-        all_q = Q()
-        for field in search_fields:
-            field_value = self.request.GET.get(field)
-            if field_value:
-                exact = False
-                # if search term is enclosed in "", we want exact matches
-                if isinstance(field_value, basestring) and \
-                        QUOTATION_MARKS.search(field_value):
-                    exact = True
-                    field_value = field_value[1:-1]
-                if field == 'part_info':
-                    if field_value == 'device':
-                        all_q &= Q(part_info__isnull=True)
-                    elif field_value == 'part':
-                        all_q &= Q(part_info__gte=0)
-                elif field == 'model':
-                    if exact:
-                        all_q &= Q(model__name=field_value)
-                    else:
-                        all_q &= Q(model__name__icontains=field_value)
-                elif field == 'category':
-                    part = self.get_search_category_part(field_value)
-                    if part:
-                        all_q &= part
-                elif field == 'deleted':
-                    if field_value.lower() == 'on':
-                        all_q &= Q(deleted__in=(True, False))
-                elif field == 'manufacturer':
-                    if exact:
-                        all_q &= Q(model__manufacturer__name=field_value)
-                    else:
-                        all_q &= Q(
-                            model__manufacturer__name__icontains=field_value
-                        )
-                elif field == 'barcode':
-                    if exact:
-                        all_q &= Q(barcode=field_value)
-                    else:
-                        all_q &= Q(barcode__contains=field_value)
-                elif field == 'sn':
-                    if exact:
-                        all_q &= Q(sn=field_value)
-                    else:
-                        all_q &= Q(sn__icontains=field_value)
-                elif field == 'niw':
-                    if exact:
-                        all_q &= Q(niw=field_value)
-                    else:
-                        all_q &= Q(niw__icontains=field_value)
-                elif field == 'provider':
-                    if exact:
-                        all_q &= Q(provider=field_value)
-                    else:
-                        all_q &= Q(provider__icontains=field_value)
-                elif field == 'order_no':
-                    if exact:
-                        all_q &= Q(order_no=field_value)
-                    else:
-                        all_q &= Q(order_no__icontains=field_value)
-                elif field == 'invoice_no':
-                    if exact:
-                        all_q &= Q(invoice_no=field_value)
-                    else:
-                        all_q &= Q(invoice_no__icontains=field_value)
-                elif field == 'user':
-                    all_q &= Q(user__id=field_value)
-                elif field == 'guardian':
-                    all_q &= Q(guardian__id=field_value)
-                elif field == 'deprecation_rate':
-                    deprecation_rate_query_map = {
-                        'null': Q(deprecation_rate__isnull=True),
-                        'deprecated': Q(deprecation_rate=0),
-                        '6': Q(deprecation_rate__gt=0,
-                               deprecation_rate__lte=6),
-                        '12': Q(deprecation_rate__gt=6,
-                                deprecation_rate__lte=12),
-                        '24': Q(deprecation_rate__gt=12,
-                                deprecation_rate__lte=24),
-                        '48': Q(deprecation_rate__gt=24,
-                                deprecation_rate__lte=48),
-                        '48<': Q(deprecation_rate__gt=48),
-                    }
-                    all_q &= deprecation_rate_query_map[field_value]
-                elif field == 'unlinked' and field_value.lower() == 'on':
-                        all_q &= ~Q(device_info=None)
-                        all_q &= Q(device_info__ralph_device_id=None)
-                elif field == 'ralph_device_id':
-                    if exact:
-                        all_q &= Q(device_info__ralph_device_id=field_value)
-                    else:
-                        all_q &= Q(
-                            device_info__ralph_device_id__icontains=field_value
-                        )
-                elif field == 'task_url':
-                    if exact:
-                        all_q &= Q(task_url=field_value)
-                    else:
-                        all_q &= Q(task_url__icontains=field_value)
-                elif field == 'id':
-                        all_q &= Q(
-                            id__in=[int(id) for id in field_value.split(",")],
-                        )
-                elif field == 'imei':
-                    if exact:
-                        all_q &= Q(office_info__imei=field_value)
-                    else:
-                        all_q &= Q(office_info__imei__icontains=field_value)
-                elif field == 'purpose':
-                    all_q &= Q(office_info__purpose=field_value)
-                else:
-                    q = Q(**{field: field_value})
-                    all_q = all_q & q
+        return asset_search_compiler.compile(self.request.GET)
+
+
+def _get_ralph_device_id(asset):
+    """Returns the id of the Ralph device linked to *asset* or, for parts,
+    to the device the part belongs to."""
+    if asset.part_info:
+        asset = asset.part_info.device
+    if asset and asset.device_info:
+        return asset.device_info.ralph_device_id
+
+
+def _get_ralph_devices(assets):
+    """Returns Ralph devices linked to *assets* in a dict keyed by their id,
+    with ventures and models loaded in the same query."""
+    ralph_ids = filter(None, (_get_ralph_device_id(asset) for asset in assets))
+    if not ralph_ids:
+        return {}
+    return Device.objects.select_related('venture', 'model').in_bulk(
+        ralph_ids,
+    )
 
-        # now fields within ranges.
-        search_date_fields = [
-            'invoice_date', 'request_date', 'delivery_date',
-            'production_use_date', 'provider_order_date', 'loan_end_date',
-        ]
-        for date in search_date_fields:
-            start = self.request.GET.get(date + '_from')
-            end = self.request.GET.get(date + '_to')
-            if start:
-                all_q &= Q(**{date + '__gte': start})
-            if end:
-                all_q &= Q(**{date + '__lte': end})
-        return all_q
+
+def _is_discovered(device):
+    if not device or not device.model:
+        return False
+    return device.model.type != DeviceType.unknown.id
+
+
+def _get_csv_writer(csv_file):
+    """Returns a writer of CSV files in the format of bob's CSV responses:
+    semicolon separated and cp1250 encoded, for Excel."""
+    return UnicodeWriter(csv_file, encoding=CSV_ENCODING)
+
+
+def _iterate_csv(header, rows):
+    """Yields *header* and *rows* as lines of a CSV file."""
+    line = StringIO()
+    writer = _get_csv_writer(line)
+    for row in itertools.chain([header], rows):
+        writer.writerow([unicode(cell) for cell in row])
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+
+
+def _save_csv_file(rows):
+    """Writes *rows* to a CSV file in the default storage one by one and
+    returns the name of the file."""
+    with tempfile.TemporaryFile() as csv_file:
+        writer = _get_csv_writer(csv_file)
+        for row in rows:
+            writer.writerow([unicode(cell) for cell in row])
+        csv_file.seek(0)
+        return default_storage.save(
+            os.path.join(CSV_EXPORT_PATH, '{}.csv'.format(uuid.uuid4())),
+            File(csv_file),
+        )
 
 
 class _AssetSearchDataTable(_AssetSearch, DataTableMixin):
@@ -519,43 +427,89 @@ class _AssetSearchDataTable(_AssetSearch, DataTableMixin):
             _AssetSearchDataTable, self,
         ).handle_search_data(*args, **kwargs)
         if get_csv:
-            return self.get_csv_data(self.get_all_items(all_q))
+            # exported in the order chosen in the search
+            return self.get_csv_data(
+                self.sort_queryset(self.get_all_items(all_q)),
+            )
         else:
-            self.data_table_query(self.get_all_items(all_q))
+            self.data_table_query(
+                self.get_all_items(all_q).select_related(
+                    *get_select_related(Asset, self.columns)
+                )
+            )
+
+    def _paginate(self, queryset):
+        page = self.request.GET.get(self.query_variable_name) or 1
+        try:
+            self.page_number = int(page)
+        except ValueError:
+            self.page_number = 1
+        if (
+            not settings.ASSETS_SEARCH.get('KEYSET_PAGINATION', True) or
+            self.page_number == 0
+        ):
+            return super(_AssetSearchDataTable, self)._paginate(queryset)
+        self.paginator = KeysetPaginator(
+            queryset, self.rows_per_page, sort=self.sort,
+        )
+        try:
+            return self.paginator.page(self.page_number)
+        except EmptyPage:
+            return self.paginator.page(1)
 
     def get_csv_header(self):
         header = super(_AssetSearchDataTable, self).get_csv_header()
         return ['type'] + header
 
     def get_csv_rows(self, queryset, type, model):
-        data = [self.get_csv_header()]
+        yield self.get_csv_header()
         total = queryset.count()
         processed = 0
         job = get_current_job()
-        for asset in queryset:
-            row = ['part', ] if asset.part_info else ['device', ]
-            for item in self.columns:
-                field = item.field
-                if field:
-                    nested_field_name = item.foreign_field_name
-                    if nested_field_name == type:
-                        cell = self.get_cell(
-                            getattr(asset, type), field, model
-                        )
-                    elif nested_field_name == 'part_info':
-                        cell = self.get_cell(asset.part_info, field, PartInfo)
-                    elif nested_field_name == 'venture':
-                        cell = self.get_cell(asset.venture, field, Venture)
-                    elif nested_field_name == 'is_discovered':
-                        cell = unicode(asset.is_discovered)
-                    else:
-                        cell = self.get_cell(asset, field, Asset)
-                    row.append(unicode(cell))
-            data.append(row)
-            processed += 1
-            set_progress(job, processed / total)
+        queryset = queryset.select_related(
+            'model__manufacturer',
+            'warehouse',
+            'device_info',
+            'office_info',
+            'part_info__device__device_info',
+            'part_info__device__model__manufacturer',
+            'part_info__source_device__model__manufacturer',
+        )
+        for assets in iterate_ordered_chunks(queryset, CSV_CHUNK_SIZE):
+            devices = _get_ralph_devices(assets)
+            for asset in assets:
+                row = ['part', ] if asset.part_info else ['device', ]
+                device = devices.get(_get_ralph_device_id(asset))
+                for item in self.columns:
+                    field = item.field
+                    if field:
+                        nested_field_name = item.foreign_field_name
+                        if nested_field_name == type:
+                            cell = self.get_cell(
+                                getattr(asset, type), field, model
+                            )
+                        elif nested_field_name == 'part_info':
+                            cell = self.get_cell(
+                                asset.part_info, field, PartInfo,
+                            )
+                        elif nested_field_name == 'venture':
+                            # parts are never assigned to a venture
+                            cell = self.get_cell(
+                                None if asset.part_info or not device
+                                else device.venture,
+                                field,
+                                Venture,
+                            )
+                        elif nested_field_name == 'is_discovered':
+                            cell = unicode(_is_discovered(device))
+                        else:
+                            cell = self.get_cell(asset, field, Asset)
+                        row.append(unicode(cell))
+                yield row
+                processed += 1
+                if processed % CSV_PROGRESS_INTERVAL == 0:
+                    set_progress(job, processed / total)
         set_progress(job, 1)
-        return data
 
     def get_context_data(self, *args, **kwargs):
         ret = super(
@@ -592,10 +546,17 @@ class _AssetSearchDataTable(_AssetSearch, DataTableMixin):
 
     def get_result(self, request, *args, **kwargs):
         self.set_mode(kwargs['mode'])
-        return self.handle_search_data(get_csv=True)
+        return _save_csv_file(self.handle_search_data(get_csv=True))
 
     def get_response(self, request, result):
-        return self.make_csv_response(result)
+        response = HttpResponse(
+            FileWrapper(default_storage.open(result)),
+            content_type='application/csv',
+        )
+        response['Content-Disposition'] = 'attachment; filename={}'.format(
+            self.csv_file_name,
+        )
+        return response
 
     def get_csv_data(self, queryset):
         return self.get_csv_rows(
@@ -690,6 +651,75 @@ def _get_return_link(mode):
     return "/assets/%s/" % mode
 
 
+def _get_selected_query(request):
+    """Returns the query matching the assets selected for a bulk operation:
+    the members of the ``selection`` or, in plain links, the ``select``
+    ids."""
+    token = request.GET.get('selection')
+    if token:
+        return Q(selections__token=token)
+    return Q(pk__in=request.GET.getlist('select'))
+
+
+def _get_selected_return_link(mode, request):
+    """Returns the link to the search results of the selected assets."""
+    token = request.GET.get('selection')
+    if token:
+        return "{}search?selection={}".format(_get_return_link(mode), token)
+    return "{}search?id={}".format(
+        _get_return_link(mode), ",".join(request.GET.getlist('select')),
+    )
+
+
+def _get_bulkedit_link(mode, ids, user):
+    selection = AssetSelection.from_ids(ids, user)
+    return "{}bulkedit/?selection={}".format(
+        _get_return_link(mode), selection.token,
+    )
+
+
+class SelectionView(_AssetSearch):
+    """Stores the assets chosen for a bulk *action*, given as ``select`` ids
+    or as a search ``query``, and redirects to the action with the token of
+    the selection."""
+
+    actions = (
+        'add_attachment/asset',
+        'bulkedit',
+        'invoice_report',
+        'transition',
+    )
+    # parameters passed on to the action
+    action_params = ('transition_type',)
+
+    def post(self, *args, **kwargs):
+        action = self.request.POST.get('action')
+        if action not in self.actions:
+            return HttpResponseBadRequest()
+        query = self.request.POST.get('query')
+        if query is not None:
+            data = QueryDict(query.encode('utf-8'))
+            selection = AssetSelection.from_queryset(
+                self.get_all_items(asset_search_compiler.compile(data), data),
+                self.request.user,
+            )
+        else:
+            selection = AssetSelection.from_ids(
+                [
+                    id for id in self.request.POST.getlist('select')
+                    if id.isdigit()
+                ],
+                self.request.user,
+            )
+        params = [('selection', selection.token)] + [
+            (name, self.request.POST[name]) for name in self.action_params
+            if name in self.request.POST
+        ]
+        return HttpResponseRedirect("{}{}/?{}".format(
+            _get_return_link(self.mode), action, urlencode(params),
+        ))
+
+
 @transaction.commit_on_success
 def _create_device(creator_profile, asset_data, device_info_data, sn, mode,
                    barcode=None, office_info_data=None):
@@ -793,8 +823,7 @@ class AddDevice(AssetsBase):
                 )
             else:
                 return HttpResponseRedirect(
-                    '/assets/%s/bulkedit/?select=%s' % (
-                        cat, '&select='.join(["%s" % id for id in ids]))
+                    _get_bulkedit_link(cat, ids, self.request.user)
                 )
         else:
             messages.error(self.request, _("Please correct the errors."))
@@ -1118,7 +1147,7 @@ class BulkEdit(AssetsBase, Base):
 
     def get(self, *args, **kwargs):
         assets_count = Asset.objects.filter(
-            pk__in=self.request.GET.getlist('select')).exists()
+            _get_selected_query(self.request)).exists()
         if not assets_count:
             messages.warning(self.request, _("Nothing to edit."))
             return HttpResponseRedirect(_get_return_link(self.mode))
@@ -1128,9 +1157,7 @@ class BulkEdit(AssetsBase, Base):
             form=bulk_form_class,
             extra=0,
         )
-        assets = Asset.objects.filter(
-            pk__in=self.request.GET.getlist('select')
-        )
+        assets = Asset.objects.filter(_get_selected_query(self.request))
         self.asset_formset = AssetFormSet(queryset=assets)
         for idx, asset in enumerate(assets):
             if asset.office_info:
@@ -1149,24 +1176,24 @@ class BulkEdit(AssetsBase, Base):
             form=bulk_form_class,
             extra=0,
         )
-        self.asset_formset = AssetFormSet(self.request.POST)
+        # don't let the formset load all assets to find the edited ones
+        ids = [
+            value for key, value in self.request.POST.iteritems()
+            if key.startswith('form-') and key.endswith('-id') and
+            value.isdigit()
+        ]
+        self.asset_formset = AssetFormSet(
+            self.request.POST,
+            queryset=Asset._default_manager.filter(
+                pk__in=ids,
+            ).select_related('office_info'),
+        )
         if self.asset_formset.is_valid():
-            with transaction.commit_on_success():
-                instances = self.asset_formset.save(commit=False)
-                for idx, instance in enumerate(instances):
-                    instance.modified_by = self.request.user.get_profile()
-                    instance.save(user=self.request.user)
-                    new_src, office_info_data = _move_data(
-                        self.asset_formset.forms[idx].cleaned_data,
-                        {}, ['purpose']
-                    )
-                    self.asset_formset.forms[idx].cleaned_data = new_src
-                    instance = _update_office_info(
-                        self.request.user, instance,
-                        office_info_data,
-                    )
-            messages.success(self.request, _("Changes saved."))
-            return HttpResponseRedirect(self.request.get_full_path())
+            if BulkEditor(self.asset_formset, self.request.user).save():
+                messages.success(self.request, _("Changes saved."))
+                return HttpResponseRedirect(self.request.get_full_path())
+            messages.error(self.request, _("Please correct the errors."))
+            return super(BulkEdit, self).get(*args, **kwargs)
         form_error = self.asset_formset.get_form_error()
         if form_error:
             messages.error(
@@ -1290,8 +1317,7 @@ class AddPart(AssetsBase):
                 )
             else:
                 return HttpResponseRedirect(
-                    '/assets/%s/bulkedit/?select=%s' % (
-                        cat, '&select='.join(["%s" % id for id in ids]))
+                    _get_bulkedit_link(cat, ids, self.request.user)
                 )
             return HttpResponseRedirect(_get_return_link(self.mode))
         else:
@@ -1482,31 +1508,51 @@ class XlsUploadView(SessionWizardView, AssetsBase):
     sidebar_selected = 'xls upload'
     mainmenu_selected = 'dc'
 
+    def get_form_initial(self, step):
+        # the spooled upload stands in for the file when the upload step is
+        # validated again
+        initial = super(XlsUploadView, self).get_form_initial(step)
+        if step == 'upload' and self.storage.data.get('spreadsheet'):
+            initial = dict(
+                initial, file=Spreadsheet(self.storage.data['spreadsheet']),
+            )
+        return initial
+
+    def get_form_step_files(self, form):
+        # DataUploadField spools the upload itself
+        return {}
+
+    def process_step(self, form):
+        if self.steps.current == 'upload':
+            self.storage.data['spreadsheet'] = form.cleaned_data['file'].token
+        return super(XlsUploadView, self).process_step(form)
+
     def get_form(self, step=None, data=None, files=None):
         if step is None:
             step = self.steps.current
         form = super(XlsUploadView, self).get_form(step, data, files)
         if step == 'column_choice':
-            names_per_sheet, update_per_sheet, add_per_sheet =\
-                self.get_cleaned_data_for_step('upload')['file']
+            spreadsheet = self.get_cleaned_data_for_step('upload')['file']
             model = self.get_cleaned_data_for_step('upload')['model']
+            headers = spreadsheet.headers()
             form.model_reflected = model
-            form.update = any(update_per_sheet.values())
-            for name_list in names_per_sheet.values():
-                for name in name_list:
+            form.key = self.get_cleaned_data_for_step('upload')['key']
+            form.update = any(update for sheet_name, names, update in headers)
+            for sheet_name, names, update in headers:
+                for name in names:
                     form.fields[slugify(name)] = ColumnChoiceField(
                         model=model,
                         mode=self.mode,
                         label=name,
                     )
         elif step == 'confirm':
-            names_per_sheet, _, _ =\
-                self.get_cleaned_data_for_step('upload')['file']
+            spreadsheet = self.get_cleaned_data_for_step('upload')['file']
             mappings = {}
-            all_names = set(sum((
-                [slugify(n) for n in name_list]
-                for name_list in names_per_sheet.values()
-            ), []))
+            all_names = set(
+                slugify(name)
+                for sheet_name, names, update in spreadsheet.headers()
+                for name in names
+            )
             for k, v in self.get_cleaned_data_for_step(
                 'column_choice'
             ).items():
@@ -1515,158 +1561,161 @@ class XlsUploadView(SessionWizardView, AssetsBase):
             self.storage.data['mappings'] = mappings
         return form
 
+    def get(self, *args, **kwargs):
+        if 'preview' in self.request.GET:
+            return self.get_preview_response()
+        return super(XlsUploadView, self).get(*args, **kwargs)
+
+    def get_preview_response(self):
+        """Renders a page of the rows to import, reading the spreadsheet only
+        up to that page."""
+        if 'mappings' not in self.storage.data:
+            raise Http404()
+        try:
+            page = max(int(self.request.GET['preview']), 1)
+        except ValueError:
+            raise Http404()
+        spreadsheet = self.get_cleaned_data_for_step('upload')['file']
+        mappings = self.storage.data['mappings']
+        columns = list(mappings.values())
+        page_size = settings.ASSETS_IMPORT.get('PREVIEW_SIZE', 100)
+        offset = (page - 1) * page_size
+        rows = []
+        try:
+            for asset_id, asset_data in itertools.islice(
+                spreadsheet.rows(), offset, offset + page_size + 1,
+            ):
+                asset_data = dict(
+                    (mappings[k], v)
+                    for (k, v) in asset_data.items()
+                    if k in mappings
+                )
+                rows.append(
+                    [asset_id] + [asset_data.get(c, '') for c in columns]
+                )
+        except ValueError as e:
+            return HttpResponse(unicode(e), status=400)
+        return render(self.request, 'assets/xls_upload_preview.html', {
+            'columns': columns,
+            'rows': rows[:page_size],
+            'first_row': offset + 1,
+            'previous_page': page - 1,
+            'next_page': page + 1 if len(rows) > page_size else None,
+        })
+
     def get_context_data(self, form, **kwargs):
         data = super(XlsUploadView, self).get_context_data(form, **kwargs)
         if self.steps.current == 'confirm':
-            names_per_sheet, update_per_sheet, add_per_sheet =\
-                self.get_cleaned_data_for_step('upload')['file']
-            mappings = self.storage.data['mappings']
-            all_columns = list(mappings.values())
-            all_column_names = all_columns
-            data_dicts = {}
-            for sheet_name, sheet_data in update_per_sheet.items():
-                for asset_id, asset_data in sheet_data.items():
-                    data_dicts.setdefault(asset_id, {})
-                    for key, value in asset_data.items():
-                        data_dicts[asset_id][mappings[key]] = value
-            update_table = []
-            for asset_id, asset_data in data_dicts.items():
-                row = [asset_id]
-                for column in all_columns:
-                    row.append(asset_data.get(column, ''))
-                update_table.append(row)
-            add_table = []
-            for sheet_name, sheet_data in add_per_sheet.items():
-                for asset_data in sheet_data:
-                    asset_data = dict(
-                        (mappings[slugify(k)], v)
-                        for (k, v) in asset_data.items()
-                        if slugify(k) in mappings
-                    )
-                    row = []
-                    for column in all_columns:
-                        row.append(asset_data.get(column, ''))
-                    add_table.append(row)
-            data['all_columns'] = all_columns
-            data['all_column_names'] = all_column_names
-            data['update_table'] = update_table
-            data['add_table'] = add_table
+            spreadsheet = self.get_cleaned_data_for_step('upload')['file']
+            importer = Importer(
+                self.get_cleaned_data_for_step('upload')['model'],
+                self.mode,
+                self.storage.data['mappings'],
+                self.request.user,
+                key=self.get_cleaned_data_for_step('upload')['key'],
+            )
+            summary = importer.summarize(spreadsheet.rows())
+            self.storage.data['duplicates'] = summary.duplicates_count
+            self.storage.data['summary_error'] = summary.error
+            data['summary'] = summary
         return data
 
-    def _get_field_value(self, field_name, value):
-        """Transform a pure string into the value to be put into the field."""
-        if '.' in field_name:
-            Model = self.AmdModel
-            _, field_name = field_name.split('.', 1)
-        else:
-            Model = self.Model
-        field, _, _, _ = Model._meta.get_field_by_name(
-            field_name
+    def done(self, form_list):
+        upload = self.get_cleaned_data_for_step('upload')
+        spreadsheet = upload['file']
+        if self.storage.data.get('duplicates'):
+            messages.error(
+                self.request,
+                _("The file has rows with the same key. Nothing was saved."),
+            )
+            return HttpResponseRedirect(
+                reverse('xls_upload', kwargs={'mode': self.mode}),
+            )
+        if self.storage.data.get('summary_error'):
+            messages.error(self.request, self.storage.data['summary_error'])
+            return HttpResponseRedirect(
+                reverse('xls_upload', kwargs={'mode': self.mode}),
+            )
+        job = create_import_job(
+            upload['model'],
+            self.mode,
+            self.storage.data['mappings'],
+            self.request.user,
+            spreadsheet,
+            key=upload['key'],
         )
-        if not value:
-            if isinstance(field, (TextField, CharField)):
-                return ''
-            else:
-                return
-        if isinstance(field, DecimalField):
-            if value.count(',') == 1 and '.' not in value:
-                value = value.replace(',', '.')
-        if field.choices:
-            value_lower = value.lower().strip()
-            for k, v in field.choices:
-                if value_lower == v.lower().strip():
-                    value = k
-                    break
+        enqueue_import_job(job)
+        return HttpResponseRedirect(reverse(
+            'xls_upload_job', kwargs={'mode': self.mode, 'job_id': job.id},
+        ))
 
-        if (
-            isinstance(value, basestring) and
-            isinstance(field, RelatedField) and
-            issubclass(field.rel.to, (Named, User, Sluggy))
-        ):
-            try:
-                if issubclass(field.rel.to, User):
-                    value = field.rel.to.objects.get(username__iexact=value)
-                elif issubclass(field.rel.to, Sluggy):
-                    value = field.rel.to.objects.get(slug=value)
-                else:
-                    value = field.rel.to.objects.get(name__iexact=value)
-            except field.rel.to.DoesNotExist:
-                if issubclass(field.rel.to, CreatableFromString):
-                    value = field.rel.to.create_from_string(
-                        asset_type=MODE2ASSET_TYPE[self.mode],
-                        s=value
-                    )
-                    value.save()
-                else:
-                    raise
-        return value
 
-    @transaction.commit_on_success
-    def done(self, form_list):
-        mappings = self.storage.data['mappings']
-        names_per_sheet, update_per_sheet, add_per_sheet =\
-            self.get_cleaned_data_for_step('upload')['file']
-        failed_assets = []
-        errors = {}
-        model = self.get_cleaned_data_for_step('upload')['model']
-        self.Model = get_model_by_name(model)
-        if model == 'ralph_assets.asset':
-            amd_field, amd_model = get_amendment_model(self.mode)
-            self.AmdModel = get_model_by_name(amd_model)
-        else:
-            amd_field = amd_model = self.AmdModel = None
-        for sheet_name, sheet_data in update_per_sheet.items():
-            for asset_id, asset_data in sheet_data.items():
-                try:
-                    asset = self.Model.objects.get(pk=asset_id)
-                except ObjectDoesNotExist:
-                    failed_assets.append(asset_id)
-                    continue
-                try:
-                    for key, value in asset_data.items():
-                        setattr(
-                            asset, mappings[key],
-                            self._get_field_value(mappings[key], value)
-                        )
-                    asset.save()
-                except Exception as exc:
-                    errors[asset_id] = repr(exc)
-        for sheet_name, sheet_data in add_per_sheet.items():
-            for asset_data in sheet_data:
-                try:
-                    kwargs = {}
-                    amd_kwargs = {}
-                    for key, value in asset_data.items():
-                        field_name = mappings.get(slugify(key))
-                        if field_name is None:
-                            continue
-                        value = self._get_field_value(field_name, value)
-                        if field_name.startswith(amd_field + '.'):
-                            _, field_name = field_name.split('.', 1)
-                            amd_kwargs[field_name] = value
-                        else:
-                            kwargs[field_name] = value
-                    asset = self.Model(**kwargs)
-                    if self.AmdModel is not None:
-                        amd_model_object = self.AmdModel(**amd_kwargs)
-                        amd_model_object.save()
-                        setattr(asset, amd_field, amd_model_object)
-                    if isinstance(asset, Asset):
-                        asset.type = MODE2ASSET_TYPE[self.mode]
-                    else:
-                        asset.asset_type = MODE2ASSET_TYPE[self.mode]
-                    asset.save()
-                except Exception as exc:
-                    errors[tuple(asset_data.values())] = repr(exc)
-        ctx_data = self.get_context_data(None)
-        ctx_data['failed_assets'] = failed_assets
-        ctx_data['errors'] = errors
-        return render(
-            self.request,
-            'assets/xls_upload_wizard_done.html',
-            ctx_data
+class ImportJobView(AssetsBase):
+    """The progress and the results of an import started with the wizard.
+
+    Polled with ``?format=json`` while the import runs, ``?format=csv``
+    downloads the errors. POST resumes an interrupted import.
+    """
+
+    template_name = 'assets/xls_upload_wizard_done.html'
+    sidebar_selected = 'xls upload'
+    errors_shown = 100
+
+    def dispatch(self, request, mode=None, job_id=None, *args, **kwargs):
+        jobs = ImportJob.objects.all()
+        if not request.user.is_superuser:
+            jobs = jobs.filter(created_by=request.user)
+        self.job = get_object_or_404(jobs, pk=job_id)
+        return super(ImportJobView, self).dispatch(
+            request, mode, *args, **kwargs
         )
 
+    def get_context_data(self, **kwargs):
+        ret = super(ImportJobView, self).get_context_data(**kwargs)
+        ret.update({
+            'job': self.job,
+            'progress': int(self.job.progress * 100),
+            'errors': self.job.errors.all()[:self.errors_shown],
+            'errors_count': self.job.errors.count(),
+            'can_resume': can_resume_import_job(self.job),
+        })
+        return ret
+
+    def get_errors_response(self):
+        response = HttpResponse(
+            _iterate_csv(
+                ['row', 'key', 'message'],
+                (
+                    (row + 1, key, message)
+                    for row, key, message in self.job.errors.values_list(
+                        'row', 'key', 'message',
+                    ).iterator()
+                ),
+            ),
+            content_type='application/csv',
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename=import-{}-errors.csv'.format(self.job.id)
+        )
+        return response
+
+    def get(self, *args, **kwargs):
+        export = self.request.GET.get('format')
+        if export == 'json':
+            return HttpResponse(json.dumps({
+                'progress': int(self.job.progress * 100),
+                'finished': self.job.is_done,
+            }), content_type='application/json')
+        if export == 'csv':
+            return self.get_errors_response()
+        return super(ImportJobView, self).get(*args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        if can_resume_import_job(self.job):
+            enqueue_import_job(self.job)
+            messages.success(self.request, _("Import resumed."))
+        return HttpResponseRedirect(self.request.path)
+
 
 class LicenceFormView(AssetsBase):
     """Base view that displays licence form."""
@@ -1741,29 +1790,76 @@ class LicenceList(AssetsBase):
 
     template_name = "assets/licence_list.html"
 
-    def get_context_data(self, *args, **kwargs):
-        data = super(LicenceList, self).get_context_data(
-            *args, **kwargs
+    def get_licences_query(self):
+        """Returns the filter of the licences matching the ``q`` parameter
+        (by software category name, SN or inventory number)."""
+        query = self.request.GET.get('q', '').strip()
+        if not query:
+            return None
+        return (
+            Q(software_category__name__icontains=query) |
+            Q(sn__icontains=query) |
+            Q(niw__icontains=query)
         )
+
+    def get_categories(self):
+        """Returns the page of software categories requested, with their
+        ``licences_annotated`` and the sums of ``used`` and ``total`` licences.
+        """
         page = self.request.GET.get('page', 1)
-        categories = SoftwareCategory.objects.annotate(
-            used=Count('licence__assets'),
-        )
+        categories = SoftwareCategory.objects.order_by('name', 'id')
         if self.mode:
             categories = categories.filter(
                 asset_type=MODE2ASSET_TYPE[self.mode]
             )
+        licences_query = self.get_licences_query()
+        if licences_query is not None:
+            categories = categories.filter(
+                id__in=Licence.objects.filter(licences_query).values(
+                    'software_category',
+                ),
+            )
         categories_page = Paginator(
             categories, LICENCE_PAGE_SIZE
         ).page(page)
+        # the licences of all categories of the page, with their used counts,
+        # in one grouped query; the categories sum them up
+        licences = Licence.objects.filter(
+            software_category__in=[
+                category.id for category in categories_page
+            ],
+        ).annotate(used=Count('assets')).order_by('id')
+        if licences_query is not None:
+            licences = licences.filter(licences_query)
+        licences_per_category = {}
+        for licence in licences:
+            licences_per_category.setdefault(
+                licence.software_category_id, [],
+            ).append(licence)
         for category in categories_page:
-            category.licences_annotated = \
-                category.licence_set.annotate(used=Count('assets')).all()
+            category.licences_annotated = licences_per_category.get(
+                category.id, [],
+            )
+            for licence in category.licences_annotated:
+                licence.software_category = category
+            category.used = sum(
+                licence.used for licence in category.licences_annotated
+            )
             category.total = sum(
                 licence.number_bought
                 for licence in category.licences_annotated
             )
-        data['categories'] = categories_page
+        return categories_page
+
+    def get_context_data(self, *args, **kwargs):
+        data = super(LicenceList, self).get_context_data(
+            *args, **kwargs
+        )
+        data.update({
+            'categories': self.get_categories(),
+            'licence_search': self.request.GET.get('q', ''),
+            'url_query': self.request.GET,
+        })
         return data
 
 
@@ -1802,15 +1898,7 @@ class InvoiceReport(_AssetSearch):
         )
 
     def get_return_link(self, *args, **kwargs):
-        if self.ids:
-            url = "{}search?id={}".format(
-                _get_return_link(self.mode), ",".join(id for id in self.ids),
-            )
-        else:
-            url = "{}search?{}".format(
-                _get_return_link(self.mode), self.request.GET.urlencode(),
-            )
-        return url
+        return _get_selected_return_link(self.mode, self.request)
 
     def get(self, *args, **kwargs):
         if not settings.ASSETS_REPORTS['ENABLE']:
@@ -1824,14 +1912,7 @@ class InvoiceReport(_AssetSearch):
         except ReportOdtSource.DoesNotExist:
             messages.error(self.request, _("Odt template does not exist!"))
             error = True
-        self.ids = self.request.GET.getlist('select')
-        if self.request.GET.get('from_query'):
-            all_q = super(
-                InvoiceReport, self,
-            ).handle_search_data(*args, **kwargs)
-        else:
-            all_q = Q(pk__in=self.ids)
-        self.assets = self.get_all_items(all_q)
+        self.assets = self.get_all_items(_get_selected_query(self.request))
         asset_distinct = self.assets.values(
             'invoice_no', 'invoice_date', 'provider'
         ).distinct()
@@ -1846,48 +1927,41 @@ class InvoiceReport(_AssetSearch):
         if error:
             return HttpResponseRedirect(self.get_return_link())
         # generate invoice report
-        pdf_data = self.get_pdf_content()
-        if not pdf_data:
+        pdf_file = self.get_pdf_file()
+        if not pdf_file:
             return HttpResponseRedirect(self.get_return_link())
         response = HttpResponse(
-            content=pdf_data, content_type='application/pdf'
+            FileWrapper(pdf_file), content_type='application/pdf'
         )
+        response['Content-Length'] = os.fstat(pdf_file.fileno()).st_size
         response['Content-Disposition'] = 'attachment; filename="{}"'.format(
             self.file_name,
         )
         return response
 
-    def get_pdf_content(self, *args, **kwargs):
-        content = None
+    def get_pdf_file(self, *args, **kwargs):
+        pdf_file = None
         data = self.get_report_data()
         self.file_name = '{}-{}-{}.pdf'.format(
             self.template_file.slug,
             data['id'],
             uuid.uuid4(),
         )
-        output_path = '{}{}'.format(
-            settings.ASSETS_REPORTS['TEMP_STORAGE_PATH'],
-            self.file_name,
-        )
-        generate_pdf(
-            self.template_file.template.path,
-            output_path,
-            data,
-        )
         try:
-            with open(output_path, 'rb') as f:
-                content = f.read()
-                f.close()
-        except IOError as e:
+            output_path = render_report(
+                self.template_file, self.file_name, data,
+            )
+            pdf_file = open_report(output_path)
+        except (IOError, OSError, ReportError) as e:
             logger.error(
-                "Can not read report for assets ids: {} ({})".format(
-                    ",".join(id for id in self.ids), e,
+                "Can not read report for assets: {} ({})".format(
+                    self.request.GET.urlencode(), e,
                 )
             )
             messages.error(self.request, _(
                 "The error occurred, was not possible to read generated file."
             ))
-        return content
+        return pdf_file
 
     def get_report_data(self, *args, **kwargs):
         first_asset = self.assets[0]
@@ -1929,11 +2003,15 @@ class AddAttachment(AssetsBase):
         })
         return ret
 
+    def get_selected_parents(self):
+        if self.Parent is Asset:
+            query = _get_selected_query(self.request)
+        else:
+            query = Q(pk__in=self.request.GET.getlist('select'))
+        return self.Parent.objects.filter(query)
+
     def get(self, *args, **kwargs):
-        url_parents_ids = self.request.GET.getlist('select')
-        self.selected_parents = self.Parent.objects.filter(
-            pk__in=url_parents_ids,
-        )
+        self.selected_parents = self.get_selected_parents()
         if not self.selected_parents.exists():
             messages.warning(self.request, _("Nothing to edit."))
             return HttpResponseRedirect(_get_return_link(self.mode))
@@ -1945,10 +2023,7 @@ class AddAttachment(AssetsBase):
         return super(AddAttachment, self).get(*args, **kwargs)
 
     def post(self, *args, **kwargs):
-        url_parents_ids = self.request.GET.getlist('select')
-        self.selected_parents = self.Parent.objects.filter(
-            id__in=url_parents_ids,
-        )
+        self.selected_parents = self.get_selected_parents()
         AttachmentFormset = formset_factory(
             form=AttachmentForm, extra=0,
         )
@@ -6,19 +6,35 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import json
+import os
 import uuid
 
+import django_rq
 from django.conf import settings
 from django.contrib import messages
-from django.db.models import Q, Count
-from django.http import HttpResponseRedirect
+from django.contrib.auth.models import User
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.utils.translation import ugettext_lazy as _
-from inkpy.api import generate_pdf
 from lck.django.common import nested_commit_on_success
 
+from ralph_assets.bulk_edit import group_changes, update_instances
 from ralph_assets.forms_transitions import TransitionForm
-from ralph_assets.views import _AssetSearch, _get_return_link
-from ralph_assets.models import ReportOdtSource, Transition, TransitionsHistory
+from ralph_assets.lookups import get_lookup_cache
+from ralph_assets.models_assets import Asset, Warehouse
+from ralph_assets.models_history import bulk_history
+from ralph_assets.models_selection import AssetSelection
+from ralph_assets.reports import render_report
+from ralph_assets.views import (
+    _AssetSearch,
+    _get_selected_query,
+    _get_selected_return_link,
+)
+from ralph_assets.models import (
+    ReportOdtSource,
+    Transition,
+    TransitionsHistory,
+)
 
 
 class TransitionDispatcher(object):
@@ -29,6 +45,10 @@ class TransitionDispatcher(object):
     - change_status - change assets status to definied in Transition.
     - release_report - generate release assets report file.
     - return_report - generate return assets report file.
+
+    Actions changing the assets only set their fields. The changes of all
+    actions are written together by ``_update_assets``, with one ``UPDATE``
+    per group of assets with identical changes and history saved in bulk.
     """
 
     def __init__(
@@ -43,32 +63,40 @@ class TransitionDispatcher(object):
     ):
         self.instance = instance
         self.transition = transition
-        self.assets = assets
+        self.assets = list(assets)
         self.logged_user = logged_user
         self.affected_user = affected_user
         self.template_file = template_file
         self.warehouse = warehouse
         self.report_file_patch = None
+        self.transition_history = None
 
     def _action_assign_user(self):
         for asset in self.assets:
             asset.user = self.affected_user
-            asset.save()
 
     def _action_unassign_user(self):
         for asset in self.assets:
             asset.user = None
-            asset.save()
 
     def _action_assign_warehouse(self):
         for asset in self.assets:
             asset.warehouse = self.warehouse
-            asset.save()
 
     def _action_change_status(self):
         for asset in self.assets:
             asset.status = self.transition.to_status
-            asset.save()
+
+    def _update_assets(self):
+        for asset in self.assets:
+            asset.update_computed_fields()
+        with bulk_history():
+            for changes, assets in group_changes(
+                self.assets, lambda asset: asset,
+            ).iteritems():
+                update_instances(
+                    Asset, assets, changes, self.logged_user, 'asset',
+                )
 
     def _get_report_data(self):
         uid = uuid.uuid4()
@@ -87,16 +115,9 @@ class TransitionDispatcher(object):
             self.template_file.slug,
             data['id'],
         )
-        output_path = '{}{}'.format(
-            settings.ASSETS_REPORTS['TEMP_STORAGE_PATH'],
-            self.file_name,
+        self.report_file_patch = render_report(
+            self.template_file, self.file_name, data,
         )
-        generate_pdf(
-            self.template_file.template.path,
-            output_path,
-            data,
-        )
-        self.report_file_patch = output_path
 
     def _action_release_report(self):
         self._generate_report()
@@ -124,8 +145,24 @@ class TransitionDispatcher(object):
     def get_report_file_name(self):
         return self.file_name
 
-    @nested_commit_on_success
+    def _remove_report(self):
+        if self.transition_history and self.transition_history.report_file:
+            self.transition_history.report_file.delete(save=False)
+        elif self.report_file_patch and os.path.exists(
+            self.report_file_patch,
+        ):
+            os.remove(self.report_file_patch)
+
     def run(self):
+        try:
+            self._run()
+        except Exception:
+            # the changes are rolled back, the report mustn't outlive them
+            self._remove_report()
+            raise
+
+    @nested_commit_on_success
+    def _run(self):
         self.file_name = None
         actions = self.transition.actions_names()
         if 'change_status' in actions:
@@ -136,28 +173,58 @@ class TransitionDispatcher(object):
             self._action_unassign_user()
         if 'assign_warehouse' in actions:
             self._action_assign_warehouse()
+        self._update_assets()
         if 'release_report' in actions:
             self._action_release_report()
         elif 'return_report' in actions:
             self._action_return_report()
         self._save_history()
+        # the updates bypassed post_save signals
+        get_lookup_cache().invalidate(Asset)
+
+
+def run_transition(
+    transition_id,
+    selection_token,
+    logged_user_id,
+    affected_user_id,
+    template_file_id,
+    warehouse_id=None,
+):
+    """Runs the transition *transition_id* of the assets of the selection
+    *selection_token*, which is deleted afterwards. Returns the id of the
+    saved ``TransitionsHistory``. Called by the rq workers, the arguments are
+    ids so the job can be pickled."""
+    assets = Asset.objects.filter(
+        selections__token=selection_token,
+    ).select_related('user')
+    dispatcher = TransitionDispatcher(
+        None,
+        Transition.objects.get(pk=transition_id),
+        assets,
+        User.objects.get(pk=logged_user_id),
+        User.objects.get(pk=affected_user_id) if affected_user_id else None,
+        ReportOdtSource.objects.get(pk=template_file_id),
+        Warehouse.objects.get(pk=warehouse_id) if warehouse_id else None,
+    )
+    dispatcher.run()
+    AssetSelection.objects.filter(token=selection_token).delete()
+    return dispatcher.get_transition_history_object().id
+
+
+RUN_TRANSITION_FUNC = '{}.{}'.format(
+    run_transition.__module__, run_transition.__name__,
+)
 
 
 class TransitionView(_AssetSearch):
     template_name = 'assets/transitions.html'
     report_file_path = None
     transition_history = None
+    job = None
 
     def get_return_link(self, *args, **kwargs):
-        if self.ids:
-            url = "{}search?id={}".format(
-                _get_return_link(self.mode), ",".join(self.ids),
-            )
-        else:
-            url = "{}search?{}".format(
-                _get_return_link(self.mode), self.request.GET.urlencode(),
-            )
-        return url
+        return _get_selected_return_link(self.mode, self.request)
 
     def get_transition_object(self, *args, **kwargs):
         try:
@@ -179,26 +246,18 @@ class TransitionView(_AssetSearch):
         return form
 
     def get_assets(self, *args, **kwargs):
-        if self.request.GET.get('from_query'):
-            all_q = super(
-                TransitionView, self,
-            ).handle_search_data(*args, **kwargs)
-            self.ids = None
-        else:
-            self.ids = self.request.GET.getlist('select')
-            all_q = Q(pk__in=self.ids)
-        return self.get_all_items(all_q)
+        return self.get_all_items(_get_selected_query(self.request))
 
     def get_warehouse(self, *args, **kwargs):
         if 'assign_warehouse' in self.transition_object.actions_names():
             return self.form.cleaned_data.get('warehouse')
 
-    def get_affected_user(self, *args, **kwargs):
+    def get_affected_user_id(self, *args, **kwargs):
         if 'return-asset' in self.transition_object.name:
-            affected_user = self.assets[0].user
-        else:
-            affected_user = self.form.cleaned_data.get('user')
-        return affected_user
+            # checked to be the only user of the assets by the error handler
+            return self.assets_user_id
+        affected_user = self.form.cleaned_data.get('user')
+        return affected_user.id if affected_user else None
 
     def get_report_file_link(self, *args, **kwargs):
         if self.transition_history:
@@ -240,27 +299,33 @@ class TransitionView(_AssetSearch):
             self.assign_warehouse = (
                 'assign_warehouse' in self.transition_object.actions_names()
             )
+        self.assets_user_id = None
         if self.transition_type == 'return-asset':
-            assets = self.assets.values('user__username').distinct()
-            assets_count = assets.annotate(cnt=Count('user')).count()
-            if assets_count not in (0, 1):
+            users = list(
+                self.assets.order_by().values_list(
+                    'user', 'user__username',
+                ).distinct()
+            )
+            if len(users) > 1:
                 messages.error(
                     self.request,
                     _(
                         'Asset has different user: {}'.format(
                             ", ".join(
-                                asset['user__username'] or 'unassigned'
-                                for asset in assets,
+                                username or 'unassigned'
+                                for user_id, username in users
                             )
                         )
                     ),
                 )
                 error = True
-            elif not assets[0]['user__username']:
+            elif not users or users[0][0] is None:
                 messages.error(
                     self.request, _('Asset has no assigned user'),
                 )
                 error = True
+            else:
+                self.assets_user_id = users[0][0]
         return error
 
     def post_error_handler(self, *args, **kwargs):
@@ -269,7 +334,31 @@ class TransitionView(_AssetSearch):
             error = self.check_reports_template_exists()
         return error
 
+    def get_job_response(self, job_id):
+        """Returns the status of the queued transition *job_id* as JSON."""
+        job = django_rq.get_queue(
+            settings.ASSETS_TRANSITIONS.get('QUEUE', 'reports'),
+        ).fetch_job(job_id)
+        # the queue is shared with exports, imports and reports
+        if job is None or job.func_name != RUN_TRANSITION_FUNC:
+            raise Http404()
+        result = {
+            'finished': job.is_finished,
+            'failed': job.is_failed,
+            'report_link': None,
+        }
+        if job.is_finished:
+            self.transition_history = TransitionsHistory.objects.get(
+                pk=job.result,
+            )
+            result['report_link'] = self.get_report_file_link()
+        return HttpResponse(
+            json.dumps(result), content_type='application/json',
+        )
+
     def get(self, *args, **kwargs):
+        if self.request.GET.get('transition_job'):
+            return self.get_job_response(self.request.GET['transition_job'])
         self.report_file_name = None
         self.assets = self.get_assets()
         errors = self.base_error_handler()
@@ -284,23 +373,35 @@ class TransitionView(_AssetSearch):
         errors = self.post_error_handler()
         self.form = self.get_transition_form()
         if self.form.is_valid() and not errors:
-            dispatcher = TransitionDispatcher(
-                self,
-                self.transition_object,
-                self.assets,
-                self.request.user,
-                self.get_affected_user(),
-                self.template_file,
-                self.get_warehouse(),
+            affected_user_id = self.get_affected_user_id()
+            warehouse = self.get_warehouse()
+            selection = AssetSelection.from_queryset(
+                self.assets, self.request.user,
             )
-            dispatcher.run()
-            self.report_file_path = dispatcher.report_file_patch
-            self.report_file_name = dispatcher.get_report_file_name
-            self.transition_history = dispatcher.get_transition_history_object()  # noqa
-            messages.success(
-                self.request,
-                _("Transitions performed successfully"),
+            job_args = (
+                self.transition_object.id,
+                selection.token,
+                self.request.user.id,
+                affected_user_id,
+                self.template_file.id,
+                warehouse.id if warehouse else None,
             )
+            options = settings.ASSETS_TRANSITIONS
+            queue = options.get('QUEUE', 'reports')
+            if queue:
+                self.job = django_rq.get_queue(queue).enqueue_call(
+                    func=run_transition, args=job_args,
+                    timeout=options.get('TIMEOUT', 600),
+                ).id
+                messages.info(self.request, _("Transition queued"))
+            else:
+                self.transition_history = TransitionsHistory.objects.get(
+                    pk=run_transition(*job_args),
+                )
+                messages.success(
+                    self.request,
+                    _("Transitions performed successfully"),
+                )
             return super(TransitionView, self).get(*args, **kwargs)
         messages.error(self.request, _('Please correct errors.'))
         return super(TransitionView, self).get(*args, **kwargs)
@@ -309,6 +410,7 @@ class TransitionView(_AssetSearch):
         ret = super(TransitionView, self).get_context_data(**kwargs)
         ret.update({
             'report_link': self.get_report_file_link(),
+            'transition_job': self.job,
             'assets': self.assets,
             'transition_form': self.form,
             'transition_type': self.transition_type.replace('-', ' ').title(),